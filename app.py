@@ -1,8 +1,32 @@
+import argparse
+import functools
+import gzip
+import json
 import os
-from typing import List
-from pythainlp import tokenize
-from flask import Flask, request, render_template, send_from_directory, jsonify, Blueprint
-import pandas as pd
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from flask import Flask, request, render_template, send_from_directory, jsonify, Blueprint, Response, \
+    stream_with_context
+from werkzeug.security import safe_join
+import numpy as np
+
+import basic_rag
+import corpus_format
+import fuzzy_terms
+import search_index
+import semantic_index
+from corpus_store import Corpus, CorpusStore
+from engine_registry import registry
+from page_images import CACHE_DIR, FORMATS, SIZES, PageImageCache
+from query_cache import QueryCache
+
+try:
+    import brotli  # optional, gzip is used without it
+except ImportError:
+    brotli = None
 
 bp = Blueprint('docsearch', __name__, template_folder='templates')
 
@@ -13,6 +37,30 @@ THA = "tha"
 
 VERBOSE = False
 
+TITLE_BOOST = 2.0  # weight of a filename match relative to a page text match
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+RAG_PAGES = 5  # pages retrieved as context for /ask
+RAG_CONTEXT_TOKENS = 3000  # estimated token budget of that context
+CHARS_PER_TOKEN = 3  # mostly Thai text, roughly 3 characters per token
+RAG_SYSTEM_PROMPT = ("You answer questions about the university's documents using only the context pages given. "
+                     "Answer in the language of the question and cite the [filename p.N] of every page you use. "
+                     "If the context does not contain the answer, say so.")
+SNIPPET_CHARS = 160
+SNIPPET_LEAD = 40  # characters of context before the first matched term
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPARE_LIMIT = 20  # top hits listed per condition by /search_compare
+HYBRID_ALPHA = 0.5  # weight of the vector score against the normalized BM25 score in hybrid semantic search
+MAX_FUZZY_EXPANSIONS = 20  # bound on the max_expansions a /search?fuzzy=true request may ask for per term
+PDF_DIR = "pdf"  # relative to the app, as send_from_directory resolves them
+IMG_DIR = "img"
+FETCH_MAX_AGE = 3600  # seconds browsers and proxies reuse a fetched file before revalidating it
+PRE_RENDERED_NAME = re.compile(r"^(?P<filename>.+)_(?P<number>\d{3,})\.png$")  # {pdf}_{page + 1:03}.png
+
+CONDITIONS = [(TESSERACT, THA_ENG), (TESSERACT, THA), (EASYOCR, THA_ENG), (EASYOCR, THA)]
+
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 def print_verbose(*args, **kwargs):
@@ -21,55 +69,561 @@ def print_verbose(*args, **kwargs):
 
 
 def get_text_location(ocr_engine: str, lang: str) -> str:
-    return os.path.join(script_dir, "text", f"summary_{ocr_engine}_{lang}.csv")
+    return corpus_format.preferred_location(os.path.join(script_dir, "text", f"summary_{ocr_engine}_{lang}.csv"))
 
 
-def _search(query: str, text: pd.DataFrame, title_only: bool, use_tokenizer: bool) -> pd.DataFrame:
-    if not use_tokenizer:
-        if title_only:
-            return text[query in text["filename"]]
+corpus_store = CorpusStore()
+# ranked matches per (corpus, normalized query, options), dropped when the corpus file changes
+query_cache = QueryCache()
+# one thread per condition, so search_compare evaluates the corpora concurrently
+compare_executor = ThreadPoolExecutor(max_workers=len(CONDITIONS), thread_name_prefix="compare")
+
+
+def get_corpus(ocr_engine: str, lang: str) -> Corpus:
+    # both end up in a file path, never build one from anything but a known condition
+    if (ocr_engine, lang) not in CONDITIONS:
+        raise ValueError(f"unknown condition: {ocr_engine}:{lang}")
+    return corpus_store.get(get_text_location(ocr_engine, lang))
+
+
+embedding_store = semantic_index.EmbeddingStore()
+fuzzy_store = fuzzy_terms.FuzzyStore()
+# page images rendered from the PDFs on demand, for /fetch
+page_images = PageImageCache(os.path.join(script_dir, CACHE_DIR))
+ask_stats = basic_rag.ChatStats()
+
+
+def get_semantic_corpus() -> Corpus:
+    """The cleaned corpus, the only one with a vector_context to embed."""
+    return corpus_store.get(corpus_format.preferred_location(os.path.join(script_dir, semantic_index.DEFAULT_CORPUS)))
+
+
+def preload_corpora():
+    corpus_store.preload(get_text_location(engine, lang) for engine, lang in CONDITIONS)
+
+
+def warm_up():
+    """
+    Loads what the first requests would otherwise wait for: the corpora with their indexes, the Thai tokenizer
+    dictionary and the normalizer fuzzy matching uses. Call it once per worker before it takes requests, e.g. from gunicorn's post_worker_init hook;
+    the seconds each part took are reported under "startup" in /stats.
+    """
+    with registry.timed("corpora"):
+        preload_corpora()
+    with registry.timed("tokenizer"):
+        registry.warm(search_index.THAI_TOKENIZER, fuzzy_terms.THAI_NORMALIZER)
+
+
+def _fields(corpus: Corpus, aggregate: bool) -> Tuple[search_index.PostingSource, search_index.PostingSource]:
+    """The (text, title) indexes to search: per page, or per document when aggregating."""
+    if aggregate:
+        return corpus.documents.text_index, corpus.documents.title_index
+    return corpus.text_index, corpus.title_index
+
+
+def _match_indexed(terms: List[str], corpus: Corpus, title_only: bool, aggregate: bool = False) -> np.ndarray:
+    text_index, title_index = _fields(corpus, aggregate)
+    if title_only:
+        return title_index.match_all(terms)
+    # a term may occur in either the filename or the page text, as with the old filename + text concatenation
+    return search_index.match_all_fields([text_index, title_index], terms)
+
+
+def _match_expanded(expansions: List[Tuple[str, List[Tuple[str, int]]]], corpus: Corpus, title_only: bool,
+                    aggregate: bool = False) -> np.ndarray:
+    """_match_indexed() where each query term matches through any of its fuzzy alternatives."""
+    text_index, title_index = _fields(corpus, aggregate)
+    groups = [[term for term, _ in alternatives] for _, alternatives in expansions]
+    return search_index.match_groups([title_index] if title_only else [text_index, title_index], groups)
+
+
+def _substring_rows(query: str, corpus: Corpus, column: str) -> np.ndarray:
+    """Sorted row ids whose column contains query verbatim: the candidates of its trigram index, verified."""
+    return (corpus.title_index if column == "filename" else corpus.text_index).raw_rows(query)
+
+
+def _match_substring(query: str, corpus: Corpus, title_only: bool) -> np.ndarray:
+    """
+    Sorted row ids whose filename (or, unless title_only, page text) contains query verbatim, whatever the word
+    segmentation, without scanning every page.
+    """
+    rows = _substring_rows(query, corpus, "filename")
+    if title_only:
+        return rows
+    return np.union1d(rows, _substring_rows(query, corpus, "text")).astype(np.int32)
+
+
+def _score_indexed(terms: List[str], corpus: Corpus, title_only: bool, aggregate: bool = False) -> np.ndarray:
+    text_index, title_index = _fields(corpus, aggregate)
+    if title_only:
+        return title_index.bm25(terms)
+    return text_index.bm25(terms) + TITLE_BOOST * title_index.bm25(terms)
+
+
+def _score_expanded(expansions: List[Tuple[str, List[Tuple[str, int]]]], corpus: Corpus, title_only: bool,
+                    aggregate: bool = False) -> np.ndarray:
+    """_score_indexed() crediting each query term with its best alternative, discounted by its edit distance."""
+    text_index, title_index = _fields(corpus, aggregate)
+    groups = [[(term, fuzzy_terms.distance_weight(distance)) for term, distance in alternatives]
+              for _, alternatives in expansions]
+    if title_only:
+        return title_index.bm25_groups(groups)
+    return text_index.bm25_groups(groups) + TITLE_BOOST * title_index.bm25_groups(groups)
+
+
+def _snippet(text: str, anchor: int, terms: List[str]) -> Tuple[str, List[List[int]]]:
+    """
+    SNIPPET_CHARS of text starting a little before anchor (the first matched term, -1 for none) and the
+    [start, end) character ranges of the terms inside it. Only the window is searched, never the whole text.
+    """
+    start = max(anchor - SNIPPET_LEAD, 0) if anchor >= 0 else 0
+    end = min(start + SNIPPET_CHARS, len(text))
+    prefix = "…" if start > 0 else ""
+    snippet = prefix + text[start:end] + ("…" if end < len(text) else "")
+    ranges = []
+    for term in terms:
+        at = snippet.find(term, len(prefix))
+        while at >= 0:
+            ranges.append([at, at + len(term)])
+            at = snippet.find(term, at + len(term))
+    highlights: List[List[int]] = []
+    for at, until in sorted(ranges):
+        if highlights and at <= highlights[-1][1]:
+            highlights[-1][1] = max(highlights[-1][1], until)
         else:
-            return text[query in text["text"]]
+            highlights.append([at, until])
+    return snippet, highlights
+
+
+def _page_hits(corpus: Corpus, rows: np.ndarray, scores: Optional[np.ndarray], terms: List[str],
+               full_text: bool = False, substring: bool = False) -> List[dict]:
+    """
+    The result schema of a page: its document id, location, score and a highlighted snippet around the first
+    matched term, found through the term positions stored in the text index. With substring the single term is
+    a raw query, located within the hit pages themselves. full_text adds the page text.
+    """
+    terms = [t for t in terms if t] if substring else search_index.query_terms(terms)
+    found = corpus.frame.iloc[rows]
+    texts = found["text"].fillna("").astype(str).tolist()
+    if substring:
+        anchors = np.array([text.find(terms[0]) if terms else -1 for text in texts], dtype=np.int64)
     else:
-        terms: List[str] = tokenize.word_tokenize(query)
-        if title_only:
-            return text[text["filename"].apply(lambda s: all(term in str(s) for term in terms))]
-        else:
-            for index, row in text.iterrows():
-                if type(row['text']) != str:
-                    print_verbose(index, type(row['text']))
-            return text[(text["filename"].apply(lambda s: all(term in str(s) for term in terms))) |
-                        (text["text"].apply(lambda s: all(term in str(s) for term in terms)))]
+        anchors = np.full(len(rows), -1, dtype=np.int64)
+        for term in terms:
+            position = corpus.text_index.first_position(term, rows)
+            anchors = np.where((position >= 0) & ((anchors < 0) | (position < anchors)), position, anchors)
+    filenames, relative_paths = found["filename"].astype(str).tolist(), found["relative_path"].astype(str).tolist()
+    pages = found["page"].to_numpy()
+    hits = []
+    for i, row in enumerate(rows):
+        text = texts[i]
+        snippet, highlights = _snippet(text, int(anchors[i]), terms)
+        hit = {
+            "doc_id": int(corpus.documents.doc_ids[row]),
+            "filename": filenames[i],
+            "relative_path": relative_paths[i],
+            "page": int(pages[i]),
+            "score": float(scores[i]) if scores is not None else None,
+            "snippet": snippet,
+            "highlights": highlights,
+        }
+        if full_text:
+            hit["text"] = text
+        hits.append(hit)
+    return hits
+
+
+def _document_hits(corpus: Corpus, docs: np.ndarray, scores: Optional[np.ndarray], terms: List[str],
+                   full_text: bool = False, substring: bool = False) -> List[dict]:
+    """
+    Hits for the given document ids: the pages whose text contains any of the terms (the raw query, with
+    substring), with the snippet of the first of them. full_text adds the document's pages joined; only the
+    returned documents are joined.
+    """
+    documents = corpus.documents
+    if substring:
+        hit_rows = _substring_rows(terms[0], corpus, "text")
+    else:
+        hit_rows = np.unique(np.concatenate(
+            [corpus.text_index.lookup(t) for t in search_index.query_terms(terms)] or [np.empty(0, dtype=np.int32)]))
+    page_numbers = corpus.frame["page"].to_numpy()
+    texts = corpus.frame["text"]
+    matched = [r[np.isin(r, hit_rows)] for r in map(documents.pages_of, docs)]
+    first_rows = np.array([m[0] if len(m) else documents.pages_of(d)[0] for d, m in zip(docs, matched)],
+                          dtype=np.int32)
+    hits = _page_hits(corpus, first_rows, scores, terms, substring=substring)
+    for hit, d, m in zip(hits, docs, matched):
+        hit["n_pages"] = int(documents.frame["n_pages"].iat[d])
+        hit["matched_pages"] = page_numbers[m].tolist()
+        if full_text:
+            hit["text"] = " ".join(texts.iloc[documents.pages_of(d)].fillna("").astype(str))
+    return hits
+
+
+@functools.lru_cache(maxsize=4096)
+def tokenize_query(query: str) -> Tuple[str, ...]:
+    """word_tokenize memoized for queries, which repeat far more often than they change."""
+    return tuple(search_index.word_tokenize(" ".join(query.split())))
+
+
+@dataclass
+class Ranking:
+    """
+    Every match of a query, as row ids (document ids when aggregating) with their scores, or in corpus order
+    without scores for the substring search. Cached per normalized query, and sliced per requested page.
+    """
+    ids: np.ndarray
+    scores: Optional[np.ndarray]
+    total_files: int
+    # with fuzzy matching, each query term and the (term, edit distance) alternatives it was expanded to
+    expansions: Optional[List[Tuple[str, List[Tuple[str, int]]]]] = None
+
+    @property
+    def terms(self) -> Optional[List[str]]:
+        """Every term that could have matched, for highlighting, when it differs from the query's own."""
+        if self.expansions is None:
+            return None
+        return [term for _, alternatives in self.expansions for term, _ in alternatives]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.ids.nbytes + (self.scores.nbytes if self.scores is not None else 0))
+
+    def page(self, offset: int, limit: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.scores is None:
+            return self.ids[offset:offset + limit], None
+        best = search_index.top_k(self.scores, np.arange(len(self.ids)), offset, limit)
+        return self.ids[best], self.scores[best]
+
+
+def _rank(query: str, corpus: Corpus, title_only: bool, use_tokenizer: bool, aggregate: bool,
+          max_expansions: int = 0) -> Ranking:
+    documents = corpus.documents
+    if not use_tokenizer:
+        rows = _match_substring(query, corpus, title_only)
+        docs = np.unique(documents.doc_ids[rows])
+        return Ranking(docs, None, len(docs)) if aggregate else Ranking(rows, None, len(docs))
+    terms = list(tokenize_query(query))
+    expansions = None
+    if max_expansions:
+        expansions = fuzzy_terms.expand_terms(fuzzy_store.get(corpus), terms, max_expansions)
+        rows = _match_expanded(expansions, corpus, title_only, aggregate)
+        scores = _score_expanded(expansions, corpus, title_only, aggregate)
+    else:
+        rows = _match_indexed(terms, corpus, title_only, aggregate)
+        scores = _score_indexed(terms, corpus, title_only, aggregate)
+    total_files = len(rows) if aggregate else len(np.unique(documents.doc_ids[rows]))
+    return Ranking(rows, scores[rows], total_files, expansions)
+
+
+def _ranking(query: str, corpus: Corpus, title_only: bool, use_tokenizer: bool = True,
+             aggregate: bool = False, max_expansions: int = 0) -> Ranking:
+    """
+    _rank() through the query cache, keyed on the query's distinct terms and valid for this corpus version.
+    max_expansions > 0 also matches each term's closest vocabulary terms (tokenized queries only).
+    """
+    if use_tokenizer:
+        normalized = tuple(sorted(search_index.query_terms(tokenize_query(query))))
+    else:
+        normalized, max_expansions = query, 0
+    key = (corpus.filepath, normalized, title_only, use_tokenizer, aggregate, max_expansions)
+    ranking = query_cache.get(key, corpus.signature)
+    if ranking is None:
+        ranking = _rank(query, corpus, title_only, use_tokenizer, aggregate, max_expansions)
+        query_cache.put(key, corpus.signature, ranking, ranking.nbytes)
+    return ranking
+
+
+def _search_ranked(query: str, corpus: Corpus, title_only: bool, offset: int, limit: int,
+                   aggregate: bool = False, use_tokenizer: bool = True, full_text: bool = False,
+                   max_expansions: int = 0) -> Tuple[List[dict], Ranking]:
+    """
+    The hits of the requested slice of the matches, ranked by BM25 with their scores, and the whole ranking.
+    With aggregate the matches are documents instead of pages.
+    """
+    ranking = _ranking(query, corpus, title_only, use_tokenizer, aggregate, max_expansions)
+    best, scores = ranking.page(offset, limit)
+    terms = ranking.terms or (list(tokenize_query(query)) if use_tokenizer else [query])
+    if aggregate:
+        return _document_hits(corpus, best, scores, terms, full_text, not use_tokenizer), ranking
+    return _page_hits(corpus, best, scores, terms, full_text, not use_tokenizer), ranking
+
+
+def _page_response(hits: List[dict], total: int, total_files: int, offset: int, limit: int,
+                   expansions: Optional[List[Tuple[str, List[Tuple[str, int]]]]] = None):
+    body = {
+        "total": total,
+        "total_files": total_files,
+        "offset": offset,
+        "limit": limit,
+        "results": hits,
+    }
+    if expansions is not None:
+        body["expansions"] = [{"term": term, "alternatives": [{"term": t, "distance": d} for t, d in alternatives]}
+                              for term, alternatives in expansions]
+    return jsonify(body)
+
+
+def _missing_query():
+    return jsonify({"error": "the query parameter is required"}), 400
+
+
+def _unknown_condition(ocr_engine: str, lang: str):
+    known = ", ".join(f"{engine}:{condition_lang}" for engine, condition_lang in CONDITIONS)
+    return jsonify({"error": f"unknown ocr_engine and lang {ocr_engine}:{lang}, expected one of {known}"}), 400
+
+
+@bp.after_request
+def compress_response(response: Response) -> Response:
+    """
+    gzip, or brotli when the Brotli package is installed, for JSON responses the client accepts compressed.
+    Streamed responses such as /ask pass through untouched.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.mimetype != "application/json"
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and request.accept_encodings["br"]:
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        response.headers["Content-Encoding"] = "br"
+    elif request.accept_encodings["gzip"]:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
 
 
 @bp.route("/search")
 def search():
-    query: str = request.args.get('query')
+    query: str = request.args.get('query') or ""
+    if not query.strip():
+        return _missing_query()
     ocr_engine = (request.args.get('ocr_engine') or TESSERACT).lower()
     lang = (request.args.get('lang') or THA_ENG).lower()
-    text = pd.read_csv(get_text_location(ocr_engine, lang), dtype={"filename": "string", "text": "string"})
+    if (ocr_engine, lang) not in CONDITIONS:
+        return _unknown_condition(ocr_engine, lang)
+    corpus = get_corpus(ocr_engine, lang)
     title_only: bool = (request.args.get('title_only') or "false").lower() == "true"
     use_tokenizer: bool = (request.args.get('use_tokenizer') or "true").lower() == "true"
-    aggregate: bool = (request.args.get('aggregate') or "true").lower() == "false"
-    text['text'] = text['filename'].astype(str) + ' ' + text['text']
-    print_verbose(ocr_engine, lang, title_only, use_tokenizer, aggregate)
-    if aggregate:
-        text = text.groupby(['filename', 'relative_path']).agg({'text': lambda x: ' '.join(x)}).reset_index()
-        text['page'] = 0
+    aggregate: bool = (request.args.get('aggregate') or "false").lower() == "true"
+    offset: int = max(request.args.get('offset', 0, type=int), 0)
+    limit: int = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    full_text: bool = (request.args.get('full_text') or "false").lower() == "true"
+    fuzzy: bool = (request.args.get('fuzzy') or "false").lower() == "true"
+    max_expansions: int = 0
+    if fuzzy:
+        max_expansions = min(max(request.args.get('max_expansions', fuzzy_terms.MAX_EXPANSIONS, type=int), 1),
+                             MAX_FUZZY_EXPANSIONS)
+    print_verbose(ocr_engine, lang, title_only, use_tokenizer, aggregate, offset, limit, max_expansions)
+    hits, ranking = _search_ranked(query, corpus, title_only, offset, limit, aggregate, use_tokenizer, full_text,
+                                   max_expansions)
+    return _page_response(hits, len(ranking.ids), ranking.total_files, offset, limit, ranking.expansions)
+
+
+def _search_semantic(query: str, corpus: Corpus, embeddings: semantic_index.EmbeddingIndex, hybrid: bool,
+                     alpha: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scores of every row and the rows to rank: cosine similarity to the query, optionally fused with the page's
+    BM25 score scaled to [0, 1], in which case lexical matches without a vector are ranked too.
+    """
+    scores = embeddings.similarity(embedding_store.encode_query(query, embeddings.model_name))
+    rows = embeddings.rows
+    if hybrid:
+        lexical = _score_indexed(list(tokenize_query(query)), corpus, False)
+        peak = float(lexical.max()) if len(lexical) else 0.0
+        if peak > 0:
+            scores = alpha * scores + (1 - alpha) * (lexical / peak)
+            ranked = lexical > 0
+            ranked[rows] = True
+            rows = np.flatnonzero(ranked).astype(np.int32)
+    return scores, rows
+
+
+@bp.route("/semantic_search")
+def semantic_search():
+    query: str = request.args.get('query') or ""
+    if not query.strip():
+        return _missing_query()
+    hybrid: bool = (request.args.get('mode') or "hybrid").lower() == "hybrid"
+    alpha: float = min(max(request.args.get('alpha', HYBRID_ALPHA, type=float), 0.0), 1.0)
+    offset: int = max(request.args.get('offset', 0, type=int), 0)
+    limit: int = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    full_text: bool = (request.args.get('full_text') or "false").lower() == "true"
+    try:
+        corpus = get_semantic_corpus()
+    except FileNotFoundError:
+        return jsonify({"error": "no cleaned corpus yet, run cleanup_text.py and then semantic_index.py"}), 503
+    embeddings = embedding_store.get(corpus)
+    if embeddings is None:
+        return jsonify({"error": "no embeddings for this corpus yet, run semantic_index.py"}), 503
+    scores, rows = _search_semantic(query, corpus, embeddings, hybrid, alpha)
+    best = search_index.top_k(scores, rows, offset, limit)
+    hits = _page_hits(corpus, best, scores[best], list(tokenize_query(query)), full_text)
+    return _page_response(hits, len(rows), len(np.unique(corpus.documents.doc_ids[rows])), offset, limit)
 
-    return _search(query, text, title_only, use_tokenizer).to_json()
+
+def _rag_context(hits: List[dict], token_budget: int) -> Tuple[str, List[dict]]:
+    """The retrieved pages in rank order, as many as fit in token_budget, the last one cut to fit."""
+    parts, sources = [], []
+    budget = token_budget * CHARS_PER_TOKEN
+    for hit in hits:
+        if budget <= 0:
+            break
+        header = f"[{hit['filename']} p.{hit['page'] + 1}]\n"
+        text = hit["text"][:max(budget - len(header), 0)]
+        parts.append(header + text)
+        budget -= len(header) + len(text)
+        sources.append({key: hit[key] for key in ("doc_id", "filename", "relative_path", "page", "score")})
+    return "\n\n".join(parts), sources
+
+
+def _sse(data, event: str = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@bp.route("/ask")
+def ask():
+    """
+    Answers a question from the top matching pages, streamed as server-sent events: one "sources" event,
+    then a data event per token, then "done" with the timings (or "error").
+    """
+    start = time.perf_counter()
+    query: str = request.args.get('query') or ""
+    if not query.strip():
+        return _missing_query()
+    ocr_engine = (request.args.get('ocr_engine') or TESSERACT).lower()
+    lang = (request.args.get('lang') or THA_ENG).lower()
+    if (ocr_engine, lang) not in CONDITIONS:
+        return _unknown_condition(ocr_engine, lang)
+    pages: int = min(max(request.args.get('pages', RAG_PAGES, type=int), 1), 20)
+    hits, _ = _search_ranked(query, get_corpus(ocr_engine, lang), False, 0, pages, full_text=True)
+    context, sources = _rag_context(hits, RAG_CONTEXT_TOKENS)
+    messages = [{"role": "system", "content": RAG_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}]
+    retrieved = time.perf_counter()
+
+    def generate():
+        yield _sse(sources, "sources")
+        first_token = None
+        tokens = 0
+        try:
+            for token in basic_rag.stream_chat(messages):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                tokens += 1
+                yield _sse({"token": token})
+        except Exception as e:
+            ask_stats.record(None, time.perf_counter() - start, tokens, error=True)
+            yield _sse({"error": str(e)}, "error")
+            return
+        finished = time.perf_counter()
+        ttft = first_token - start if first_token is not None else None
+        ask_stats.record(ttft, finished - start, tokens)
+        yield _sse({"retrieval_ms": round((retrieved - start) * 1000, 1),
+                    "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+                    "total_ms": round((finished - start) * 1000, 1), "tokens": tokens}, "done")
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _compare_condition(query: str, ocr_engine: str, lang: str, title_only: bool, use_tokenizer: bool,
+                       terms: List[str], limit: int) -> Tuple[Corpus, Ranking, List[dict], np.ndarray, float]:
+    """One corpus of search_compare: its ranking, top hits, the distinct page keys it matched and the seconds taken."""
+    start = time.perf_counter()
+    corpus = get_corpus(ocr_engine, lang)
+    ranking = _ranking(query, corpus, title_only, use_tokenizer)
+    best, scores = ranking.page(0, limit)
+    hits = _page_hits(corpus, best, scores, terms, substring=not use_tokenizer)
+    keys = np.unique(corpus.page_keys[ranking.ids])
+    return corpus, ranking, hits, keys, time.perf_counter() - start
 
 
 @bp.route("/search_compare")
 def search_compare():
-    query: str = request.args.get('query')
-    results = {}
-    conditions = [(TESSERACT, THA_ENG), (TESSERACT, THA), (EASYOCR, THA_ENG), (EASYOCR, THA)]
-    for engine, lang in conditions:
-        text = pd.read_csv(get_text_location(engine, lang), dtype={"filename": "string", "text": "string"})
-        text['text'] = text['filename'].astype(str) + ' ' + text['text']
-        results[(engine, lang)] = _search(query, text, False, True).to_json()
-    return jsonify(results)
+    """
+    The same query against every (engine, lang) corpus at once: per-condition totals, top hits and timings,
+    how many pages each pair of conditions agree on, and the pages only one condition found.
+    """
+    start = time.perf_counter()
+    query: str = request.args.get('query') or ""
+    if not query.strip():
+        return _missing_query()
+    title_only: bool = (request.args.get('title_only') or "false").lower() == "true"
+    use_tokenizer: bool = (request.args.get('use_tokenizer') or "true").lower() == "true"
+    limit: int = min(max(request.args.get('limit', COMPARE_LIMIT, type=int), 1), MAX_LIMIT)
+    # tokenized once here; the corpora below read the memoized terms
+    terms = [t for t in tokenize_query(query) if t.strip()] if use_tokenizer else [query]
+    tokenized = time.perf_counter()
+
+    names = [f"{engine}:{lang}" for engine, lang in CONDITIONS]
+    futures = [compare_executor.submit(_compare_condition, query, engine, lang, title_only, use_tokenizer, terms,
+                                       limit)
+               for engine, lang in CONDITIONS]
+    results = dict(zip(names, (f.result() for f in futures)))
+    keys = {name: result[3] for name, result in results.items()}
+
+    conditions = {}
+    for (engine, lang), name in zip(CONDITIONS, names):
+        corpus, ranking, hits, _, seconds = results[name]
+        others = [keys[other] for other in names if other != name]
+        only = np.setdiff1d(keys[name], np.unique(np.concatenate(others)) if others else [], assume_unique=True)
+        only_rows = ranking.ids[np.isin(corpus.page_keys[ranking.ids], only)][:limit]
+        conditions[name] = {
+            "ocr_engine": engine,
+            "lang": lang,
+            "total": int(len(ranking.ids)),
+            "total_files": int(ranking.total_files),
+            "only_total": int(len(only)),
+            "ms": round(seconds * 1000, 2),
+            "results": hits,
+            "only": _page_hits(corpus, only_rows, None, terms, substring=not use_tokenizer),
+        }
+
+    pairs = []
+    for i, a in enumerate(names):
+        for b in names[i + 1:]:
+            both = len(np.intersect1d(keys[a], keys[b], assume_unique=True))
+            union = len(keys[a]) + len(keys[b]) - both
+            pairs.append({"a": a, "b": b, "both": both, "only_a": len(keys[a]) - both, "only_b": len(keys[b]) - both,
+                          "jaccard": round(both / union, 4) if union else None})
+
+    found_by_all = keys[names[0]]
+    for name in names[1:]:
+        found_by_all = np.intersect1d(found_by_all, keys[name], assume_unique=True)
+    return jsonify({
+        "query": query,
+        "terms": terms,
+        "title_only": title_only,
+        "use_tokenizer": use_tokenizer,
+        "conditions": conditions,
+        "pairs": pairs,
+        "found_by_all": int(len(found_by_all)),
+        "found_by_any": int(len(np.unique(np.concatenate(list(keys.values()))))),
+        "timing_ms": {"tokenize": round((tokenized - start) * 1000, 2),
+                      "total": round((time.perf_counter() - start) * 1000, 2)},
+    })
+
+
+@bp.route("/compare")
+def compare():
+    return render_template("home_compare.html")
+
+
+@bp.route("/stats")
+def stats():
+    return jsonify({
+        "corpus": corpus_store.stats(),
+        "embeddings": embedding_store.stats(),
+        "fuzzy": fuzzy_store.stats(),
+        "page_images": page_images.stats(),
+        "startup": registry.stats(),
+        "ask": ask_stats.summary(),
+        "query_cache": query_cache.stats(),
+        "tokenize_memo": tokenize_query.cache_info()._asdict(),
+    })
 
 
 @bp.route("/")
@@ -77,15 +631,71 @@ def home():
     return render_template("home.html")
 
 
+def _image_response(etag: str, data: Optional[bytes] = None, mimetype: Optional[str] = None) -> Response:
+    response = Response(data, mimetype=mimetype) if data is not None else Response(status=304)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = FETCH_MAX_AGE
+    return response
+
+
 @bp.route("/fetch")
 def fetch_content():
+    """
+    content_type=pdf serves a PDF. content_type=img serves a page image of the PDF named by filename, with page
+    (0-based, as in the hits), size (thumb, medium or full) and format (png or webp), rendered on demand and
+    cached. A pre-rendered image name such as report.pdf_003.png is served from img/ when it is there and
+    rendered from the PDF otherwise.
+    """
     content_type: str = request.args.get('content_type')
     filename: str = request.args.get('filename')
     relative_path: str = request.args.get('relative_path')
-    return send_from_directory(os.path.join(content_type, relative_path), filename)
+    if content_type != "img":
+        return send_from_directory(os.path.join(content_type, relative_path), filename, max_age=FETCH_MAX_AGE)
+
+    size, fmt = request.args.get("size", "full"), request.args.get("format", "png")
+    pre_rendered = PRE_RENDERED_NAME.match(filename) if "page" not in request.args else None
+    if pre_rendered:
+        image_filepath = safe_join(os.path.join(script_dir, IMG_DIR), relative_path, filename)
+        if image_filepath is not None and os.path.isfile(image_filepath):
+            return send_from_directory(os.path.join(IMG_DIR, relative_path), filename, max_age=FETCH_MAX_AGE)
+        filename, page = pre_rendered["filename"], int(pre_rendered["number"]) - 1
+    else:
+        page = request.args.get("page", type=int)
+    if page is None or size not in SIZES or fmt not in FORMATS:
+        return jsonify({"error": f"page, size ({', '.join(SIZES)}) and format ({', '.join(FORMATS)}) "
+                                 f"select a page image"}), 400
+
+    pdf_filepath = safe_join(os.path.join(script_dir, PDF_DIR), relative_path, filename)
+    try:
+        if pdf_filepath is None:
+            raise FileNotFoundError(filename)
+        # revalidation only needs the PDF's signature, not the image
+        etag = page_images.etag(pdf_filepath, page, size, fmt)
+        if etag in request.if_none_match:
+            return _image_response(etag)
+        image = page_images.get(pdf_filepath, page, size, fmt)
+    except (FileNotFoundError, IndexError):
+        return jsonify({"error": "no such page"}), 404
+    return _image_response(image.etag, image.data, image.mimetype)
 
 
 app = Flask(__name__)
 app.register_blueprint(bp, url_prefix='/docsearch')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves /docsearch.")
+    parser.add_argument("--port", type=int, default=9002)
+    parser.add_argument("--no-debug", dest="debug", action="store_false")
+    parser.add_argument("--no-warm-up", dest="warm_up", action="store_false")
+    args = parser.parse_args()
+    # with the debug reloader only its child process serves requests, the parent would warm up for nothing
+    if args.warm_up and (not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        warm_up()
+        print("startup", registry.stats())
+    app.run(port=args.port, debug=args.debug)
+
+
 if __name__ == "__main__":
-    app.run(port=9002, debug=True)
+    main()
@@ -1,34 +1,81 @@
 import json
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # NOTE: ollama must be running for this to work, start the ollama app or run `ollama serve`
 model = "llama3"  # TODO: update this for whatever model you wish to use
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434/api/chat")
+
+# one pooled session, so every turn and every /docsearch/ask request reuses open connections to the backend
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+def stream_chat(messages: List[Dict[str, str]], chat_model: Optional[str] = None,
+                url: Optional[str] = None) -> Iterator[str]:
+    """Yields the content of each streamed token as it arrives from Ollama's /api/chat."""
+    with session.post(url or OLLAMA_URL, json={"model": chat_model or model, "messages": messages, "stream": True},
+                      stream=True) as r:
+        r.raise_for_status()
+        # chunk_size=None hands over each chunk as soon as it is received instead of waiting to fill a buffer
+        for line in r.iter_lines(chunk_size=None):
+            if not line:
+                continue
+            body = json.loads(line)
+            if "error" in body:
+                raise Exception(body["error"])
+            if body.get("done", False):
+                return
+            content = body.get("message", {}).get("content", "")
+            if content:
+                yield content
 
 
 def chat(messages):
-    r = requests.post(
-        "http://127.0.0.1:11434/api/chat",
-        json={"model": model, "messages": messages, "stream": True},
-        stream=True
-    )
-    r.raise_for_status()
-    output = ""
-
-    for line in r.iter_lines():
-        body = json.loads(line)
-        if "error" in body:
-            raise Exception(body["error"])
-        if body.get("done") is False:
-            message = body.get("message", "")
-            content = message.get("content", "")
-            output += content
-            # the response streams one token at a time, print that as we receive it
-            print(content, end="", flush=True)
-
-        if body.get("done", False):
-            message["content"] = output
-            return message
+    parts = []
+    for content in stream_chat(messages):
+        parts.append(content)
+        # the response streams one token at a time, print that as we receive it
+        print(content, end="", flush=True)
+    return {"role": "assistant", "content": "".join(parts)}
+
+
+class ChatStats:
+    """Time to first token and total latency of streamed answers, in milliseconds."""
+
+    def __init__(self, keep: int = 1000):
+        self.requests = 0
+        self.errors = 0
+        self.ttft_ms: Deque[float] = deque(maxlen=keep)
+        self.total_ms: Deque[float] = deque(maxlen=keep)
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, ttft_seconds: Optional[float], total_seconds: float, tokens: int, error: bool = False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.tokens += tokens
+            if ttft_seconds is not None:
+                self.ttft_ms.append(ttft_seconds * 1000)
+            self.total_ms.append(total_seconds * 1000)
+
+    def summary(self) -> dict:
+        def percentiles(values):
+            if not values:
+                return None
+            values = sorted(values)
+            return {p: round(values[min(len(values) - 1, int(len(values) * p / 100))], 1) for p in (50, 90, 99)}
+
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "tokens": self.tokens,
+                    "ttft_ms": percentiles(self.ttft_ms), "total_ms": percentiles(self.total_ms)}
 
 
 def main():
@@ -0,0 +1,195 @@
+"""
+OCR seconds per page, Gemini upload bytes per page and text agreement of preprocessed pages (page_preprocess)
+against the pages as they are OCR'd and uploaded today.
+
+    python -m benchmarks.preprocess --pdf-dir pdf --pages 30 --ocr tesseract --lang tha
+    python -m benchmarks.preprocess --pdf-dir pdf --ocr tesseract --reference text/summary_tesseract_tha.csv
+    python -m benchmarks.preprocess --synthetic 10
+
+Agreement is the similarity (difflib ratio, 1.0 = identical) of the preprocessed page's text to the text of
+the unprocessed page, or, with --reference, to the text stored for that page in an existing summary CSV.
+Without --ocr only the preparation time and upload sizes are measured.
+"""
+import argparse
+import difflib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+import pymupdf
+from PIL import Image
+
+import page_preprocess
+from page_render import pixmap_to_array, pixmap_to_image, render_page
+
+GEMINI_DPI = 300  # what gemini_ocr.py renders and uploads as PNG today
+UPLOAD_VARIANTS = {
+    "webp_q60": page_preprocess.PROFILES["gemini"],
+    "webp_q80": page_preprocess.Profile(dpi=150, upload="webp", quality=80),
+    "jpeg_q70": page_preprocess.Profile(dpi=150, upload="jpeg", quality=70),
+    "png1_200dpi": page_preprocess.Profile(dpi=200, binarize="otsu", upload="png1"),
+}
+
+
+def synthetic_scan_pdf(filepath: str, pages: int, seed: int = 0):
+    """Pages that look scanned: text rendered to an image, slightly rotated, noisy, with a dark border."""
+    rng = np.random.default_rng(seed)
+    with pymupdf.open() as doc, pymupdf.open() as source:
+        for i in range(pages):
+            page = source.new_page()
+            for line in range(40):
+                page.insert_text((50, 60 + line * 18), f"page {i} line {line} the quick brown fox 0123456789")
+            pix = render_page(page, 200)
+            gray = cv2.cvtColor(pixmap_to_array(pix), cv2.COLOR_RGB2GRAY)
+            height, width = gray.shape
+            rotation = cv2.getRotationMatrix2D((width / 2, height / 2), float(rng.uniform(-3, 3)), 1.0)
+            gray = cv2.warpAffine(gray, rotation, (width, height), borderValue=255)
+            gray = np.clip(gray.astype(np.int16) + rng.normal(0, 25, gray.shape), 0, 255).astype(np.uint8)
+            gray[:40], gray[:, :30] = 20, 20
+            ok, data = cv2.imencode(".png", gray)
+            scanned = doc.new_page(width=page.rect.width, height=page.rect.height)
+            scanned.insert_image(scanned.rect, stream=data.tobytes())
+        doc.save(filepath)
+
+
+def collect_pages(pdf_dir: str, pdf_filepaths: List[str], limit: int) -> List[Tuple[Tuple[str, str, int],
+                                                                                     pymupdf.Page]]:
+    """((relative_path, filename, page), page) for up to limit pages, keyed as in summary_*.csv."""
+    pages = []
+    for filepath in pdf_filepaths:
+        doc = pymupdf.open(filepath)
+        relative_path = os.path.relpath(os.path.dirname(filepath), pdf_dir)
+        for i, page in enumerate(doc):
+            pages.append(((relative_path, os.path.basename(filepath), i), page))
+            if len(pages) >= limit:
+                return pages
+    return pages
+
+
+def agreement(text: str, reference: str) -> float:
+    a, b = " ".join(text.split()), " ".join(reference.split())
+    if not a and not b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def per_page(total: float, pages: int, digits: int = 4):
+    return round(total / pages, digits) if pages else None
+
+
+def run_ocr(pages, to_input: Callable, ocr: Optional[Callable]) -> Tuple[dict, List[str]]:
+    prepare_seconds, ocr_seconds, texts = 0.0, 0.0, []
+    for _, page in pages:
+        start = time.perf_counter()
+        ocr_input = to_input(page)
+        prepared = time.perf_counter()
+        if ocr is not None:
+            texts.append(ocr(ocr_input))
+        ocr_seconds += time.perf_counter() - prepared
+        prepare_seconds += prepared - start
+    return {"prepare_seconds_per_page": per_page(prepare_seconds, len(pages)),
+            "ocr_seconds_per_page": per_page(ocr_seconds, len(pages)) if ocr is not None else None,
+            "total_seconds_per_page": per_page(prepare_seconds + ocr_seconds, len(pages))}, texts
+
+
+def upload_sizes(pages) -> Dict[str, dict]:
+    sizes = {"png_300dpi": {"bytes_per_page": 0, "encode_seconds_per_page": 0.0}}
+    sizes.update({name: {"bytes_per_page": 0, "encode_seconds_per_page": 0.0} for name in UPLOAD_VARIANTS})
+    for _, page in pages:
+        start = time.perf_counter()
+        sizes["png_300dpi"]["bytes_per_page"] += len(render_page(page, GEMINI_DPI).tobytes("png"))
+        sizes["png_300dpi"]["encode_seconds_per_page"] += time.perf_counter() - start
+        for name, profile in UPLOAD_VARIANTS.items():
+            start = time.perf_counter()
+            pix = render_page(page, profile.dpi)
+            data, _ = page_preprocess.encode(page_preprocess.prepare(pixmap_to_array(pix), profile), profile)
+            sizes[name]["bytes_per_page"] += len(data)
+            sizes[name]["encode_seconds_per_page"] += time.perf_counter() - start
+    baseline = sizes["png_300dpi"]["bytes_per_page"]
+    for size in sizes.values():
+        size["ratio"] = round(size["bytes_per_page"] / baseline, 4) if baseline else None
+        size["bytes_per_page"] = size["bytes_per_page"] // len(pages) if pages else None
+        size["encode_seconds_per_page"] = per_page(size["encode_seconds_per_page"], len(pages))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", default="pdf")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark generated scan-like pages instead")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--ocr", choices=["tesseract", "easyocr"], default=None, help="OCR the pages too")
+    parser.add_argument("--lang", default="tha+eng")
+    parser.add_argument("--reference", default=None,
+                        help="summary CSV whose stored text the preprocessed OCR is compared with")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="preprocess_")
+    pdf_dir = args.pdf_dir
+    if args.synthetic:
+        pdf_dir = tmp_dir
+        pdf_filepaths = [os.path.join(tmp_dir, "synthetic.pdf")]
+        synthetic_scan_pdf(pdf_filepaths[0], args.synthetic)
+    else:
+        pdf_filepaths = [os.path.join(folder, f) for folder, _, files in os.walk(args.pdf_dir)
+                         for f in sorted(files) if f.lower().endswith(".pdf")]
+    pages = collect_pages(pdf_dir, pdf_filepaths, args.synthetic or args.pages)
+
+    ocr = None
+    if args.ocr == "tesseract":
+        import pytesseract
+
+        def ocr(img):
+            return pytesseract.image_to_string(img, lang=args.lang)
+    elif args.ocr == "easyocr":
+        import easyocr
+        reader = easyocr.Reader(['th', 'en'] if args.lang == "tha+eng" else ['th'])
+
+        def ocr(img):
+            return " ".join(reader.readtext(np.asarray(img), detail=0, paragraph=True))
+
+    profile = page_preprocess.PROFILES[args.ocr or "tesseract"]
+
+    def current(page):
+        # what ocr_pipeline hands the engine today: the page at PyMuPDF's default resolution, as is
+        pix = render_page(page)
+        return pixmap_to_image(pix).copy()
+
+    def preprocessed(page):
+        return Image.fromarray(page_preprocess.prepare(pixmap_to_array(render_page(page, profile.dpi)), profile))
+
+    result = {"pages": len(pages), "ocr": args.ocr, "lang": args.lang, "profile": profile.__dict__}
+    result["current"], current_texts = run_ocr(pages, current, ocr)
+    result["preprocessed"], texts = run_ocr(pages, preprocessed, ocr)
+    if ocr is not None:
+        if args.reference:
+            stored = pd.read_csv(args.reference, dtype={"relative_path": str, "filename": str}, keep_default_na=False)
+            stored = {(r, f, int(p)): t for r, f, p, t in
+                      zip(stored["relative_path"], stored["filename"], stored["page"], stored["text"])}
+            references = [stored.get(key) for key, _ in pages]
+            result["agreement_with"] = args.reference
+        else:
+            references = current_texts
+            result["agreement_with"] = "current"
+        scores = [agreement(text, reference) for text, reference in zip(texts, references) if reference is not None]
+        if args.reference:
+            current_scores = [agreement(text, reference) for text, reference in zip(current_texts, references)
+                              if reference is not None]
+            result["current"]["agreement_mean"] = round(float(np.mean(current_scores)), 4) if current_scores else None
+        result["preprocessed"]["agreement_mean"] = round(float(np.mean(scores)), 4) if scores else None
+        result["preprocessed"]["agreement_min"] = round(float(np.min(scores)), 4) if scores else None
+        result["ocr_speedup"] = round(result["current"]["total_seconds_per_page"]
+                                      / result["preprocessed"]["total_seconds_per_page"], 2)
+    result["gemini_upload"] = upload_sizes(pages)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
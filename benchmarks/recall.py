@@ -0,0 +1,108 @@
+"""
+Regression check of search recall: every query must find at least the pages the old substring search found,
+where a term matched if it occurred anywhere in the filename (title_only) or in the filename or page text.
+Tokens get in the way of that in two ways, both checked here per page and per document, tokenized and verbatim:
+- Thai filenames the tokenizer splits badly with their ".pdf" extension
+  (e.g. "รายงานการประชุม.pdf" -> 'ราย', 'งานการ', 'ประ', 'ชุ', 'ม.', 'pdf');
+- page text where a query term sits inside a longer token, on a synthetic corpus
+  (benchmarks/synthetic_corpus.py) with its query set plus fragments of its words.
+Exits with status 1 and lists the queries that miss pages.
+
+    python -m benchmarks.recall [--pages 500]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# (filename, pages)
+DOCUMENTS = [
+    ("รายงานการประชุม.pdf", 3),
+    ("ประกาศมหาวิทยาลัย.pdf", 1),
+    ("ประกาศ_ผลการสอบ_2567.pdf", 1),
+    ("คำสั่งแต่งตั้งคณะกรรมการ.pdf", 2),
+    ("budget report ประจำปี.pdf", 1),
+]
+TITLE_QUERIES = ["รายงาน", "ประชุม", "รายงานการประชุม", "ประกาศ", "มหาวิทยาลัย", "กรรมการ", "คณะกรรมการ", "แต่งตั้ง",
+                 "ผลการสอบ", "2567", "budget", "ประจำปี", "pdf"]
+TEXT_QUERIES = 100
+
+
+def write_titles_corpus(out_dir: str) -> str:
+    rows = [{"filename": filename, "relative_path": "ประกาศ/2567", "page": page, "text": "เนื้อหา"}
+            for filename, pages in DOCUMENTS for page in range(pages)]
+    text_dir = os.path.join(out_dir, "text")
+    os.makedirs(text_dir, exist_ok=True)
+    filepath = os.path.join(text_dir, "summary_tesseract_tha+eng.csv")
+    pd.DataFrame(rows).to_csv(filepath)
+    return filepath
+
+
+def write_text_corpus(out_dir: str, pages: int) -> tuple:
+    """The synthetic corpus and its queries, plus the first characters of some of its words."""
+    from benchmarks import synthetic_corpus
+
+    written = synthetic_corpus.write_corpus(out_dir, pages, TEXT_QUERIES)
+    with open(written["queries"], encoding="utf-8") as f:
+        queries = json.load(f)
+    fragments = [query[:3] for query in queries if len(query) > 4][:TEXT_QUERIES // 4]
+    return written["corpora"]["tesseract:tha+eng"], queries + fragments
+
+
+def search_terms(app, query: str) -> List[str]:
+    return [t for t in app.tokenize_query(query) if t.strip()]
+
+
+def check(filepath: str, queries: List[str], title_only: bool) -> Dict[str, List[dict]]:
+    import app
+    from corpus_store import file_signature, load_corpus
+
+    corpus = load_corpus(filepath, file_signature(filepath))
+    filenames = corpus.frame["filename"].astype(str).to_numpy()
+    texts = corpus.frame["text"].fillna("").astype(str).to_numpy()
+    fields = filenames if title_only else [f"{name}\n{text}" for name, text in zip(filenames, texts)]
+    doc_ids = corpus.documents.doc_ids
+    misses = {}
+    for query in queries:
+        for use_tokenizer in (True, False):
+            terms = search_terms(app, query) if use_tokenizer else [query]
+            if not terms:
+                continue
+            if use_tokenizer and not title_only:
+                # as with the old concatenation, each term may occur in either the filename or the text
+                found = [all(term in name or term in text for term in terms) for name, text in zip(filenames, texts)]
+            else:
+                found = [all(term in field for term in terms) for field in fields]
+            expected = np.flatnonzero(found)
+            for aggregate in (False, True):
+                ids = app._ranking(query, corpus, title_only, use_tokenizer, aggregate).ids
+                wanted = np.unique(doc_ids[expected]) if aggregate else expected
+                missing = np.setdiff1d(wanted, ids)
+                if len(missing):
+                    misses.setdefault(query, []).append({"title_only": title_only, "use_tokenizer": use_tokenizer,
+                                                         "aggregate": aggregate, "expected": len(wanted),
+                                                         "found": len(ids), "missing": len(missing)})
+    return misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500, help="pages of the synthetic corpus for the text check")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        misses = check(write_titles_corpus(os.path.join(out_dir, "titles")), TITLE_QUERIES, True)
+        text_filepath, text_queries = write_text_corpus(os.path.join(out_dir, "text_corpus"), args.pages)
+        misses.update(check(text_filepath, text_queries, False))
+    print(json.dumps({"queries": len(TITLE_QUERIES) + len(text_queries), "misses": misses}, ensure_ascii=False,
+                     indent=2))
+    sys.exit(1 if misses else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Pages/s of the render -> OCR hand-off with and without the PNG round-trip through img/.
+
+    python -m benchmarks.render_io --pdf-dir pdf --pages 50
+    python -m benchmarks.render_io --synthetic 30 --ocr tesseract --lang tha
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+import pymupdf
+from PIL import Image
+
+from page_render import pixmap_to_array, pixmap_to_image, render_page
+
+
+def synthetic_pdf(filepath: str, pages: int):
+    with pymupdf.open() as doc:
+        for i in range(pages):
+            page = doc.new_page()
+            for line in range(40):
+                page.insert_text((50, 60 + line * 18), f"page {i} line {line} the quick brown fox 0123456789")
+        doc.save(filepath)
+
+
+def collect_pages(pdf_filepaths: List[str], limit: int) -> List[pymupdf.Page]:
+    pages = []
+    for filepath in pdf_filepaths:
+        doc = pymupdf.open(filepath)
+        for page in doc:
+            pages.append(page)
+            if len(pages) >= limit:
+                return pages
+    return pages
+
+
+def run(pages: List[pymupdf.Page], to_ocr_input: Callable, ocr: Optional[Callable], dpi: Optional[int]) -> dict:
+    start = time.perf_counter()
+    for page in pages:
+        ocr_input = to_ocr_input(render_page(page, dpi))
+        if ocr is not None:
+            ocr(ocr_input)
+    seconds = time.perf_counter() - start
+    return {"pages": len(pages), "seconds": round(seconds, 4), "pages_per_second": round(len(pages) / seconds, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", default="pdf")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark a generated PDF with this many pages")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--dpi", type=int, default=None)
+    parser.add_argument("--ocr", choices=["tesseract", "easyocr"], default=None, help="include OCR in the timing")
+    parser.add_argument("--lang", default="tha+eng")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="render_io_")
+    if args.synthetic:
+        pdf_filepaths = [os.path.join(tmp_dir, "synthetic.pdf")]
+        synthetic_pdf(pdf_filepaths[0], args.synthetic)
+    else:
+        pdf_filepaths = [os.path.join(folder, f) for folder, _, files in os.walk(args.pdf_dir)
+                         for f in sorted(files) if f.lower().endswith(".pdf")]
+    pages = collect_pages(pdf_filepaths, args.synthetic or args.pages)
+
+    ocr = None
+    if args.ocr == "tesseract":
+        import pytesseract
+
+        def ocr(img):
+            return pytesseract.image_to_string(img, lang=args.lang)
+    elif args.ocr == "easyocr":
+        import easyocr
+        reader = easyocr.Reader(['th', 'en'] if args.lang == "tha+eng" else ['th'])
+
+        def ocr(img):
+            return reader.readtext(np.asarray(img), detail=0, paragraph=True)
+
+    counter = iter(range(10 ** 9))
+
+    def via_disk(pix):
+        # what pdf_to_text does today: encode PNG, write it, read and decode it back
+        image_filepath = os.path.join(tmp_dir, f"{next(counter)}.png")
+        pix.save(image_filepath)
+        img = Image.open(image_filepath)
+        img.load()
+        return img if args.ocr != "easyocr" else np.array(img)
+
+    def in_memory(pix):
+        return pixmap_to_image(pix) if args.ocr != "easyocr" else pixmap_to_array(pix)
+
+    result = {
+        "pages": len(pages),
+        "dpi": args.dpi,
+        "ocr": args.ocr,
+        "disk_round_trip": run(pages, via_disk, ocr, args.dpi),
+        "in_memory": run(pages, in_memory, ocr, args.dpi),
+    }
+    result["speedup"] = round(result["in_memory"]["pages_per_second"]
+                              / result["disk_round_trip"]["pages_per_second"], 2)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
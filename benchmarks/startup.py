@@ -0,0 +1,68 @@
+"""
+Cold start of the entry points: seconds to import each one in a fresh interpreter, the imports that take the
+most of it (python -X importtime), and with --warm-up the seconds app.warm_up() spends per part.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --modules app cleanup_text --top 5 --warm-up
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict
+
+ENTRY_POINTS = ["app", "read_pdf", "ocr_pipeline", "gemini_ocr", "cleanup_text", "semantic_index", "basic_rag"]
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *options, "-c", code], cwd=REPO_DIR, capture_output=True, text=True,
+                          check=True)
+
+
+def import_report(module: str, top: int) -> dict:
+    start = time.perf_counter()
+    process = run_python(f"import {module}", "-X", "importtime")
+    wall_seconds = time.perf_counter() - start
+    # lines are "import time: self [us] | cumulative | <indented name>", nested imports indented further
+    # and printed after their children, so the direct imports of a module are the depth 1 lines before it
+    children: Dict[str, int] = {}
+    imports: Dict[str, int] = {}
+    total_us = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == module:
+                total_us, imports = int(cumulative), children
+            children = {}
+    slowest = sorted(imports.items(), key=lambda item: -item[1])[:top]
+    return {"wall_seconds": round(wall_seconds, 3), "import_seconds": round(total_us / 1e6, 3),
+            "slowest_imports": {name: round(us / 1e6, 3) for name, us in slowest}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--top", type=int, default=8, help="slowest direct imports listed per module")
+    parser.add_argument("--warm-up", action="store_true", help="also time app.warm_up() on the local corpora")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    run_python("pass")
+    result = {"interpreter_seconds": round(time.perf_counter() - start, 3)}
+    result["modules"] = {module: import_report(module, args.top) for module in args.modules}
+    if args.warm_up:
+        process = run_python("import json, app; app.warm_up(); print(json.dumps(app.registry.stats()))")
+        result["warm_up"] = json.loads(process.stdout.strip().splitlines()[-1])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+The DocSearch benchmark suite: search latency and throughput on synthetic corpora of growing size, and the OCR
+and cleanup pipelines against local stand-ins, as one JSON report to compare commits and catch regressions.
+
+    python -m benchmarks.suite --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.suite --sizes 1000 --queries 50 --skip-pipelines
+
+For every size a corpus is generated (benchmarks/synthetic_corpus.py, kept under --corpus-dir for later runs)
+and searched in its own process, so each size reports its own peak RSS:
+- _search_ranked() with every combination of title_only, use_tokenizer and aggregate, once with empty query
+  caches ("cold") and once more ("warm");
+- /docsearch/search_compare through the Flask test client.
+The OCR pipeline OCRs generated PDFs with a stub tesseract executable, and cleanup_text.py consolidates
+generated pages against fake_gemini.py with no rate limit, batched as cleanup_text.py batches them unless
+--cleanup-batch-pages says otherwise.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [1000, 10000, 100000]
+OCR_CONDITIONS = [("tesseract", "tha+eng"), ("tesseract", "tha")]
+STUB_TESSERACT = """#!{python}
+# stands in for tesseract: <image> <output base> -l <lang> [txt], writes the page text to <output base>.txt
+import sys
+with open(sys.argv[2] + ".txt", "w", encoding="utf-8") as f:
+    f.write("ประกาศมหาวิทยาลัย เรื่อง การประชุม budget report 2567\\n")
+"""
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {"count": len(ms), "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3), "p90_ms": round(float(np.percentile(ms, 90)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3), "max_ms": round(float(ms.max()), 3),
+            "per_second": round(len(ms) / ms.sum() * 1000, 1) if ms.sum() else None}
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size; ru_maxrss is in KiB on Linux and bytes on macOS."""
+    maxrss = resource.getrusage(who).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def timed_calls(call: Callable[[str], object], queries: List[str]) -> List[float]:
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        call(query)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def corpus_for(corpus_dir: str, size: int, queries: int, seed: int) -> Dict[str, object]:
+    """The corpus of this size and seed under corpus_dir, generated unless an earlier run left it there."""
+    from benchmarks import synthetic_corpus
+    out_dir = os.path.join(corpus_dir, f"pages{size}_seed{seed}")
+    queries_filepath = os.path.join(out_dir, "queries.json")
+    if os.path.exists(queries_filepath):
+        with open(queries_filepath, encoding="utf-8") as f:
+            if len(json.load(f)) >= queries:
+                return {"dir": out_dir, "generate_seconds": None}
+    start = time.perf_counter()
+    synthetic_corpus.write_corpus(out_dir, size, queries, seed)
+    return {"dir": out_dir, "generate_seconds": round(time.perf_counter() - start, 3)}
+
+
+def search_benchmark(corpus_dir: str, size: int, queries: int, seed: int) -> Dict[str, object]:
+    """Runs in a fresh process per size."""
+    corpus = corpus_for(corpus_dir, size, queries, seed)
+    with open(os.path.join(corpus["dir"], "queries.json"), encoding="utf-8") as f:
+        query_set = json.load(f)[:queries]
+
+    import app
+    app.script_dir = corpus["dir"]  # get_text_location() reads text/ under it
+    result = {"pages": size, "queries": len(query_set), "generate_seconds": corpus["generate_seconds"]}
+    start = time.perf_counter()
+    app.warm_up()
+    result["warm_up_seconds"] = round(time.perf_counter() - start, 3)
+    result["startup"] = app.registry.stats()
+
+    searched = app.get_corpus(app.TESSERACT, app.THA_ENG)
+    modes = {}
+    for title_only, use_tokenizer, aggregate in itertools.product([False, True], repeat=3):
+        totals = []
+
+        def search(query: str):
+            hits, ranking = app._search_ranked(query, searched, title_only, 0, app.DEFAULT_LIMIT,
+                                               aggregate=aggregate, use_tokenizer=use_tokenizer)
+            totals.append(len(ranking.ids))
+
+        app.query_cache.clear()
+        app.tokenize_query.cache_clear()
+        cold = timed_calls(search, query_set)
+        warm = timed_calls(search, query_set)
+        name = f"title_only={title_only},use_tokenizer={use_tokenizer},aggregate={aggregate}"
+        modes[name] = {"cold": latency_summary(cold), "warm": latency_summary(warm),
+                       "mean_results": round(float(np.mean(totals[:len(query_set)])), 1)}
+    result["search"] = modes
+
+    client = app.app.test_client()
+
+    def compare(query: str):
+        response = client.get("/docsearch/search_compare", query_string={"query": query})
+        if response.status_code != 200:
+            raise RuntimeError(f"/search_compare answered {response.status_code} for {query!r}")
+
+    app.query_cache.clear()
+    app.tokenize_query.cache_clear()
+    result["search_compare"] = {"cold": latency_summary(timed_calls(compare, query_set)),
+                                "warm": latency_summary(timed_calls(compare, query_set))}
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def ocr_pipeline_benchmark(work_dir: str, pages: int, workers: int) -> Dict[str, object]:
+    """Runs in a fresh process, in work_dir, since the pipeline lays out img/ relative to the working directory."""
+    from benchmarks.render_io import synthetic_pdf
+    from ocr_pipeline import run_pipeline
+
+    os.chdir(work_dir)
+    tesseract = os.path.join(work_dir, "tesseract")
+    with open(tesseract, "w", encoding="utf-8") as f:
+        f.write(STUB_TESSERACT.format(python=sys.executable))
+    os.chmod(tesseract, os.stat(tesseract).st_mode | stat.S_IEXEC)
+    os.makedirs("pdf", exist_ok=True)
+    files = 4
+    for i in range(files):
+        synthetic_pdf(os.path.join("pdf", f"doc{i}.pdf"), pages // files + (i < pages % files))
+    summary = run_pipeline(root_dir="pdf", pytesseract_exe=tesseract, output_filename="text/summary", img_dir="img",
+                           workers=workers, in_memory=True, conditions=OCR_CONDITIONS, use_cache=False)
+    return {"pages": pages, "workers": workers, "conditions": [f"{e}:{l}" for e, l in OCR_CONDITIONS],
+            "report": summary, "peak_rss_mb": peak_rss_mb(),
+            "peak_worker_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def cleanup_benchmark(work_dir: str, pages: int, seed: int, latency: float,
+                      batch_pages: Optional[int] = None) -> Dict[str, object]:
+    """
+    cleanup_text.py in a subprocess against an in-process fake Gemini, which answers batch prompts per page, with
+    its wall time, requests per page and peak RSS. batch_pages overrides cleanup_text.py's --batch-pages.
+    """
+    from benchmarks import synthetic_corpus
+    from fake_gemini import FakeGemini
+
+    synthetic_corpus.write_corpus(work_dir, pages, 1, seed)
+    with FakeGemini(latency=latency) as fake:
+        env = dict(os.environ, GEMINI_API_KEY="fake", GOOGLE_GEMINI_BASE_URL=fake.base_url)
+        start = time.perf_counter()
+        with open(os.path.join(work_dir, "cleanup.log"), "w") as log:
+            command = [sys.executable, os.path.join(REPO_DIR, "cleanup_text.py"), "--rpm", "0"]
+            if batch_pages is not None:
+                command += ["--batch-pages", str(batch_pages)]
+            process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        requests = dict(fake.counts)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"cleanup_text.py failed, see {os.path.join(work_dir, 'cleanup.log')}")
+    maxrss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"pages": pages, "batch_pages": batch_pages, "fake_latency_seconds": latency,
+            "wall_seconds": round(wall, 3), "pages_per_second": round(pages / wall, 2), "requests": requests,
+            "requests_per_page": round(sum(requests.values()) / pages, 3), "peak_rss_mb": round(maxrss, 1)}
+
+
+def in_fresh_process(function: Callable, *args) -> Dict[str, object]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="corpus sizes in pages")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "docsearch_bench"),
+                        help="where generated corpora are kept between runs")
+    parser.add_argument("--skip-search", action="store_true")
+    parser.add_argument("--skip-pipelines", action="store_true")
+    parser.add_argument("--ocr-pages", type=int, default=40)
+    parser.add_argument("--ocr-workers", type=int, default=2)
+    parser.add_argument("--cleanup-pages", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds the fake Gemini takes per request")
+    parser.add_argument("--cleanup-batch-pages", type=int, default=None,
+                        help="pages per cleanup request, 1 to measure the one-page path (default: cleanup_text's)")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of printing it")
+    args = parser.parse_args()
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "cpus": os.cpu_count(), "args": vars(args)}
+    if not args.skip_search:
+        report["search"] = {str(size): in_fresh_process(search_benchmark, args.corpus_dir, size, args.queries,
+                                                        args.seed)
+                            for size in args.sizes}
+    if not args.skip_pipelines:
+        work_dir = tempfile.mkdtemp(prefix="docsearch_pipelines_")
+        try:
+            os.makedirs(os.path.join(work_dir, "ocr"))
+            os.makedirs(os.path.join(work_dir, "cleanup"))
+            report["ocr_pipeline"] = in_fresh_process(ocr_pipeline_benchmark, os.path.join(work_dir, "ocr"),
+                                                      args.ocr_pages, args.ocr_workers)
+            report["cleanup"] = cleanup_benchmark(os.path.join(work_dir, "cleanup"), args.cleanup_pages, args.seed,
+                                                  args.llm_latency, args.cleanup_batch_pages)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
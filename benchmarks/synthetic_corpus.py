@@ -0,0 +1,179 @@
+"""
+Synthetic corpora in the summary_{engine}_{lang}.csv schema, to benchmark search at sizes the real documents
+do not reach. Page text mixes Thai words from PyThaiNLP's word list, written without spaces between words as
+in Thai prose, with English words and numbers, all drawn from a Zipf-like distribution so a few terms are very
+common and most are rare. Documents run from one to a few dozen pages under Thai folder names. Each OCR
+condition gets the same pages with its own OCR-like noise (dropped characters, merged words), and a query
+set is drawn from the pages: common, rare, multi-word, English and substring queries.
+
+    python -m benchmarks.synthetic_corpus --pages 10000 --out /tmp/corpus [--queries 200] [--seed 0]
+
+writes /tmp/corpus/text/summary_{engine}_{lang}.csv for every condition and /tmp/corpus/queries.json.
+"""
+import argparse
+import json
+import os
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+CONDITIONS = [("tesseract", "tha+eng"), ("tesseract", "tha"), ("easyocr", "tha+eng"), ("easyocr", "tha")]
+THAI_VOCABULARY = 20_000
+ZIPF_EXPONENT = 1.0
+ZIPF_OFFSET = 2.7  # Zipf-Mandelbrot, flattens the head so the commonest word is a few percent of the text
+WORDS_PER_PAGE = 220  # median, log-normally distributed
+ENGLISH_SHARE = 0.08
+NUMBER_SHARE = 0.03
+SPACE_SHARE = 0.15  # Thai words followed by a space, roughly phrase breaks
+PAGES_PER_DOCUMENT = 8  # mean, geometric
+FOLDERS = 40
+OCR_NOISE = {"tesseract": 0.03, "easyocr": 0.06}  # share of words damaged per engine
+ENGLISH_ONLY_LOSS = 0.5  # share of English words a "tha" run misreads
+
+ENGLISH_WORDS = (
+    "university faculty budget report meeting committee minutes agenda announcement regulation policy student "
+    "research project annual plan fiscal year office department director president dean approval procurement "
+    "contract invoice payment salary staff training seminar conference curriculum course semester examination "
+    "grade scholarship library laboratory equipment building maintenance schedule deadline appendix reference "
+    "document number date signature secretary chairman member quality assurance evaluation performance "
+    "strategy development community service international cooperation memorandum agreement").split()
+THAI_WORD = re.compile(r"^[ก-๎]{2,12}$")
+
+
+def thai_vocabulary(rng: np.random.Generator, size: int = THAI_VOCABULARY) -> List[str]:
+    from pythainlp.corpus import thai_words
+    words = sorted(w for w in thai_words() if THAI_WORD.match(w))
+    return [words[i] for i in rng.choice(len(words), size=min(size, len(words)), replace=False)]
+
+
+def zipf_probabilities(size: int, exponent: float = ZIPF_EXPONENT) -> np.ndarray:
+    weights = 1.0 / (np.arange(1, size + 1) + ZIPF_OFFSET) ** exponent
+    return weights / weights.sum()
+
+
+def page_tokens(rng: np.random.Generator, thai: Sequence[str], pages: int) -> Tuple[List[List[str]],
+                                                                                 List[List[str]],
+                                                                                 List[np.ndarray]]:
+    """
+    The words of every page, before OCR noise, the separator written after each (Thai words run together
+    except at phrase breaks, anything next to a non-Thai word is space separated) and which are English.
+    """
+    counts = np.maximum(rng.lognormal(np.log(WORDS_PER_PAGE), 0.5, pages).astype(np.int64), 5)
+    total = int(counts.sum())
+    # one vocabulary of Thai words, then English words, then numbers, indexed by the drawn ids
+    vocabulary = np.array(list(thai) + ENGLISH_WORDS + [str(n) for n in range(1, 3000)], dtype=object)
+    kinds = rng.random(total)
+    ids = np.where(kinds < ENGLISH_SHARE,
+                   len(thai) + rng.choice(len(ENGLISH_WORDS), size=total, p=zipf_probabilities(len(ENGLISH_WORDS))),
+                   rng.choice(len(thai), size=total, p=zipf_probabilities(len(thai))))
+    numbers = (kinds >= ENGLISH_SHARE) & (kinds < ENGLISH_SHARE + NUMBER_SHARE)
+    ids[numbers] = len(thai) + len(ENGLISH_WORDS) + rng.integers(0, 2999, size=int(numbers.sum()))
+    words = vocabulary[ids].tolist()
+    is_thai = kinds >= ENGLISH_SHARE + NUMBER_SHARE
+    spaced = (rng.random(total) < SPACE_SHARE) | ~is_thai | ~np.append(is_thai[1:], True)
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    spaced[bounds[1:] - 1] = False
+    separators = np.where(spaced, " ", "").tolist()
+    english = kinds < ENGLISH_SHARE
+    return ([words[bounds[p]:bounds[p + 1]] for p in range(pages)],
+            [separators[bounds[p]:bounds[p + 1]] for p in range(pages)],
+            [english[bounds[p]:bounds[p + 1]] for p in range(pages)])
+
+
+def join_words(words: Sequence[str], separators: Sequence[str]) -> str:
+    return "".join(map(str.__add__, words, separators))
+
+
+def ocr_noise(rng: np.random.Generator, words: List[str], english: np.ndarray, engine: str,
+              lang: str) -> List[str]:
+    """The page as one OCR condition reads it: some words lose a character, tha runs garble English."""
+    damaged = rng.random(len(words)) < OCR_NOISE[engine]
+    lost = english & (rng.random(len(words)) < ENGLISH_ONLY_LOSS) if lang == "tha" else np.zeros_like(english)
+    noisy = list(words)
+    for i in np.flatnonzero(damaged | lost):
+        word = words[i]
+        if lost[i]:
+            noisy[i] = word.upper()[::2]
+        elif damaged[i] and len(word) > 2:
+            cut = int(rng.integers(len(word)))
+            noisy[i] = word[:cut] + word[cut + 1:]
+    return noisy
+
+
+def documents(rng: np.random.Generator, thai: Sequence[str], pages: int) -> List[Tuple[str, str, int]]:
+    """(relative_path, filename, page) of every page, 0-based pages as the OCR pipeline writes them."""
+    folders = [f"{thai[i]}/{2560 + i % 8}" for i in range(FOLDERS)]
+    keys = []
+    doc = 0
+    while len(keys) < pages:
+        length = int(rng.geometric(1 / PAGES_PER_DOCUMENT))
+        title = "".join(thai[int(i)] for i in rng.integers(0, 2000, size=3))
+        folder = folders[int(rng.integers(FOLDERS))]
+        keys.extend((folder, f"{title}_{doc:05}.pdf", page) for page in range(length))
+        doc += 1
+    return keys[:pages]
+
+
+def make_queries(rng: np.random.Generator, tokens: List[List[str]], page_separators: List[List[str]],
+                 count: int) -> List[str]:
+    """Queries drawn from the pages: single words (common ones more often), phrases, English and substrings."""
+    queries = []
+    while len(queries) < count:
+        page = int(rng.integers(len(tokens)))
+        words, separators = tokens[page], page_separators[page]
+        start = int(rng.integers(len(words)))
+        kind = rng.random()
+        if kind < 0.45:
+            query = words[start]
+        elif kind < 0.7:
+            query = join_words(words[start:start + 2], separators[start:start + 2]).strip()
+        elif kind < 0.85:
+            query = " ".join(words[start:start + 3])
+        elif kind < 0.95:
+            query = ENGLISH_WORDS[int(rng.integers(len(ENGLISH_WORDS)))]
+        else:
+            word = max(words[start:start + 4], key=len)
+            query = word[1:-1] if len(word) > 4 else word
+        if query.strip():
+            queries.append(query)
+    return queries
+
+
+def write_corpus(out_dir: str, pages: int, queries: int = 200, seed: int = 0) -> Dict[str, object]:
+    """Writes the corpora and the queries; returns their paths."""
+    rng = np.random.default_rng(seed)
+    thai = thai_vocabulary(rng)
+    tokens, separators, english = page_tokens(rng, thai, pages)
+    keys = documents(rng, thai, pages)
+    text_dir = os.path.join(out_dir, "text")
+    os.makedirs(text_dir, exist_ok=True)
+    filepaths = {}
+    for engine, lang in CONDITIONS:
+        condition_rng = np.random.default_rng([seed, len(filepaths)])
+        texts = [join_words(ocr_noise(condition_rng, words, page_english, engine, lang), page_separators)
+                 for words, page_separators, page_english in zip(tokens, separators, english)]
+        frame = pd.DataFrame({"filename": [k[1] for k in keys], "relative_path": [k[0] for k in keys],
+                              "page": [k[2] for k in keys], "text": texts})
+        filepath = os.path.join(text_dir, f"summary_{engine}_{lang}.csv")
+        frame.to_csv(filepath)
+        filepaths[f"{engine}:{lang}"] = filepath
+    queries_filepath = os.path.join(out_dir, "queries.json")
+    with open(queries_filepath, "w", encoding="utf-8") as f:
+        json.dump(make_queries(rng, tokens, separators, queries), f, ensure_ascii=False, indent=0)
+    return {"corpora": filepaths, "queries": queries_filepath}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(write_corpus(args.out, args.pages, args.queries, args.seed), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
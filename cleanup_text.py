@@ -1,50 +1,49 @@
+"""
+Consolidates the four OCR versions of every page (text/*.csv) into one corrected text plus metadata with an
+LLM, into text_cleaned/cleaned_consolidated_docs.csv.
+
+    python cleanup_text.py [--provider gemini|ollama] [--batch-pages 8] [--rpm 10] [--redo-everything]
+"""
+import argparse
+import functools
 import json
 import os
 import re
+import threading
 import time
 
-import dotenv
-from google import genai
 import pandas as pd
 import requests
 from tqdm import tqdm
 
-dotenv.load_dotenv()
+from corpus_store import load_corpus_frame
+from gemini_client import GeminiDispatcher, RateLimitExhausted, genai_client, is_rate_limit_error
+from progress_ledger import DONE, ERROR, ProgressLedger, page_key
+from result_cache import LLM, RESULT_CACHE_FILENAME, ResultCache, cache_key
+from result_sink import ResultSink
 
 # --- CONFIGURATION ---
 MODEL_NAME = "qwen3:8b"
 TEXT_FOLDER = "text"
 OUTPUT_FOLDER = "text_cleaned"
-CSV_FILES = os.listdir(TEXT_FOLDER)  # Paths to CSVs
 CONSOLIDATE_FILEPATH = os.path.join(OUTPUT_FOLDER, "cleaned_consolidated_docs.csv")
+LEDGER_FILEPATH = os.path.join(OUTPUT_FOLDER, "progress.sqlite")
+LEDGER_STAGE = "cleanup"
+RESULT_CACHE_FILEPATH = os.path.join(OUTPUT_FOLDER, RESULT_CACHE_FILENAME)
+OUTPUT_COLUMNS = ["relative_path", "filename", "page", "clean_text", "meta_type", "meta_subject", "meta_entities",
+                  "vector_context", "error"]
 REDO_EVERYTHING = False
 
-if not os.path.exists(CONSOLIDATE_FILEPATH):
-    _blank = pd.DataFrame({
-        "relative_path": [],
-        "filename": [],
-        "page": [],
-        "clean_text": [],
-        "meta_type": [],
-        "meta_subject": [],
-        "meta_entities": [],
-        "vector_context": [],
-        "error": []
-    })
-    _blank.to_csv(CONSOLIDATE_FILEPATH, index=False)
-
-# --- 1. DATA PREPARATION ---
-print("Loading and merging CSVs...")
-
-# Load all CSVs
-dfs = [pd.read_csv(os.path.join(TEXT_FOLDER, f)) for f in CSV_FILES]
-
 # SET THIS FLAG: 'ollama' or 'gemini'
 PROVIDER = 'gemini'
 
-# GEMINI SETTINGS
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# GEMINI SETTINGS, the API key is read from GEMINI_API_KEY in the environment or .env
 GEMINI_MODEL = ["gemini-2.5-flash", "gemini-2.5-flash-preview-09-2025"]  # switch model to different models
+GEMINI_RPM = 10  # requests per minute allowed per model (free tier flash: 10)
+MAX_IN_FLIGHT = 4  # concurrent LLM requests
+BATCH_PAGES = 8  # pages per request; 1 sends one page per request as before
+BATCH_TOKEN_BUDGET = 24000  # estimated OCR input tokens per batched request: 8 pages of four ~2000-char versions
+CHARS_PER_TOKEN = 3
 
 # OLLAMA SETTINGS
 OLLAMA_MODEL = "qwen3:8b"
@@ -52,42 +51,43 @@ OLLAMA_URL = "http://localhost:11434/api/chat"
 
 # --- 2. SETUP BACKENDS ---
 
-if PROVIDER == 'gemini':
-    genai.configure(api_key=GEMINI_API_KEY)
+@functools.lru_cache(maxsize=None)
+def generation_config():
+    from google.genai import types
+
     # Configure generation for strict JSON
-    generation_config = {
-        "temperature": 0.1,
-        "response_mime_type": "application/json",
-    }
-    model_gemini = (
-        [genai.GenerativeModel(
-            model_name=_model,
-            generation_config=generation_config,
-            system_instruction="You are a precise Thai Document Editor. Output strictly valid JSON."
-        ) for _model in GEMINI_MODEL]
+    return types.GenerateContentConfig(
+        temperature=0.1,
+        response_mime_type="application/json",
+        system_instruction="You are a precise Thai Document Editor. Output strictly valid JSON.",
     )
 
+
 call_count = 0
 
 
-def call_llm(prompt, model_id=None):
+def call_llm(prompt, model=None, usage=None):
+    """Unified wrapper to call either Gemini or Ollama. Fills usage with the prompt/output token counts if given."""
     global call_count
     call_count += 1
-    """Unified wrapper to call either Gemini or Ollama"""
-    if model_id is None:
-        model_to_use = model_gemini[call_count % len(model_gemini)]
-    else:
-        model_to_use = model_gemini[model_id]
+    if model is None:
+        model = GEMINI_MODEL[call_count % len(GEMINI_MODEL)] if PROVIDER == 'gemini' else OLLAMA_MODEL
     response = None
 
     if PROVIDER == 'gemini':
         try:
             # Gemini handles JSON enforcement natively via config
-            response = model_to_use.generate_content(prompt)
+            response = genai_client().models.generate_content(model=model, contents=prompt,
+                                                              config=generation_config())
+            if usage is not None and response.usage_metadata is not None:
+                usage["prompt_tokens"] = response.usage_metadata.prompt_token_count
+                usage["output_tokens"] = response.usage_metadata.candidates_token_count
             return json.loads(response.text)
         except Exception as e:
+            if is_rate_limit_error(e):
+                raise  # the dispatcher backs off and retries these
             print(str(e))
-            for c in response.candidates:
+            for c in (response.candidates if response is not None else None) or []:
                 print(">>>>> candidate: ", c.finish_reason, c.token_count)
                 print(c.content)
             raise Exception(f"Gemini API Error: {e}")
@@ -95,7 +95,7 @@ def call_llm(prompt, model_id=None):
     elif PROVIDER == 'ollama':
         try:
             payload = {
-                "model": OLLAMA_MODEL,
+                "model": model,
                 "messages": [
                     {"role": "system",
                      "content": "You are a precise Thai Document Editor. Output strictly valid JSON."},
@@ -106,61 +106,68 @@ def call_llm(prompt, model_id=None):
                 "stream": False
             }
             res = requests.post(OLLAMA_URL, json=payload)
+            if res.status_code == 429:
+                raise Exception(f"429 Ollama Error: {res.text}")
             if res.status_code != 200:
                 raise Exception(f"Ollama Error: {res.text}")
 
-            return json.loads(res.json()['message']['content'])
+            body = res.json()
+            if usage is not None:
+                usage["prompt_tokens"] = body.get("prompt_eval_count")
+                usage["output_tokens"] = body.get("eval_count")
+            return json.loads(body['message']['content'])
         except Exception as _e:
+            if is_rate_limit_error(_e):
+                raise
             raise Exception(f"Ollama Connection Error: {_e}")
     return None
 
 
 # --- 3. DATA PREPARATION (Using your requested Relative Path Fix) ---
-print("Loading and merging CSVs...")
-dfs = [pd.read_csv(os.path.join(TEXT_FOLDER, f)) for f in CSV_FILES]
 
-for df in dfs:
-    df['relative_path'] = df['relative_path'].astype(str)
-    df['filename'] = df['filename'].astype(str)
-    df['page'] = df['page'].astype(str)  # Ensure page is string for safe merging
+def csv_filepaths():
+    return [os.path.join(TEXT_FOLDER, f) for f in os.listdir(TEXT_FOLDER) if f.endswith(".csv")]
 
-# Rename text columns
-for i, df in enumerate(dfs):
-    df.rename(columns={'text': f'text_v{i + 1}'}, inplace=True)
 
-# Merge on composite key
-merged_df = dfs[0]
-for i in range(1, len(dfs)):
-    subset = dfs[i][['relative_path', 'filename', 'page', f'text_v{i + 1}']]
-    merged_df = pd.merge(merged_df, subset, on=['relative_path', 'filename', 'page'], how='outer')
+def load_versions(filepaths):
+    """One row per page with its text from every CSV as text_v1, text_v2, ..., "" where a CSV lacks the page."""
+    # only the columns merged below, from the memory-mapped columnar copy when it is up to date
+    dfs = [load_corpus_frame(filepath, ['relative_path', 'filename', 'page', 'text']) for filepath in filepaths]
 
-merged_df = merged_df.fillna("")
-print(merged_df.shape)
+    for df in dfs:
+        df['relative_path'] = df['relative_path'].astype(str)
+        df['filename'] = df['filename'].astype(str)
+        df['page'] = df['page'].astype(str)  # Ensure page is string for safe merging
 
-# a little magic here to skip consolidated rows
+    # Rename text columns
+    for i, df in enumerate(dfs):
+        df.rename(columns={'text': f'text_v{i + 1}'}, inplace=True)
 
-if not REDO_EVERYTHING and os.path.exists(CONSOLIDATE_FILEPATH):
-    consolidated_docs = pd.read_csv(CONSOLIDATE_FILEPATH)
-    # if ['relative_path', 'filename', 'page'] combo is in consolidated_docs, remove it from merged
-    # only look at rows where it's not error
-    if "error" in consolidated_docs.columns:
-        consolidated_docs = consolidated_docs[consolidated_docs["error"].isna()]
+    # Merge on composite key
+    merged_df = dfs[0]
+    for i in range(1, len(dfs)):
+        subset = dfs[i][['relative_path', 'filename', 'page', f'text_v{i + 1}']]
+        merged_df = pd.merge(merged_df, subset, on=['relative_path', 'filename', 'page'], how='outer')
 
+    merged_df = merged_df.fillna("")
     merged_df['page'] = merged_df['page'].astype("int")
-    consolidated_docs['page'] = consolidated_docs['page'].astype("int")
+    return merged_df
 
-    merged_df = merged_df.merge(
-        consolidated_docs[['relative_path', 'filename', 'page']],
-        on=['relative_path', 'filename', 'page'],
-        how='left',
-        indicator=True
-    )
 
-    # Filter to keep only rows that exist in 'left_only' (merged_df)
-    # Then drop the helper column
-    merged_df = merged_df[merged_df['_merge'] == 'left_only'].drop(columns=['_merge'])
+def pending_pages(merged_df):
+    """The pages not consolidated yet, looked up in the progress ledger shared with gemini_ocr.py."""
+    if os.path.exists(CONSOLIDATE_FILEPATH):
+        # carry over progress from runs that only kept it in the output CSV
+        consolidated_docs = pd.read_csv(CONSOLIDATE_FILEPATH, usecols=['relative_path', 'filename', 'page', 'error'])
+        # only look at rows where it's not error
+        ledger.seed_from_frame(consolidated_docs[consolidated_docs["error"].isna()], LEDGER_STAGE)
+        del consolidated_docs
 
-print(merged_df.shape)
+    if REDO_EVERYTHING:
+        return merged_df
+    return merged_df[[
+        not ledger.is_done(page_key(r, f, p), LEDGER_STAGE)
+        for r, f, p in zip(merged_df['relative_path'], merged_df['filename'], merged_df['page'])]]
 
 
 # --- 4. PROCESSING LOOP ---
@@ -174,48 +181,181 @@ def clean_text(text):
     # and ensures implies surrounding quotes which helps separate the versions.
     text = re.sub(r'[\x00-\x1F\x7F-\x9F.*]', ' ', text).strip()
     text = text.replace('"""', '\\"\\"\\"')
-    return json.dumps(text)
+    return json.dumps(text, ensure_ascii=False)
 
 
-def construct_prompt(row):
-    """Creates the 'Judge' prompt with 4 versions of the text."""
-    return f"""
-You are an expert Thai Document Editor. I have processed a single document page using 4 different OCR methods. 
-Your job is to combine them into ONE perfect version and extract metadata.
-
-INPUT VERSIONS:
-Version 1: {clean_text(row.get('text_v1', ''))}
-Version 2: {clean_text(row.get('text_v2', ''))}
-Version 3: {clean_text(row.get('text_v3', ''))}
-Version 4: {clean_text(row.get('text_v4', ''))}
-
-INSTRUCTIONS:
+INSTRUCTIONS = """INSTRUCTIONS:
 1. **Consolidate & Fix**: Compare the versions to reconstruct the most likely original text. Fix Thai vowel issues (floating vowels) and spelling errors.
 2. **Metadata**: Analyze the content to identify the Document Type, Subject, and Key Entities.
 3. **Numbers**: Keep original numbers, but fix format errors (e.g., '1,0 00' -> '1,000').
 4. **Fix Common Thai OCR errors**: Fix broken vowels (e.g., 'เ- ก- า' -> 'เกา'). Fix confused numbers (Thai ๑ vs Arabic 1). 
 5. **DO NOT translate**: Keep the original language and wording as much as possible and only fix mistakes and typos. 
+"""
 
-OUTPUT FORMAT (Strict JSON):
-{{
+PAGE_OUTPUT_FORMAT = """{
     "clean_text": "The full corrected text of the page...",
     "doc_type": "The type of document (e.g., ระเบียบ,)",
     "subject": "A 1-sentence summary of the page context",
     "entities": "List of names, dates, or organizations found"
+}"""
+
+
+def input_versions(row):
+    return "\n".join(f"Version {i + 1}: {clean_text(row.get(f'text_v{i + 1}', ''))}" for i in range(4))
+
+
+def construct_prompt(row):
+    """Creates the 'Judge' prompt with 4 versions of the text."""
+    return f"""
+You are an expert Thai Document Editor. I have processed a single document page using 4 different OCR methods. 
+Your job is to combine them into ONE perfect version and extract metadata.
+
+INPUT VERSIONS:
+{input_versions(row)}
+
+{INSTRUCTIONS}
+OUTPUT FORMAT (Strict JSON):
+{PAGE_OUTPUT_FORMAT}
+"""
+
+
+def construct_batch_prompt(rows):
+    """The 'Judge' prompt for several pages at once: the instructions are sent once, answers come back keyed by page id."""
+    pages = "\n\n".join(f"PAGE {page_id}:\n{input_versions(row)}" for page_id, row in rows)
+    return f"""
+You are an expert Thai Document Editor. I have processed {len(rows)} document pages, each using 4 different OCR methods. 
+For EACH page separately, combine its versions into ONE perfect version and extract metadata. Never mix text between pages.
+
+{pages}
+
+{INSTRUCTIONS}
+OUTPUT FORMAT (Strict JSON): one object per page, keyed by its page id ({", ".join(f'"{page_id}"' for page_id, _ in rows)}):
+{{
+    "<page id>": {PAGE_OUTPUT_FORMAT.replace(chr(10), chr(10) + "    ")}
 }}
 """
 
 
-error_count = 0
+def estimate_tokens(row):
+    # OCR text is mostly Thai, which tokenizes at roughly CHARS_PER_TOKEN characters per token
+    return sum(len(str(row.get(f'text_v{i + 1}', ''))) for i in range(4)) // CHARS_PER_TOKEN + 1
+
+
+def usable_answer(page):
+    return isinstance(page, dict) and isinstance(page.get('clean_text'), str) and bool(page['clean_text'].strip())
+
+
+def split_batch_response(ai_data, page_ids):
+    """Answers of a batch request by page id, leaving out pages whose answer is missing or unusable."""
+    if not isinstance(ai_data, dict):
+        return {}
+    return {page_id: ai_data[page_id] for page_id in page_ids if usable_answer(ai_data.get(page_id))}
+
+
+class RequestStats:
+    """Requests, pages and tokens per prompt mode ("single" or "batch"), to compare the cost of the two."""
+
+    def __init__(self):
+        self.modes = {}
+        self.fallback_pages = 0
+        self.lock = threading.Lock()
+
+    def record(self, mode, pages, usage):
+        with self.lock:
+            stats = self.modes.setdefault(mode, {"requests": 0, "pages": 0, "prompt_tokens": 0, "output_tokens": 0})
+            stats["requests"] += 1
+            stats["pages"] += pages
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["output_tokens"] += usage.get("output_tokens") or 0
+
+    def summary(self):
+        summary = {"fallback_pages": self.fallback_pages}
+        for mode, stats in self.modes.items():
+            summary[mode] = dict(
+                stats,
+                pages_per_request=round(stats["pages"] / stats["requests"], 2),
+                tokens_per_page=round((stats["prompt_tokens"] + stats["output_tokens"]) / max(stats["pages"], 1), 1))
+        return summary
+
+
+request_stats = RequestStats()
+
+
+def run_request(model, payload):
+    """
+    Dispatcher call for a (mode, pages, prompt) payload, recording its token usage. Returns the answer and
+    the seconds it took per page.
+    """
+    mode, pages, prompt = payload
+    usage = {}
+    start = time.perf_counter()
+    ai_data = call_llm(prompt, model, usage)
+    request_stats.record(mode, pages, usage)
+    return ai_data, (time.perf_counter() - start) / pages
+
+
+# created by main(): the output, its progress ledger and the result cache, where a page's answer is reused
+# whenever the same OCR versions come up again, whichever model gave it
+sink = None
+ledger = None
+result_cache = None
+progress = None
+merged_df = None
+
+
+def page_cache_key(row):
+    return cache_key("cleanup", PROVIDER, construct_prompt(row))
 
-this_result = None
-print(f"Starting processing using provider: {PROVIDER.upper()}...")
 
-for index, this_row in tqdm(merged_df.iterrows(), total=merged_df.shape[0]):
-    # Skip empty rows
-    if all(this_row[f'text_v{i + 1}'] == "" for i in range(len(dfs))):
-        continue
+def cache_answer(row, answer, seconds):
+    if usable_answer(answer):
+        result_cache.put(LLM, page_cache_key(row), json.dumps(answer, ensure_ascii=False), seconds)
 
+
+def non_empty_rows():
+    versions = [c for c in merged_df.columns if c.startswith('text_v')]
+    for index, row in merged_df.iterrows():
+        # Skip empty rows
+        if all(row[c] == "" for c in versions):
+            continue
+        yield row
+
+
+def uncached_rows(rows):
+    """The rows without a cached answer; the others are written right away."""
+    for row in rows:
+        cached = None if REDO_EVERYTHING else result_cache.get(LLM, page_cache_key(row))
+        if cached is None:
+            yield row
+            continue
+        write_result(row, json.loads(cached), None)
+        progress.update(1)
+
+
+def pending_rows(rows):
+    for row in rows:
+        yield [row], ("single", 1, construct_prompt(row))
+
+
+def enumerate_pages(rows):
+    return ((f"p{i + 1}", row) for i, row in enumerate(rows))
+
+
+def pending_batches(rows):
+    """Packs consecutive pages into batches of at most BATCH_PAGES pages and BATCH_TOKEN_BUDGET input tokens."""
+    batch, budget = [], 0
+    for row in rows:
+        tokens = estimate_tokens(row)
+        if batch and (len(batch) >= BATCH_PAGES or budget + tokens > BATCH_TOKEN_BUDGET):
+            yield batch, ("batch", len(batch), construct_batch_prompt(list(enumerate_pages(batch))))
+            batch, budget = [], 0
+        batch.append(row)
+        budget += tokens
+    if batch:
+        yield batch, ("batch", len(batch), construct_batch_prompt(list(enumerate_pages(batch))))
+
+
+def write_result(this_row, ai_data, error):
     this_result = {
         'relative_path': this_row['relative_path'],
         'filename': this_row['filename'],
@@ -228,10 +368,7 @@ for index, this_row in tqdm(merged_df.iterrows(), total=merged_df.shape[0]):
         'vector_context': ''
     }
 
-    try:
-        new_prompt = construct_prompt(this_row)
-        ai_data = call_llm(new_prompt)
-
+    if error is None:
         entities = ai_data.get('entities', '')
         if hasattr(ai_data.get('entities'), '__len__'):
             entities = ",".join(entities)
@@ -244,21 +381,103 @@ for index, this_row in tqdm(merged_df.iterrows(), total=merged_df.shape[0]):
         # Metadata string for embedding
         this_result[
             'vector_context'] = f"Type: {ai_data.get('doc_type')} | Subject: {ai_data.get('subject')} | Entities: {entities}"
-
-        # Rate Limit Safety for Gemini (Free tier usually allows 15 RPM, Paid is higher)
-        if PROVIDER == 'gemini':
-            time.sleep(1)
-
-    except Exception as e:
-        print(f"Error processing {this_row['filename']} p{this_row['page']}: {e}")
-        # Fallback to raw text
-        this_result['error'] = str(e)
-        error_count += 1
-        time.sleep(6)  # sleep on it. It might hit RPM
-        if error_count >= 100:
-            print("too many error, likely caused by RPD limit reached")
-            break
     else:
-        error_count = 0
+        print(f"Error processing {this_row['filename']} p{this_row['page']}: {error}")
+        # Fallback to raw text
+        this_result['error'] = str(error)
+
+    sink.write(this_result)
+
+
+def record_progress(rows):
+    # called once the rows are on disk, so a crash in between only redoes these pages
+    for row in rows:
+        key = page_key(row['relative_path'], row['filename'], row['page'])
+        if row.get('error'):
+            ledger.mark_error(key, LEDGER_STAGE, row['error'])
+        else:
+            ledger.mark_done(key, LEDGER_STAGE)
+
+
+def main():
+    global PROVIDER, BATCH_PAGES, GEMINI_RPM, REDO_EVERYTHING, sink, ledger, result_cache, progress, merged_df
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", choices=["gemini", "ollama"], default=PROVIDER)
+    parser.add_argument("--batch-pages", type=int, default=BATCH_PAGES, help="pages per request, 1 for one each")
+    parser.add_argument("--rpm", type=float, default=GEMINI_RPM,
+                        help="Gemini requests per minute per model, 0 for no limit (e.g. against fake_gemini.py)")
+    parser.add_argument("--redo-everything", action="store_true", default=REDO_EVERYTHING)
+    args = parser.parse_args()
+    PROVIDER, BATCH_PAGES, GEMINI_RPM = args.provider, args.batch_pages, args.rpm or None
+    REDO_EVERYTHING = args.redo_everything
+
+    print("Loading and merging CSVs...")
+    merged_df = load_versions(csv_filepaths())
+    print(merged_df.shape)
+    ledger = ProgressLedger(LEDGER_FILEPATH)
+    merged_df = pending_pages(merged_df)
+    print(merged_df.shape)
+
+    result_cache = ResultCache(RESULT_CACHE_FILEPATH)
+    sink = ResultSink(CONSOLIDATE_FILEPATH, OUTPUT_COLUMNS, on_commit=record_progress)
+    print(f"Starting processing using provider: {PROVIDER.upper()}...")
+
+    dispatcher = GeminiDispatcher(
+        run_request,
+        GEMINI_MODEL if PROVIDER == 'gemini' else [OLLAMA_MODEL],
+        rpm=GEMINI_RPM if PROVIDER == 'gemini' else None,
+        max_in_flight=MAX_IN_FLIGHT if PROVIDER == 'gemini' else 1,
+    )
 
-    pd.DataFrame(this_result, index=[0]).to_csv(CONSOLIDATE_FILEPATH, index=False, mode='a', header=False)
+    # pages whose batch answer failed validation are retried one page per request afterwards
+    fallback = []
+    exhausted = False
+    rows_to_send = uncached_rows(non_empty_rows())
+    work = pending_batches(rows_to_send) if BATCH_PAGES > 1 else pending_rows(rows_to_send)
+    progress = tqdm(total=merged_df.shape[0])
+    for these_rows, result, error in dispatcher.imap_unordered(work):
+        if isinstance(error, RateLimitExhausted):
+            print("every model is still rate limited, likely caused by RPD limit reached")
+            exhausted = True
+            break
+        ai_data, seconds = result if error is None else (None, 0.0)
+        if BATCH_PAGES <= 1:
+            write_result(these_rows[0], ai_data, error)
+            if error is None:
+                cache_answer(these_rows[0], ai_data, seconds)
+        else:
+            pages = dict(enumerate_pages(these_rows))
+            answers = split_batch_response(ai_data, list(pages)) if error is None else {}
+            for page_id, this_row in pages.items():
+                if page_id in answers:
+                    write_result(this_row, answers[page_id], None)
+                    cache_answer(this_row, answers[page_id], seconds)
+                else:
+                    fallback.append(this_row)
+        progress.update(len(these_rows))
+
+    if fallback and not exhausted:
+        print(f"retrying {len(fallback)} pages one at a time")
+        request_stats.fallback_pages = len(fallback)
+        for these_rows, result, error in dispatcher.imap_unordered(pending_rows(fallback)):
+            if isinstance(error, RateLimitExhausted):
+                print("every model is still rate limited, likely caused by RPD limit reached")
+                break
+            ai_data, seconds = result if error is None else (None, 0.0)
+            write_result(these_rows[0], ai_data, error)
+            if error is None:
+                cache_answer(these_rows[0], ai_data, seconds)
+    progress.close()
+
+    dispatcher.close()
+    sink.close()
+    print(dispatcher.stats.summary())
+    print(request_stats.summary())
+    print(result_cache.stats())
+    result_cache.close()
+    print({"done": ledger.count(LEDGER_STAGE, DONE), "error": ledger.count(LEDGER_STAGE, ERROR)})
+    ledger.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Columnar copies of the corpus CSVs (text/summary_*.csv, text_cleaned/*.csv) as uncompressed Arrow IPC files.
+
+An .arrow file is memory-mapped on load: page and text columns are used in place, so loading takes milliseconds
+and every process serving the same file shares one copy through the page cache. A copy converted from a CSV
+records the CSV's (mtime_ns, size) and is ignored once the CSV changes.
+
+    python corpus_format.py [file.csv ...]
+"""
+import os
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+COLUMNAR_EXTENSION = ".arrow"
+CORE_COLUMNS = ["relative_path", "filename", "page", "text", "engine", "lang"]
+SIGNATURE_KEY = b"source_signature"
+
+
+def columnar_location(csv_filepath: str) -> str:
+    return os.path.splitext(csv_filepath)[0] + COLUMNAR_EXTENSION
+
+
+def is_columnar(filepath: str) -> bool:
+    return filepath.endswith(COLUMNAR_EXTENSION)
+
+
+def preferred_location(csv_filepath: str) -> str:
+    """The CSV if it exists, otherwise its columnar copy if that exists, e.g. once the CSVs have been archived."""
+    if not os.path.exists(csv_filepath) and os.path.exists(columnar_location(csv_filepath)):
+        return columnar_location(csv_filepath)
+    return csv_filepath
+
+
+def condition_of(filepath: str) -> Tuple[str, str]:
+    """(engine, lang) of a summary_{engine}_{lang} file, ("", "") for other corpora."""
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    if not name.startswith("summary_"):
+        return "", ""
+    engine, _, lang = name[len("summary_"):].partition("_")
+    return engine, lang
+
+
+def read_csv_frame(filepath: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Reads a summary_{engine}_{lang}.csv into a compact frame: repeated path/filename values become
+    categoricals, page becomes int32 and missing text becomes "". cleaned_consolidated_docs.csv is
+    read the same way, using its clean_text column as the text.
+    """
+    text = pd.read_csv(filepath, dtype={"filename": "string", "text": "string", "clean_text": "string"})
+    text = text.drop(columns=[c for c in text.columns if c.startswith("Unnamed:")])
+    if "text" not in text.columns and "clean_text" in text.columns:
+        text["text"] = text.pop("clean_text")
+    text["relative_path"] = text["relative_path"].astype(str).astype("category")
+    text["text"] = text["text"].fillna("")
+    text["filename"] = text["filename"].astype("category")
+    text["page"] = text["page"].astype("int32")
+    return text[list(columns)] if columns is not None else text
+
+
+def write_columnar(frame: pd.DataFrame, filepath: str, engine: str = "", lang: str = "",
+                   source_signature: Optional[Sequence[int]] = None):
+    """Writes the frame with the typed core columns first; other columns are kept as strings."""
+    n = len(frame)
+    extra = [c for c in frame.columns if c not in CORE_COLUMNS]
+    arrays = [
+        pa.array(frame["relative_path"].astype("category"), pa.dictionary(pa.int32(), pa.string())),
+        pa.array(frame["filename"].astype("category"), pa.dictionary(pa.int32(), pa.string())),
+        pa.array(frame["page"].to_numpy(np.int32), pa.int32()),
+        pa.array(frame["text"].fillna("").astype(str), pa.large_string()),
+        pa.DictionaryArray.from_arrays(pa.array(np.zeros(n, np.int32)), pa.array([engine])),
+        pa.DictionaryArray.from_arrays(pa.array(np.zeros(n, np.int32)), pa.array([lang])),
+    ] + [pa.array(frame[c].astype("string"), pa.large_string()) for c in extra]
+    metadata = {}
+    if source_signature is not None:
+        metadata[SIGNATURE_KEY] = ",".join(str(int(v)) for v in source_signature).encode()
+    table = pa.table(arrays, names=CORE_COLUMNS + extra, metadata=metadata)
+
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    tmp_filepath = f"{filepath}.tmp"
+    with pa.OSFile(tmp_filepath, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    # readers keep their mapping of the old file until they reload
+    os.replace(tmp_filepath, filepath)
+
+
+def _to_pandas_type(arrow_type: pa.DataType):
+    # strings stay in the mapped Arrow buffers instead of becoming one Python object per row
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def read_columnar(filepath: str, columns: Optional[Sequence[str]] = None,
+                  source_signature: Optional[Sequence[int]] = None) -> Optional[pd.DataFrame]:
+    """
+    Memory-maps an .arrow corpus and returns the requested columns, or None if the file is missing or was
+    converted from a different version of its CSV than source_signature.
+    """
+    if not os.path.exists(filepath):
+        return None
+    reader = pa.ipc.open_file(pa.memory_map(filepath, "r"))
+    if source_signature is not None:
+        stored = (reader.schema.metadata or {}).get(SIGNATURE_KEY)
+        if stored != ",".join(str(int(v)) for v in source_signature).encode():
+            return None
+    table = reader.read_all()
+    if columns is not None:
+        table = table.select(list(columns))
+    return table.to_pandas(types_mapper=_to_pandas_type)
+
+
+def convert(csv_filepath: str, columnar_filepath: Optional[str] = None) -> str:
+    from corpus_store import file_signature
+
+    columnar_filepath = columnar_filepath or columnar_location(csv_filepath)
+    signature = file_signature(csv_filepath)
+    engine, lang = condition_of(csv_filepath)
+    write_columnar(read_csv_frame(csv_filepath), columnar_filepath, engine, lang, signature)
+    return columnar_filepath
+
+
+def main(csv_filepaths: List[str]):
+    """Converts the given CSVs, by default every text/summary_*.csv and the cleaned docs."""
+    if not csv_filepaths:
+        csv_filepaths = [os.path.join("text", f) for f in sorted(os.listdir("text"))
+                         if f.startswith("summary_") and f.endswith(".csv")]
+        cleaned = os.path.join("text_cleaned", "cleaned_consolidated_docs.csv")
+        if os.path.exists(cleaned):
+            csv_filepaths.append(cleaned)
+
+    for csv_filepath in csv_filepaths:
+        columnar_filepath = convert(csv_filepath)
+        print(csv_filepath, "->", columnar_filepath, os.path.getsize(columnar_filepath), "bytes")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import corpus_format
+import search_index
+from search_index import GroupedIndex, InvertedIndex, TextIndex, TitleIndex, TrigramIndex
+
+# (mtime_ns, size) of a corpus file, used to detect when it has been rewritten
+Signature = Tuple[int, int]
+
+
+def file_signature(filepath: str) -> Signature:
+    st = os.stat(filepath)
+    return st.st_mtime_ns, st.st_size
+
+
+def load_corpus_frame(filepath: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    The corpus as a compact frame (see corpus_format.read_csv_frame), optionally only some columns.
+    Reads the memory-mapped columnar copy when it is up to date with the CSV, and the CSV otherwise.
+    """
+    if corpus_format.is_columnar(filepath):
+        return corpus_format.read_columnar(filepath, columns)
+    frame = corpus_format.read_columnar(corpus_format.columnar_location(filepath), columns, file_signature(filepath))
+    if frame is None:
+        frame = corpus_format.read_csv_frame(filepath, columns)
+    return frame
+
+
+def ensure_columnar(filepath: str, signature: Signature) -> bool:
+    """Converts a CSV corpus whose columnar copy is missing or stale. Returns whether a conversion happened."""
+    if corpus_format.is_columnar(filepath):
+        return False
+    columnar_filepath = corpus_format.columnar_location(filepath)
+    if corpus_format.read_columnar(columnar_filepath, [], signature) is not None:
+        return False
+    try:
+        engine, lang = corpus_format.condition_of(filepath)
+        corpus_format.write_columnar(corpus_format.read_csv_frame(filepath), columnar_filepath, engine, lang,
+                                     signature)
+    except OSError as e:
+        print(f"could not write {columnar_filepath}, serving from the CSV: {e}")
+        return False
+    return True
+
+
+def page_key_hashes(frame: pd.DataFrame) -> np.ndarray:
+    """A uint64 per row identifying its (relative_path, filename, page), comparable across corpora."""
+    return pd.util.hash_pandas_object(frame[["relative_path", "filename", "page"]], index=False).to_numpy()
+
+
+@dataclass
+class DocumentView:
+    """
+    The corpus grouped by (filename, relative_path), materialized once at load time.
+
+    frame has one row per document (filename, relative_path, n_pages). The page rows of document d are
+    page_rows[offsets[d]:offsets[d + 1]], in page order, and doc_ids maps every page row to its document.
+    """
+    frame: pd.DataFrame
+    doc_ids: np.ndarray
+    offsets: np.ndarray
+    page_rows: np.ndarray
+    text_index: Optional[GroupedIndex] = None
+    title_index: Optional[GroupedIndex] = None
+
+    def pages_of(self, doc: int) -> np.ndarray:
+        return self.page_rows[self.offsets[doc]:self.offsets[doc + 1]]
+
+    def memory_bytes(self) -> int:
+        return int(self.frame.memory_usage(deep=True).sum() + self.doc_ids.nbytes + self.offsets.nbytes
+                   + self.page_rows.nbytes)
+
+
+def build_document_view(frame: pd.DataFrame, text_index: Optional[TextIndex] = None,
+                        title_index: Optional[TitleIndex] = None) -> DocumentView:
+    doc_ids = frame.groupby(["filename", "relative_path"], observed=True, sort=False).ngroup().to_numpy(np.int32)
+    n_docs = int(doc_ids.max()) + 1 if len(doc_ids) else 0
+    page_rows = np.lexsort((frame["page"].to_numpy(), doc_ids)).astype(np.int32)
+    n_pages = np.bincount(doc_ids, minlength=n_docs)
+    offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(n_pages, out=offsets[1:])
+    docs = frame.iloc[page_rows[offsets[:-1]]][["filename", "relative_path"]].reset_index(drop=True)
+    docs["n_pages"] = n_pages.astype(np.int32)
+    return DocumentView(
+        docs, doc_ids, offsets, page_rows,
+        GroupedIndex(text_index, doc_ids, n_docs) if text_index is not None else None,
+        GroupedIndex(title_index, doc_ids, n_docs, repeated=True) if title_index is not None else None,
+    )
+
+
+@dataclass
+class Corpus:
+    filepath: str
+    signature: Signature
+    frame: pd.DataFrame
+    text_index: Optional[TextIndex] = None
+    title_index: Optional[TitleIndex] = None
+    documents: Optional[DocumentView] = None
+    page_keys: Optional[np.ndarray] = None
+    text_trigrams: Optional[TrigramIndex] = None
+    title_trigrams: Optional[TrigramIndex] = None
+    loaded_at: float = field(default_factory=time.time)
+
+    def memory_bytes(self) -> int:
+        size = int(self.frame.memory_usage(deep=True).sum())
+        for index in (self.text_index, self.title_index, self.text_trigrams, self.title_trigrams):
+            if index is not None:
+                size += index.nbytes
+        if self.documents is not None:
+            size += self.documents.memory_bytes()
+        if self.page_keys is not None:
+            size += self.page_keys.nbytes
+        return size
+
+
+def load_corpus(filepath: str, signature: Signature) -> Corpus:
+    """
+    Loads the frame with its token and trigram indexes, reusing the persisted indexes when they match this file
+    version.
+    A CSV is converted to its columnar copy first, so later loads (and other worker processes) map it instead.
+    """
+    ensure_columnar(filepath, signature)
+    frame = load_corpus_frame(filepath)
+    text_tokens = search_index.load_or_build(search_index.index_location(filepath, "text"),
+                                             frame["text"], signature)
+    title_tokens = search_index.load_or_build(search_index.index_location(filepath, "title"),
+                                              search_index.field_texts("title", frame["filename"]), signature)
+    text_trigrams = search_index.load_or_build(search_index.index_location(filepath, "text_trigrams"),
+                                               frame["text"], signature, index_class=TrigramIndex)
+    title_trigrams = search_index.load_or_build(search_index.index_location(filepath, "title_trigrams"),
+                                                frame["filename"].astype(str), signature, index_class=TrigramIndex)
+    codes, names = pd.factorize(frame["filename"].astype(str))
+    title_index = TitleIndex(title_tokens, title_trigrams, list(names), codes.astype(np.int32))
+    text_index = TextIndex(text_tokens, text_trigrams, frame["text"])
+    return Corpus(filepath, signature, frame, text_index, title_index,
+                  build_document_view(frame, text_index, title_index), page_key_hashes(frame),
+                  text_trigrams, title_trigrams)
+
+
+class CorpusStore:
+    """
+    Process-wide cache of loaded corpora keyed by file path.
+
+    A corpus is loaded on first use (or by preload()) and reloaded only when the file's mtime or size
+    changes. Reloads build a new Corpus and swap it into the table in one assignment, so requests
+    already holding the old object keep using it undisturbed.
+    """
+
+    def __init__(self, loader: Callable[[str, Signature], Corpus] = load_corpus):
+        self._loader = loader
+        self._entries: Dict[str, Corpus] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _lock_for(self, filepath: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(filepath, threading.Lock())
+
+    def get(self, filepath: str) -> Corpus:
+        signature = file_signature(filepath)
+        corpus = self._entries.get(filepath)
+        if corpus is not None and corpus.signature == signature:
+            self.hits += 1
+            return corpus
+
+        with self._lock_for(filepath):
+            # another thread may have finished loading while we were waiting for the lock
+            corpus = self._entries.get(filepath)
+            signature = file_signature(filepath)
+            if corpus is not None and corpus.signature == signature:
+                self.hits += 1
+                return corpus
+            if corpus is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            corpus = self._loader(filepath, signature)
+            self._entries[filepath] = corpus
+            return corpus
+
+    def preload(self, filepaths: Iterable[str]):
+        for filepath in filepaths:
+            if os.path.exists(filepath):
+                self.get(filepath)
+
+    def evict(self, filepath: Optional[str] = None):
+        if filepath is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(filepath, None)
+
+    def stats(self) -> dict:
+        entries = dict(self._entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "memory_bytes": sum(c.memory_bytes() for c in entries.values()),
+            "corpora": {
+                path: {"rows": len(c.frame),
+                       "documents": len(c.documents.frame) if c.documents is not None else None,
+                       "memory_bytes": c.memory_bytes(), "loaded_at": c.loaded_at}
+                for path, c in entries.items()
+            },
+        }
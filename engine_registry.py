@@ -0,0 +1,94 @@
+"""
+Heavy engines and models (easyocr readers, the PyThaiNLP dictionary, Gemini clients) created on first use,
+once per process, instead of at import time. The module that owns an engine registers a loader under a name;
+registry.get(name, *args) builds the object the first time and records how long that took, next to any phases
+timed with registry.timed(), so stats() shows where startup time goes.
+
+    python engine_registry.py [name[:arg] ...]
+
+loads the named engines (default: the Thai tokenizer and the Gemini client, e.g. easyocr:tha for an easyocr
+reader) and prints the load times.
+"""
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+_MISSING = object()
+
+
+class Registry:
+    def __init__(self):
+        self._loaders: Dict[str, Callable[..., Any]] = {}
+        self._objects: Dict[Tuple[Hashable, ...], Any] = {}
+        # one lock per object, so loading one engine does not hold up the others
+        self._locks: Dict[Tuple[Hashable, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.load_seconds: Dict[str, float] = {}
+        self.phase_seconds: Dict[str, float] = {}
+
+    def register(self, name: str, loader: Callable[..., Any]) -> Callable[..., Any]:
+        self._loaders[name] = loader
+        return loader
+
+    def get(self, name: str, *args: Hashable) -> Any:
+        """The object loader(*args) of name returned, loading it on the first call."""
+        key = (name,) + args
+        obj = self._objects.get(key, _MISSING)
+        if obj is not _MISSING:
+            return obj
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            obj = self._objects.get(key, _MISSING)
+            if obj is _MISSING:
+                start = time.perf_counter()
+                obj = self._loaders[name](*args)
+                self.load_seconds[":".join(map(str, key))] = time.perf_counter() - start
+                self._objects[key] = obj
+        return obj
+
+    def loaded(self, name: str, *args: Hashable) -> bool:
+        return (name,) + args in self._objects
+
+    def warm(self, *names: str) -> Dict[str, float]:
+        """Loads the named engines now, e.g. before a server takes requests, and returns the seconds each took."""
+        seconds = {}
+        for name in names:
+            start = time.perf_counter()
+            self.get(name)
+            seconds[name] = time.perf_counter() - start
+        return seconds
+
+    @contextmanager
+    def timed(self, phase: str):
+        """Records the seconds the block takes as a startup phase, e.g. with registry.timed("corpora")."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[phase] = time.perf_counter() - start
+
+    def stats(self) -> Dict[str, Any]:
+        return {"registered": sorted(self._loaders),
+                "load_seconds": {k: round(v, 3) for k, v in self.load_seconds.items()},
+                "phase_seconds": {k: round(v, 3) for k, v in self.phase_seconds.items()}}
+
+
+registry = Registry()
+
+
+def main(*names: str):
+    # importing the owners registers their engines, in the imported module rather than this __main__
+    import engine_registry
+    import gemini_client
+    import ocr_engines  # noqa: F401
+    import search_index
+    for name in names or [search_index.THAI_TOKENIZER, gemini_client.GEMINI_CLIENT]:
+        engine_registry.registry.get(*name.split(":"))
+    print(engine_registry.registry.stats())
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
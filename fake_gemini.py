@@ -0,0 +1,143 @@
+"""
+A local stand-in for the Gemini REST endpoint (POST /v1beta/models/{model}:generateContent) with configurable
+latency, per-model RPM limits and injected 429/500 errors, to exercise gemini_client without spending quota.
+
+    python fake_gemini.py --port 8089 --latency 0.5 --rpm 10 --error-rate 0.05
+
+then point a client at it:
+
+    genai.Client(api_key="fake", http_options=types.HttpOptions(base_url="http://127.0.0.1:8089"))
+
+or run gemini_ocr.py / cleanup_text.py with GEMINI_API_KEY=fake GOOGLE_GEMINI_BASE_URL=http://127.0.0.1:8089
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Optional
+
+# the "PAGE <id>:" headers of a cleanup_text.py batch prompt, answered with one object per page id
+BATCH_PAGE = re.compile(r"^PAGE (\S+):$", re.MULTILINE)
+
+
+def default_responder(model: str, prompt: str, json_mode: bool) -> str:
+    if json_mode:
+        page = {"clean_text": prompt[:200], "doc_type": "fake", "subject": f"answered by {model}", "entities": []}
+        page_ids = BATCH_PAGE.findall(prompt)
+        return json.dumps({page_id: page for page_id in page_ids} if page_ids else page, ensure_ascii=False)
+    return f"fake text from {model}"
+
+
+class FakeGemini:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.0,
+                 rpm: Optional[float] = None, error_rate: float = 0.0, server_error_rate: float = 0.0,
+                 responder: Callable[[str, str, bool], str] = default_responder):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.responder = responder
+        self.calls: Dict[str, Deque[float]] = {}
+        self.counts = {"ok": 0, "rate_limited": 0, "server_error": 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _over_limit(self, model: str) -> bool:
+        if not self.rpm:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            window = self.calls.setdefault(model, deque())
+            while window and window[0] <= now - 60:
+                window.popleft()
+            if len(window) >= self.rpm:
+                return True
+            window.append(now)
+            return False
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: dict):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                model = self.path.split("/models/", 1)[-1].split(":", 1)[0]
+                time.sleep(max(0.0, fake.latency + random.uniform(-fake.jitter, fake.jitter)))
+                if fake._over_limit(model) or random.random() < fake.error_rate:
+                    with fake.lock:
+                        fake.counts["rate_limited"] += 1
+                    return self._send(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                      "message": "Resource has been exhausted (e.g. check quota)."}})
+                if random.random() < fake.server_error_rate:
+                    with fake.lock:
+                        fake.counts["server_error"] += 1
+                    return self._send(500, {"error": {"code": 500, "status": "INTERNAL", "message": "injected"}})
+                prompt = " ".join(part.get("text", "") for content in request.get("contents", [])
+                                  for part in content.get("parts", []))
+                config = request.get("generationConfig") or {}
+                text = fake.responder(model, prompt, config.get("responseMimeType") == "application/json")
+                with fake.lock:
+                    fake.counts["ok"] += 1
+                self._send(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": len(prompt) // 4 + 1,
+                                      "candidatesTokenCount": len(text) // 4 + 1,
+                                      "totalTokenCount": (len(prompt) + len(text)) // 4 + 2},
+                    "modelVersion": model,
+                })
+
+        return Handler
+
+    def start(self) -> "FakeGemini":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=None, help="requests per minute allowed per model")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="probability of an injected 500")
+    args = parser.parse_args()
+    fake_server = FakeGemini(args.host, args.port, args.latency, args.jitter, args.rpm, args.error_rate,
+                             args.server_error_rate)
+    print(f"fake Gemini listening on {fake_server.base_url}")
+    fake_server.server.serve_forever()
@@ -0,0 +1,123 @@
+"""
+A local stand-in for Ollama's POST /api/chat, streaming newline-delimited JSON the way Ollama does, with a
+configurable time to first token and per-token latency, to exercise basic_rag and /docsearch/ask.
+
+    python fake_ollama.py --port 11435 --ttft 0.3 --token-latency 0.02
+
+then run the app with OLLAMA_URL=http://127.0.0.1:11435/api/chat
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+
+def default_responder(model: str, messages: List[Dict[str, str]]) -> List[str]:
+    question = messages[-1]["content"] if messages else ""
+    return [f"fake answer from {model}", " to", f" {len(question)}", " characters", "."]
+
+
+class FakeOllama:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ttft: float = 0.1, token_latency: float = 0.01,
+                 responder: Callable[[str, List[Dict[str, str]]], List[str]] = default_responder):
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.responder = responder
+        self.requests: List[dict] = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/api/chat"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _chunk(self, body: dict):
+                data = (json.dumps(body, ensure_ascii=False) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                if self.path != "/api/chat":
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with fake.lock:
+                    fake.requests.append(request)
+                model = request.get("model", "")
+                tokens = fake.responder(model, request.get("messages", []))
+                start = time.perf_counter()
+
+                def message(content):
+                    return {"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                            "message": {"role": "assistant", "content": content}}
+
+                if not request.get("stream", True):
+                    time.sleep(fake.ttft + fake.token_latency * len(tokens))
+                    data = json.dumps(dict(message("".join(tokens)), done=True)).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(fake.ttft)
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(fake.token_latency)
+                    self._chunk(dict(message(token), done=False))
+                self._chunk(dict(message(""), done=True, done_reason="stop", eval_count=len(tokens),
+                                 total_duration=int((time.perf_counter() - start) * 1e9)))
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+    def start(self) -> "FakeOllama":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.1, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds between tokens")
+    args = parser.parse_args()
+    fake_server = FakeOllama(args.host, args.port, args.ttft, args.token_latency)
+    print(f"fake Ollama listening on {fake_server.chat_url}")
+    fake_server.server.serve_forever()
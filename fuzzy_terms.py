@@ -0,0 +1,260 @@
+"""
+OCR-error-tolerant expansion of query terms against a corpus vocabulary, for /docsearch/search?fuzzy=true.
+
+Vocabulary terms are normalized the Thai-aware way (zero-width characters, tone mark and vowel order, doubled
+marks, nikhahit + sara aa, Thai digits) and indexed SymSpell-style: every normalized form is stored under all
+its deletions of up to MAX_DISTANCE characters within its first PREFIX_LENGTH characters. A query term then
+needs only its own few deletions looked up, and the candidates are confirmed by edit distance, so expanding
+costs the same however large the vocabulary. The index is persisted as index/<corpus>.fuzzy.npz.
+"""
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import search_index
+from corpus_store import Corpus, Signature
+from engine_registry import registry
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+MAX_EXPANSIONS = 5
+DISTANCE_WEIGHT = 0.7
+# edit distance allowed by the length of the normalized query term; short terms are only matched normalized
+DISTANCE_BY_LENGTH = [(3, 0), (6, 1)]
+
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+THAI_NORMALIZER = "thai_normalizer"
+
+
+def _load_normalizer() -> Callable[[str], str]:
+    from pythainlp.util import normalize
+    return normalize
+
+
+registry.register(THAI_NORMALIZER, _load_normalizer)
+
+
+def normalize_term(term: str) -> str:
+    """The form OCR variants of a term share: Thai digits as ASCII, marks in standard order, lower case."""
+    term = unicodedata.normalize("NFC", term)
+    if any("฀" <= c <= "๿" for c in term):
+        term = registry.get(THAI_NORMALIZER)(term)
+    return term.translate(THAI_DIGITS).lower()
+
+
+def allowed_distance(form: str) -> int:
+    for below, distance in DISTANCE_BY_LENGTH:
+        if len(form) < below:
+            return distance
+    return MAX_DISTANCE
+
+
+def deletions(form: str, max_distance: int = MAX_DISTANCE) -> List[str]:
+    """form's prefix and every string made by deleting up to max_distance of its characters."""
+    found = {form[:PREFIX_LENGTH]}
+    edge = list(found)
+    for _ in range(max_distance):
+        edge = [w[:i] + w[i + 1:] for w in edge if len(w) > 1 for i in range(len(w))]
+        edge = [w for w in edge if w not in found]
+        found.update(edge)
+    return list(found)
+
+
+def _hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (transpositions count once), or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    """
+    forms are the distinct normalized vocabulary terms, each with the original terms that normalize to it
+    (terms[offsets[f]:offsets[f + 1]]) and its highest document frequency. The deletion index maps the hash
+    of every deletion (sorted delete_keys) to form ids (delete_forms).
+    """
+
+    def __init__(self, forms: List[str], terms: List[str], offsets: np.ndarray, frequencies: np.ndarray,
+                 delete_keys: np.ndarray, delete_forms: np.ndarray):
+        self.forms = forms
+        self.terms = terms
+        self.offsets = offsets
+        self.frequencies = frequencies
+        self.delete_keys = delete_keys
+        self.delete_forms = delete_forms
+        self._terms = set(terms)
+
+    @classmethod
+    def build(cls, index: search_index.InvertedIndex) -> "FuzzyIndex":
+        by_form: Dict[str, List[str]] = {}
+        for term in index.vocab:
+            if term.strip():
+                by_form.setdefault(normalize_term(term), []).append(term)
+        forms = sorted(by_form)
+        terms = [term for form in forms for term in by_form[form]]
+        offsets = np.zeros(len(forms) + 1, dtype=np.int64)
+        np.cumsum([len(by_form[form]) for form in forms], out=offsets[1:])
+        document_frequency = np.diff(index.offsets)
+        frequencies = np.array([max(document_frequency[index.vocab[t]] for t in by_form[form]) for form in forms],
+                               dtype=np.int32)
+        keys, form_ids = [], []
+        for form_id, form in enumerate(forms):
+            for deletion in deletions(form, allowed_distance(form)):
+                keys.append(_hash(deletion))
+                form_ids.append(form_id)
+        keys = np.array(keys, dtype=np.uint64)
+        form_ids = np.array(form_ids, dtype=np.int32)
+        order = np.argsort(keys, kind="stable")
+        return cls(forms, terms, offsets, frequencies, keys[order], form_ids[order])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.offsets.nbytes + self.frequencies.nbytes + self.delete_keys.nbytes
+                   + self.delete_forms.nbytes + sum(len(t) for t in self.forms) + sum(len(t) for t in self.terms))
+
+    def known(self, term: str) -> bool:
+        return term in self._terms
+
+    def _forms_with(self, keys: Sequence[int]) -> np.ndarray:
+        keys = np.array(keys, dtype=np.uint64)
+        start = np.searchsorted(self.delete_keys, keys, side="left")
+        end = np.searchsorted(self.delete_keys, keys, side="right")
+        if not len(keys) or not (end - start).any():
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.delete_forms[s:e] for s, e in zip(start, end)]))
+
+    def expand(self, term: str, max_expansions: int = MAX_EXPANSIONS) -> List[Tuple[str, int]]:
+        """
+        Vocabulary terms within the allowed edit distance of term once both are normalized, as (term, distance),
+        closest and then most frequent first, at most max_expansions of them.
+        """
+        form = normalize_term(term)
+        if not form.strip():
+            return []
+        distance = allowed_distance(form)
+        matches = []
+        for form_id in self._forms_with([_hash(d) for d in deletions(form, distance)]):
+            found = edit_distance(form, self.forms[form_id], distance)
+            if found <= distance:
+                matches.append((found, -int(self.frequencies[form_id]), int(form_id)))
+        expansions: List[Tuple[str, int]] = []
+        for found, _, form_id in sorted(matches):
+            for vocabulary_term in self.terms[self.offsets[form_id]:self.offsets[form_id + 1]]:
+                expansions.append((vocabulary_term, found))
+        expansions.sort(key=lambda e: (e[1], e[0] != term))
+        return expansions[:max_expansions]
+
+    def save(self, filepath: str, signature: Optional[Sequence[int]] = None):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        tmp_filepath = f"{filepath}.tmp.npz"
+        np.savez(tmp_filepath,
+                 version=np.array([search_index.INDEX_VERSION]),
+                 signature=np.array(signature if signature is not None else [-1, -1], dtype=np.int64),
+                 forms=np.frombuffer(json.dumps(self.forms, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                 terms=np.frombuffer(json.dumps(self.terms, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                 offsets=self.offsets,
+                 frequencies=self.frequencies,
+                 delete_keys=self.delete_keys,
+                 delete_forms=self.delete_forms)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath: str, signature: Optional[Sequence[int]] = None) -> Optional["FuzzyIndex"]:
+        if not os.path.exists(filepath):
+            return None
+        with np.load(filepath) as data:
+            if int(data["version"][0]) != search_index.INDEX_VERSION:
+                return None
+            if signature is not None and tuple(data["signature"]) != tuple(signature):
+                return None
+            return cls(json.loads(data["forms"].tobytes().decode("utf-8")),
+                       json.loads(data["terms"].tobytes().decode("utf-8")), data["offsets"], data["frequencies"],
+                       data["delete_keys"], data["delete_forms"])
+
+
+class FuzzyStore:
+    """The fuzzy index of each corpus' text vocabulary, built (or loaded) on first use per corpus version."""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Signature, FuzzyIndex]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, corpus: Corpus) -> FuzzyIndex:
+        entry = self._entries.get(corpus.filepath)
+        if entry is not None and entry[0] == corpus.signature:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(corpus.filepath)
+            if entry is None or entry[0] != corpus.signature:
+                filepath = search_index.index_location(corpus.filepath, "fuzzy")
+                index = FuzzyIndex.load(filepath, corpus.signature)
+                if index is None:
+                    index = FuzzyIndex.build(corpus.text_index.index)
+                    index.save(filepath, corpus.signature)
+                entry = corpus.signature, index
+                self._entries[corpus.filepath] = entry
+            return entry[1]
+
+    def stats(self) -> dict:
+        return {path: {"forms": len(index.forms), "deletions": len(index.delete_keys), "memory_bytes": index.nbytes}
+                for path, (_, index) in dict(self._entries).items()}
+
+
+def distance_weight(distance: int) -> float:
+    """The share of a term's BM25 score a row gets for containing an expansion at this edit distance."""
+    return DISTANCE_WEIGHT ** distance
+
+
+def expand_terms(index: FuzzyIndex, tokens: Sequence[str],
+                 max_expansions: int = MAX_EXPANSIONS) -> List[Tuple[str, List[Tuple[str, int]]]]:
+    """
+    Each distinct query term with its alternatives as (term, distance): the term itself, so it still matches as
+    it would without expansion, then up to max_expansions other vocabulary terms.
+
+    tokens are word_tokenize output, whitespace included. A misspelled word tends to be split into fragments
+    that are not words of the corpus, so a run of tokens between whitespace with such a fragment is first
+    expanded whole, and only split into its tokens when nothing is close to it.
+    """
+    def alternatives(term: str) -> List[Tuple[str, int]]:
+        found = [(t, d) for t, d in index.expand(term, max_expansions + 1) if t != term]
+        return [(term, 0)] + found[:max_expansions]
+
+    runs: List[List[str]] = [[]]
+    for token in tokens:
+        if token.strip():
+            runs[-1].append(token)
+        elif runs[-1]:
+            runs.append([])
+    expanded: Dict[str, List[Tuple[str, int]]] = {}
+    for run in runs:
+        if len(run) > 1 and not all(index.known(t) for t in run):
+            joined = "".join(run)
+            whole = alternatives(joined)
+            if len(whole) > 1:
+                expanded.setdefault(joined, whole)
+                continue
+        for term in run:
+            if term not in expanded:
+                expanded[term] = alternatives(term)
+    return list(expanded.items())
@@ -0,0 +1,237 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from engine_registry import registry
+
+GEMINI_CLIENT = "gemini_client"
+
+
+class RateLimitExhausted(Exception):
+    """Every model stayed rate limited through all retries, which usually means the daily quota is spent."""
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """429 / RESOURCE_EXHAUSTED / quota errors from google-genai, Ollama or a plain HTTP client."""
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    if code == 429:
+        return True
+    message = str(e).lower()
+    return "429" in message or "resource_exhausted" in message or "quota" in message or "rate limit" in message
+
+
+class TokenBucket:
+    """Allows rate_per_minute acquisitions per minute, with bursts of up to capacity (default: 1)."""
+
+    def __init__(self, rate_per_minute: Optional[float], capacity: float = 1):
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        if self.rate is None:
+            return 0.0
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def available(self) -> float:
+        if self.rate is None:
+            return float("inf")
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class ModelRouter:
+    """
+    One token bucket per model plus a cool-down set after a rate-limit error. acquire() picks the model with
+    the most spare quota and blocks until some model is usable.
+    """
+
+    def __init__(self, models: List[str], rpm: Union[None, float, Dict[str, float]] = None, burst: float = 1):
+        self.models = list(models)
+        rpm_of = rpm if isinstance(rpm, dict) else {m: rpm for m in self.models}
+        self.buckets = {m: TokenBucket(rpm_of.get(m), burst) for m in self.models}
+        self.cooldown_until = {m: 0.0 for m in self.models}
+        self.failures = {m: 0 for m in self.models}
+        self.lock = threading.Lock()
+
+    def acquire(self) -> str:
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                ready = [m for m in self.models if self.cooldown_until[m] <= now]
+            waits = []
+            for m in sorted(ready, key=lambda m: -self.buckets[m].available()):
+                wait_seconds = self.buckets[m].try_acquire()
+                if wait_seconds == 0:
+                    return m
+                waits.append(wait_seconds)
+            with self.lock:
+                waits.extend(until - now for until in self.cooldown_until.values() if until > now)
+            time.sleep(min(max(min(waits, default=0.05), 0.01), 5.0))
+
+    def report_success(self, model: str):
+        with self.lock:
+            self.failures[model] = 0
+
+    def report_rate_limited(self, model: str, base_backoff: float, max_backoff: float) -> float:
+        """Puts the model on an exponential, jittered cool-down and returns its length in seconds."""
+        with self.lock:
+            self.failures[model] += 1
+            backoff = min(max_backoff, base_backoff * 2 ** (self.failures[model] - 1))
+            backoff = backoff / 2 + random.uniform(0, backoff / 2)
+            self.cooldown_until[model] = max(self.cooldown_until[model], time.monotonic() + backoff)
+            return backoff
+
+
+class DispatcherStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.per_model: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def count(self, model: str, outcome: str):
+        with self.lock:
+            self.requests += 1
+            if outcome == "ok":
+                self.succeeded += 1
+                self.per_model[model] = self.per_model.get(model, 0) + 1
+            elif outcome == "rate_limited":
+                self.rate_limited += 1
+            else:
+                self.failed += 1
+
+    def summary(self) -> Dict[str, Any]:
+        minutes = max(time.monotonic() - self.started, 1e-9) / 60
+        return {
+            "requests": self.requests,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "per_model": dict(self.per_model),
+            "elapsed_seconds": round(minutes * 60, 3),
+            "requests_per_minute": round(self.requests / minutes, 2),
+            "succeeded_per_minute": round(self.succeeded / minutes, 2),
+        }
+
+
+class GeminiDispatcher:
+    """
+    Keeps up to max_in_flight calls running on a thread pool. Each call is routed to whichever model has spare
+    quota; a rate-limit error puts that model on cool-down and retries the call, on any model, up to
+    max_retries times before raising RateLimitExhausted. Other errors are raised to the caller as they are.
+
+    call(model, payload) does the actual request, so the dispatcher works the same against Gemini, Ollama
+    or the local fake endpoint in fake_gemini.py.
+    """
+
+    def __init__(self, call: Callable[[str, Any], Any], models: List[str],
+                 rpm: Union[None, float, Dict[str, float]] = None, max_in_flight: int = 4, max_retries: int = 8,
+                 base_backoff: float = 2.0, max_backoff: float = 120.0):
+        self.call = call
+        self.router = ModelRouter(models, rpm)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stats = DispatcherStats()
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="gemini")
+
+    def _run(self, payload: Any) -> Any:
+        for _ in range(self.max_retries + 1):
+            model = self.router.acquire()
+            try:
+                result = self.call(model, payload)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    self.stats.count(model, "failed")
+                    raise
+                self.stats.count(model, "rate_limited")
+                self.router.report_rate_limited(model, self.base_backoff, self.max_backoff)
+                continue
+            self.stats.count(model, "ok")
+            self.router.report_success(model)
+            return result
+        raise RateLimitExhausted(f"still rate limited after {self.max_retries} retries on {self.router.models}")
+
+    def submit(self, payload: Any) -> Future:
+        return self.executor.submit(self._run, payload)
+
+    def imap_unordered(self, items: Iterable[Tuple[Any, Any]]) -> Iterator[Tuple[Any, Optional[Any], Optional[Exception]]]:
+        """
+        Runs (key, payload) items with at most max_in_flight outstanding and yields (key, result, error) as
+        they complete. Stops submitting once a call raised RateLimitExhausted, and yields that error last.
+        """
+        pending: Dict[Future, Any] = {}
+        exhausted = None
+        items = iter(items)
+        while True:
+            while exhausted is None and len(pending) < self.max_in_flight:
+                item = next(items, None)
+                if item is None:
+                    break
+                key, payload = item
+                pending[self.submit(payload)] = key
+            if not pending:
+                break
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = pending.pop(future)
+                error = future.exception()
+                if isinstance(error, RateLimitExhausted):
+                    exhausted = error
+                yield key, None if error else future.result(), error
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def genai_caller(client, config=None) -> Callable[[str, Any], Any]:
+    """call(model, contents) for a google.genai Client, e.g. one pointed at fake_gemini via http_options."""
+
+    def call(model: str, contents: Any):
+        return client.models.generate_content(model=model, contents=contents, config=config)
+
+    return call
+
+
+def _load_client(api_key: Optional[str] = None):
+    import dotenv
+    from google import genai  # about a second to import, so only when a client is needed
+    dotenv.load_dotenv()
+    return genai.Client(api_key=api_key) if api_key else genai.Client()
+
+
+registry.register(GEMINI_CLIENT, _load_client)
+
+
+def genai_client(api_key: Optional[str] = None):
+    """
+    The google.genai Client of this process, created on first use. Without api_key it reads GEMINI_API_KEY
+    (or GOOGLE_API_KEY) from the environment or .env.
+    """
+    return registry.get(GEMINI_CLIENT, api_key) if api_key else registry.get(GEMINI_CLIENT)
@@ -1,64 +1,72 @@
 import os
+import time
+from typing import Optional, Union
 
-import dotenv
+import numpy as np
 import pandas as pd
 import pymupdf
 from PIL import Image
-from google import genai
-from google.genai.types import GenerateContentConfig
 
-dotenv.load_dotenv()
+from gemini_client import GeminiDispatcher, RateLimitExhausted, genai_client
+import page_preprocess
+from page_render import ImageSaver, pixmap_to_array, pixmap_to_image, render_page
+from progress_ledger import DONE, ERROR, ProgressLedger, page_key
+from result_cache import OCR, RESULT_CACHE_FILENAME, ResultCache, cache_key, image_digest
+from result_sink import ResultSink
 
 # --- Setup ---
 OUTPUT_FOLDER = "text_cleaned"
 CONSOLIDATE_FILEPATH = os.path.join(OUTPUT_FOLDER, "ocr_docs.csv")
+LEDGER_FILEPATH = os.path.join(OUTPUT_FOLDER, "progress.sqlite")
+LEDGER_STAGE = "gemini_ocr"
+RESULT_CACHE_FILEPATH = os.path.join(OUTPUT_FOLDER, RESULT_CACHE_FILENAME)
+OUTPUT_COLUMNS = ["relative_path", "filename", "page", "text", "error"]
+MIN_TEXT_LENGTH = 10  # pages with less text than this are OCR'd again on the next run
 
 GEMINI_MODEL = ["gemini-2.5-pro"]  # switch model to different models
-
-if not os.path.exists(CONSOLIDATE_FILEPATH):
-    _blank = pd.DataFrame({
-        "relative_path": [],
-        "filename": [],
-        "page": [],
-        "text": [],
-        "error": []
-    })
-    _blank.to_csv(CONSOLIDATE_FILEPATH, index=False)
-
-# The client will automatically pick it up.
-try:
-    client = genai.Client()
-except Exception as e:
-    print(f"Error initializing Gemini client. Make sure the API key is set: {e}")
-    # You might want to exit or handle this error differently
-    # For this example, we'll assume the environment is set up.
-    # If you need to explicitly set the key: client = genai.Client(api_key="YOUR_API_KEY")
-    pass
+GEMINI_RPM = 5  # requests per minute allowed per model (free tier pro: 5)
+MAX_IN_FLIGHT = 4  # concurrent OCR requests
+IN_MEMORY = False  # send the rendered page to Gemini without the PNG round-trip through img/
+SAVE_IMAGES = True  # with IN_MEMORY, still write img/ for the viewer, in the background
+RENDER_DPI = 300
+# upload the page cleaned up and compactly encoded (page_preprocess.PROFILES["gemini"]) instead of a full PNG
+PREPROCESS = False
 
 gemini_call_count = 0
 
+# The prompt explicitly guides the model to perform OCR and handle
+# the specific languages and numerals (Thai and English).
+OCR_PROMPT = (
+    "Extract ALL text from this scanned document image. Extracted as much text in its original "
+    "document structure as possible, preserving line breaks and sections if possible while avoiding reciting copyrighted material."
+)
+
 
-def gemini_ocr(image_path: str) -> str:
+def gemini_ocr(image: Union[str, Image.Image, bytes], model: Optional[str] = None,
+               mime_type: str = "image/png") -> str:
     """
     Performs Optical Character Recognition (OCR) on an image file using the
     Gemini API, specifically prompting it for Thai, English, and numeral extraction.
 
     Args:
-        image_path: The file path to the image of the scanned document.
+        image: The file path to the image of the scanned document, the already rendered image, or the
+            already encoded image.
+        model: The Gemini model to use. Rotates through GEMINI_MODEL if not given.
+        mime_type: The type of an encoded image.
 
     Returns:
         The extracted text as a string, or an error message if processing fails.
     """
+    from google.genai.types import GenerateContentConfig, Part
+
     # 1. Prepare the image and the prompt
-    # Open the image using Pillow (PIL)
-    _img = Image.open(image_path)
-
-    # The prompt explicitly guides the model to perform OCR and handle
-    # the specific languages and numerals (Thai and English).
-    prompt = (
-        "Extract ALL text from this scanned document image. Extracted as much text in its original "
-        "document structure as possible, preserving line breaks and sections if possible while avoiding reciting copyrighted material."
-    )
+    # Open the image using Pillow (PIL) unless it is already in memory
+    if isinstance(image, bytes):
+        _img = Part.from_bytes(data=image, mime_type=mime_type)
+    else:
+        _img = Image.open(image) if isinstance(image, str) else image
+
+    prompt = OCR_PROMPT
 
     # 2. Call the Gemini API
     global gemini_call_count
@@ -71,8 +79,8 @@ def gemini_ocr(image_path: str) -> str:
     )
 
     # We send both the text prompt and the image object (as a list) to the model.
-    response = client.models.generate_content(
-        model=GEMINI_MODEL[gemini_call_count % len(GEMINI_MODEL)],
+    response = genai_client().models.generate_content(
+        model=model or GEMINI_MODEL[gemini_call_count % len(GEMINI_MODEL)],
         contents=[prompt, _img],
         config=config
 
@@ -84,76 +92,141 @@ def gemini_ocr(image_path: str) -> str:
     return response.text
 
 
-# --- Example Usage (Requires a dummy image file) ---
-if __name__ == '__main__':
-    # --- Create a Dummy Image for Demonstration ---
-    # **NOTE**: In a real scenario, replace this path with your actual
-    # extracted PDF page image (e.g., 'page_1.png', 'scan_001.jpg').
-    consolidated_docs = pd.read_csv(CONSOLIDATE_FILEPATH)
-    consolidated_docs = consolidated_docs[consolidated_docs["error"].isna()]  # only ones without errors
-    consolidated_docs = consolidated_docs[
-        consolidated_docs["text"].str.len() > 10]  # if the old one is shit, try to do it again
-    consolidated_docs['page'] = consolidated_docs['page'].astype("int")
+def main():
+    """OCRs every page under pdf/ not done yet into CONSOLIDATE_FILEPATH."""
+    ledger = ProgressLedger(LEDGER_FILEPATH)
+    # carry over progress from runs that only kept it in the output CSV
+    if os.path.exists(CONSOLIDATE_FILEPATH):
+        consolidated_docs = pd.read_csv(CONSOLIDATE_FILEPATH)
+        consolidated_docs = consolidated_docs[consolidated_docs["error"].isna()]  # only ones without errors
+        consolidated_docs = consolidated_docs[
+            consolidated_docs["text"].str.len() > MIN_TEXT_LENGTH]  # if the old one is shit, try to do it again
+        ledger.seed_from_frame(consolidated_docs, LEDGER_STAGE)
+        del consolidated_docs
 
     image_root = "img"
-    raw_folders = ["pdf"]
-    image_filepaths = []
-    while raw_folders:
-        raw_folder = raw_folders.pop()
-        for elt in os.listdir(raw_folder):
-            this_filepath = os.path.join(raw_folder, elt)
-            if os.path.isdir(this_filepath):
-                raw_folders.append(this_filepath)
-                os.makedirs(os.path.join(image_root, this_filepath), exist_ok=True)
-            elif os.path.splitext(this_filepath)[-1].lower() in [".pdf"]:
+    # pages with the same pixels get the same text
+    result_cache = ResultCache(RESULT_CACHE_FILEPATH)
+
+    def page_cache_key(image_filepath, pix=None):
+        """The result cache key of the page's pixels, from the rendered pixmap in memory mode."""
+        if pix is not None:
+            digest = image_digest(pixmap_to_image(pix))
+        else:
+            with Image.open(image_filepath) as img:
+                digest = image_digest(img)
+        return cache_key(digest, "gemini", OCR_PROMPT, *GEMINI_MODEL,
+                         page_preprocess.PROFILES["gemini"] if PREPROCESS else None)
+
+    def iter_page_images():
+        """
+        Walks pdf/ lazily, yielding ((relative_path, filename, page), (image_filepath, pixmap, cache key)) for
+        pages not done yet, so OCR starts on the first document instead of after the whole tree is listed and
+        rendered. The pixmap (None unless IN_MEMORY) is the page rendered once here for its cache key and reused
+        by ocr_job; the dispatcher only pulls MAX_IN_FLIGHT pages ahead, so only that many are held. Pages whose
+        pixels are in the result cache are written straight away instead.
+        """
+        raw_folders = ["pdf"]
+        while raw_folders:
+            raw_folder = raw_folders.pop()
+            os.makedirs(os.path.join(image_root, raw_folder), exist_ok=True)
+            for elt in os.listdir(raw_folder):
+                this_filepath = os.path.join(raw_folder, elt)
+                if os.path.isdir(this_filepath):
+                    raw_folders.append(this_filepath)
+                    continue
+                if os.path.splitext(this_filepath)[-1].lower() not in [".pdf"]:
+                    continue
+                relative_path = os.path.join(image_root, raw_folder)
                 with pymupdf.open(this_filepath) as doc:  # open a document
-                    for i, page in enumerate(doc):
+                    for i in range(doc.page_count):
+                        key = page_key(relative_path, elt, i + 1)
+                        if ledger.is_done(key, LEDGER_STAGE):
+                            continue  # skipping items that's already been OCR'd
                         dst_image_filepath = os.path.join(image_root, f"{this_filepath}_{i + 1:03}.png")
-                        if os.path.exists(dst_image_filepath):
-                            print("skipped", dst_image_filepath)
-                        else:
-                            pix = page.get_pixmap(dpi=300)  # render page to an image
+                        pix = None
+                        if IN_MEMORY:
+                            pix = render_page(doc[i], dpi=RENDER_DPI)
+                        elif not os.path.exists(dst_image_filepath):
+                            pix = doc[i].get_pixmap(dpi=RENDER_DPI)  # render page to an image
                             pix.save(dst_image_filepath)
                             print(dst_image_filepath)
-                        image_filepaths.append(dst_image_filepath)
-
-    for image_filepath in image_filepaths:
-        relative_path, filename = os.path.split(image_filepath)
-        filename = os.path.splitext(filename)[0]
-        page = int(filename[filename.rfind("_") + 1:])
-        filename = filename[0: filename.rfind("_")]
-
-        done_items = consolidated_docs[
-            (consolidated_docs["relative_path"] == relative_path) &
-            (consolidated_docs["filename"] == filename) &
-            (consolidated_docs["page"] == page)]
-
-        # skipping items that's already been OCR'd
-        if len(done_items):
-            # print(f"Already done OCR on: {image_filepath}. Skipped")
-            continue
-
-        try:
-            print(f"Attempting OCR on: {image_filepath}")
-
-            # Run the OCR function
-            extracted_text = gemini_ocr(image_filepath)
-
-            ## Display the Results ##
-            this_result = pd.DataFrame({
-                "relative_path": [relative_path],
-                "filename": [filename],
-                "page": [page],
-                "text": [extracted_text],
-                "error": [""]
-            })
-        except Exception as e:
-            this_result = pd.DataFrame({
-                "relative_path": [relative_path],
-                "filename": [filename],
-                "page": [page],
-                "text": [""],
-                "error": [str(e)]
-            })
-            print(str(e))
-        this_result.to_csv(CONSOLIDATE_FILEPATH, index=False, mode='a', header=False)
+                            pix = None
+                        this_cache_key = page_cache_key(dst_image_filepath, pix)
+                        text = result_cache.get(OCR, this_cache_key)
+                        if text is not None:
+                            if saver is not None and not os.path.exists(dst_image_filepath):
+                                saver.save(pix, dst_image_filepath)
+                            sink.write({"relative_path": key[0], "filename": key[1], "page": key[2], "text": text,
+                                        "error": ""})
+                            continue
+                        yield key, (dst_image_filepath, pix, this_cache_key)
+
+    saver = ImageSaver() if IN_MEMORY and SAVE_IMAGES else None
+
+    def compact_upload(image):
+        """The page cleaned up and encoded as page_preprocess.PROFILES["gemini"] says, and its MIME type."""
+        profile = page_preprocess.PROFILES["gemini"]
+        if isinstance(image, str):
+            with Image.open(image) as img:
+                image = np.asarray(img.convert("RGB"))
+        return page_preprocess.encode(page_preprocess.prepare(image, profile, RENDER_DPI), profile)
+
+    def ocr_job(model, job):
+        image_filepath, pix, this_cache_key = job
+        print(f"Attempting OCR on: {image_filepath}")
+        image, mime_type = image_filepath, "image/png"
+        if pix is not None:
+            if saver is not None and not os.path.exists(image_filepath):
+                saver.save(pix, image_filepath)
+            image = pixmap_to_array(pix) if PREPROCESS else pixmap_to_image(pix)
+        if PREPROCESS:
+            image, mime_type = compact_upload(image)
+        start = time.perf_counter()
+        text = gemini_ocr(image, model, mime_type)
+        # too short a text is retried on the next run, so it is not worth reusing
+        if text is not None and len(text) > MIN_TEXT_LENGTH:
+            result_cache.put(OCR, this_cache_key, text, time.perf_counter() - start)
+        return text
+
+    def record_progress(rows):
+        # called once the rows are on disk, so a crash in between only redoes these pages
+        for row in rows:
+            key = page_key(row["relative_path"], row["filename"], row["page"])
+            if row["error"]:
+                ledger.mark_error(key, LEDGER_STAGE, row["error"])
+            elif len(row["text"] or "") <= MIN_TEXT_LENGTH:
+                ledger.mark_error(key, LEDGER_STAGE, "text too short")
+            else:
+                ledger.mark_done(key, LEDGER_STAGE)
+
+    sink = ResultSink(CONSOLIDATE_FILEPATH, OUTPUT_COLUMNS, on_commit=record_progress)
+
+    # keeps MAX_IN_FLIGHT requests running, within GEMINI_RPM per model, backing off on 429s
+    dispatcher = GeminiDispatcher(ocr_job, GEMINI_MODEL, rpm=GEMINI_RPM, max_in_flight=MAX_IN_FLIGHT)
+    for (relative_path, filename, page), extracted_text, error in dispatcher.imap_unordered(iter_page_images()):
+        if isinstance(error, RateLimitExhausted):
+            print("every model is still rate limited, likely caused by RPD limit reached")
+            break
+        if error is not None:
+            print(str(error))
+        sink.write({
+            "relative_path": relative_path,
+            "filename": filename,
+            "page": page,
+            "text": extracted_text if error is None else "",
+            "error": "" if error is None else str(error),
+        })
+    dispatcher.close()
+    sink.close()
+    print(dispatcher.stats.summary())
+    print(result_cache.stats())
+    result_cache.close()
+    if saver is not None:
+        saver.close()
+    print({"done": ledger.count(LEDGER_STAGE, DONE), "error": ledger.count(LEDGER_STAGE, ERROR)})
+    ledger.close()
+
+
+if __name__ == '__main__':
+    main()
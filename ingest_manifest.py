@@ -0,0 +1,257 @@
+"""
+What has been ingested from pdf/: every PDF's size, mtime, content hash and page count, and per OCR condition
+the content hash whose pages are in that condition's summary_{engine}_{lang}.csv.
+
+A rerun only hashes files whose size or mtime changed, OCRs only files that are new or whose content changed
+since they were processed, and removes the rows of changed and deleted files from the output first:
+
+    python ingest_manifest.py [pdf] [text/manifest.sqlite]
+
+prints what the next run would do without changing anything.
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pymupdf
+
+from result_sink import drop_incomplete_rows, record_committed
+
+# (relative_path, filename), relative to the pdf root
+FileKey = Tuple[str, str]
+# (ocr_engine, language_option)
+Condition = Tuple[str, str]
+
+MANIFEST_FILENAME = "manifest.sqlite"
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def manifest_location(output_filename: str) -> str:
+    """Beside the outputs, e.g. text/summary -> text/manifest.sqlite"""
+    return os.path.join(os.path.dirname(output_filename), MANIFEST_FILENAME)
+
+
+def content_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def condition_name(condition: Condition) -> str:
+    return ":".join(condition)
+
+
+@dataclass
+class PdfEntry:
+    relative_path: str
+    filename: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    page_count: int
+
+    @property
+    def key(self) -> FileKey:
+        return self.relative_path, self.filename
+
+
+@dataclass
+class Scan:
+    """The PDFs found by Manifest.scan(), and how they differ from the previous scan."""
+    entries: Dict[FileKey, PdfEntry]
+    added: List[FileKey] = field(default_factory=list)
+    changed: List[FileKey] = field(default_factory=list)
+    deleted: List[FileKey] = field(default_factory=list)
+    hashed: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> dict:
+        return {"files": len(self.entries), "added": len(self.added), "changed": len(self.changed),
+                "deleted": len(self.deleted), "hashed": self.hashed, "seconds": round(self.seconds, 3)}
+
+
+class Manifest:
+    """
+    The PDF and per-condition processing tables, in SQLite next to the outputs. A file counts as processed for
+    a condition only once all of its pages are in the output, so an interrupted run leaves it pending.
+    """
+
+    def __init__(self, filepath: str):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                relative_path TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                page_count INTEGER NOT NULL,
+                PRIMARY KEY (relative_path, filename)
+            ) WITHOUT ROWID""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed (
+                relative_path TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                condition TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (relative_path, filename, condition)
+            ) WITHOUT ROWID""")
+        self._lock = threading.Lock()
+
+    def _write(self, statement: str, rows: Sequence[tuple]):
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(statement, rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def scan(self, root_dir: str, files: Sequence[FileKey], record: bool = True) -> Scan:
+        """
+        Finds what changed among the PDFs under root_dir and, with record, stores the result. Only files whose
+        size or mtime changed are hashed, and only those whose hash changed are opened to count their pages.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            known = {(r, f): PdfEntry(r, f, size, mtime_ns, sha, pages) for r, f, size, mtime_ns, sha, pages in
+                     self._conn.execute("SELECT * FROM files").fetchall()}
+        scan = Scan({})
+        for relative_path, filename in files:
+            if os.path.splitext(filename)[-1].lower() != ".pdf":
+                continue
+            key = relative_path, filename
+            filepath = os.path.join(root_dir, relative_path, filename)
+            stat = os.stat(filepath)
+            entry = known.get(key)
+            if entry is None or entry.size != stat.st_size or entry.mtime_ns != stat.st_mtime_ns:
+                sha = content_hash(filepath)
+                scan.hashed += 1
+                if entry is None or entry.sha256 != sha:
+                    with pymupdf.open(filepath) as doc:
+                        page_count = doc.page_count
+                    (scan.added if entry is None else scan.changed).append(key)
+                else:
+                    page_count = entry.page_count  # touched but identical
+                entry = PdfEntry(relative_path, filename, stat.st_size, stat.st_mtime_ns, sha, page_count)
+            scan.entries[key] = entry
+        scan.deleted = [key for key in known if key not in scan.entries]
+        scan.seconds = time.perf_counter() - start
+        if not record:
+            return scan
+
+        self._write("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    [(e.relative_path, e.filename, e.size, e.mtime_ns, e.sha256, e.page_count)
+                     for key, e in scan.entries.items() if known.get(key) != e])
+        self._write("DELETE FROM files WHERE relative_path = ? AND filename = ?", scan.deleted)
+        return scan
+
+    def conditions(self) -> List[Condition]:
+        with self._lock:
+            names = self._conn.execute("SELECT DISTINCT condition FROM processed").fetchall()
+        return [tuple(name.split(":", 1)) for name, in names]
+
+    def processed(self, condition: Condition) -> Dict[FileKey, str]:
+        """The content hash each file was processed at for this condition."""
+        with self._lock:
+            rows = self._conn.execute("SELECT relative_path, filename, sha256 FROM processed WHERE condition = ?",
+                                      (condition_name(condition),)).fetchall()
+        return {(r, f): sha for r, f, sha in rows}
+
+    def mark_processed(self, condition: Condition, entries: Sequence[PdfEntry]):
+        now = time.time()
+        self._write("INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?)",
+                    [(e.relative_path, e.filename, condition_name(condition), e.sha256, now) for e in entries])
+
+    def forget(self, condition: Condition, keys: Sequence[FileKey]):
+        self._write("DELETE FROM processed WHERE relative_path = ? AND filename = ? AND condition = ?",
+                    [(r, f, condition_name(condition)) for r, f in keys])
+
+    def pending(self, condition: Condition, scan: Scan) -> List[PdfEntry]:
+        """The files whose current content has not been fully processed for this condition."""
+        processed = self.processed(condition)
+        return [entry for key, entry in scan.entries.items() if processed.get(key) != entry.sha256]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stale_files(manifest: Manifest, scan: Scan, condition: Condition) -> Set[FileKey]:
+    """Files with rows in this condition's output from content that has since changed or been deleted."""
+    return {key for key, sha in manifest.processed(condition).items()
+            if key not in scan.entries or scan.entries[key].sha256 != sha}
+
+
+def prepare_output(manifest: Manifest, scan: Scan, condition: Condition, output_filepath: str,
+                   columns: Sequence[str]) -> Optional[np.ndarray]:
+    """
+    Removes the rows of stale files from a condition's output, before its sink is opened, and forgets that
+    they were processed. Returns a boolean mask of the previous rows that were kept, or None if the output was
+    left untouched. If the output is gone, everything is forgotten so it is rebuilt.
+    """
+    if not os.path.exists(output_filepath) or os.path.getsize(output_filepath) == 0:
+        manifest.forget(condition, list(manifest.processed(condition)))
+        return None
+    # the first run against an output written before the manifest existed also drops the PDFs deleted since
+    baseline = not manifest.processed(condition)
+    stale = stale_files(manifest, scan, condition)
+    if not stale and not baseline:
+        return None
+    drop_incomplete_rows(output_filepath)
+    rows = pd.read_csv(output_filepath, dtype=str, keep_default_na=False)
+    files = rows[["relative_path", "filename"]].drop_duplicates()
+    if baseline:
+        stale |= set(zip(files["relative_path"], files["filename"])) - set(scan.entries)
+        if not stale:
+            return None
+    kept = ~(rows["relative_path"] + "/" + rows["filename"]).isin({f"{r}/{f}" for r, f in stale}).to_numpy()
+    tmp_filepath = f"{output_filepath}.tmp"
+    rows[kept].to_csv(tmp_filepath, header=list(columns), index=False)
+    os.replace(tmp_filepath, output_filepath)
+    record_committed(output_filepath, os.path.getsize(output_filepath))
+    manifest.forget(condition, list(stale))
+    print(f"removed {int((~kept).sum())} rows of {len(stale)} changed or deleted files from {output_filepath}")
+    return kept
+
+
+def main(root_dir: str = "pdf", manifest_filepath: Optional[str] = None):
+    from ocr_pipeline import output_location
+    from read_pdf import traverse_folder
+
+    manifest_filepath = manifest_filepath or manifest_location("text/summary")
+    with Manifest(manifest_filepath) as manifest:
+        scan = manifest.scan(root_dir, traverse_folder(root_dir), record=False)
+        print(scan.summary())
+        for condition in manifest.conditions():
+            pending = manifest.pending(condition, scan)
+            print(condition_name(condition), output_location("text/summary", condition),
+                  {"pending_files": len(pending), "pending_pages": sum(e.page_count for e in pending),
+                   "stale_files": len(stale_files(manifest, scan, condition))})
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,46 @@
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from engine_registry import registry
+
+TESSERACT = "tesseract"
+EASYOCR = "easyocr"
+
+# tesseract language option -> easyocr language list
+EASYOCR_LANGUAGES = {
+    "tha+eng": ['th', 'en'],
+    "tha": ['th'],
+}
+
+
+
+def set_tesseract_cmd(pytesseract_exe: Optional[str]):
+    if pytesseract_exe:
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = pytesseract_exe
+
+
+def _load_easyocr(*languages: str):
+    import easyocr  # imports torch, seconds on its own
+    return easyocr.Reader(list(languages))
+
+
+registry.register(EASYOCR, _load_easyocr)
+
+
+def easyocr_reader(language_option: str):
+    """One easyocr.Reader per language set, created on first use since loading the model takes seconds."""
+    return registry.get(EASYOCR, *EASYOCR_LANGUAGES[language_option])
+
+
+def ocr_image(ocr_engine: str, language_option: str, img: Image.Image, array: Optional[np.ndarray] = None) -> str:
+    """OCRs an image with one engine. array, if given, is the same image as a NumPy array for easyocr."""
+    if ocr_engine == TESSERACT:
+        import pytesseract
+        return pytesseract.image_to_string(img, lang=language_option)
+    if ocr_engine == EASYOCR:
+        reader = easyocr_reader(language_option)
+        return " ".join(reader.readtext(np.asarray(img) if array is None else array, detail=0, paragraph=True))
+    raise ValueError(f"unknown OCR engine: {ocr_engine}")
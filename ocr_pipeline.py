@@ -0,0 +1,376 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+from os import path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pymupdf
+
+import ocr_engines
+import page_preprocess
+import search_index
+from corpus_store import Signature, file_signature
+from ingest_manifest import FileKey, Manifest, PdfEntry, manifest_location, prepare_output
+from page_render import ImageSaver, pixmap_to_array, pixmap_to_image, render_page
+from result_cache import OCR, ResultCache, cache_key, cache_location, image_digest
+from result_sink import ResultSink
+
+# (relative_path, filename, page) with page 0-based, as stored in summary_*.csv
+PageKey = Tuple[str, str, int]
+# (ocr_engine, language_option), one summary_{engine}_{lang}.csv each
+Condition = Tuple[str, str]
+
+OUTPUT_COLUMNS = ["", "filename", "relative_path", "page", "text"]
+
+# --- worker process state, set up once per process by _init_worker ---
+_worker: Dict = {}
+
+
+def _init_worker(conditions: Sequence[Condition], root_dir: str, img_dir: str, pytesseract_exe: Optional[str],
+                 in_memory: bool = False, save_images: bool = True, cache_filepath: Optional[str] = None,
+                 preprocess: bool = False):
+    _worker.update(root_dir=root_dir, img_dir=img_dir, in_memory=in_memory, preprocess=preprocess,
+                   saver=ImageSaver() if in_memory and save_images else None,
+                   cache=ResultCache(cache_filepath) if cache_filepath else None,
+                   doc_filepath=None, doc=None)
+    if _worker["saver"] is not None:
+        # pool workers leave through os._exit, so flush background image writes from a multiprocessing finalizer
+        from multiprocessing.util import Finalize
+        Finalize(_worker["saver"], _worker["saver"].close, exitpriority=10)
+    ocr_engines.set_tesseract_cmd(pytesseract_exe)
+    # load each easyocr model once per process, shared by every condition using the same language set
+    for ocr_engine, language_option in conditions:
+        if ocr_engine == ocr_engines.EASYOCR:
+            ocr_engines.easyocr_reader(language_option)
+
+
+def _open_document(doc_filepath: str) -> pymupdf.Document:
+    # pages of a document are submitted consecutively, so keeping the last document open avoids most re-opens
+    if _worker["doc_filepath"] != doc_filepath:
+        if _worker["doc"] is not None:
+            _worker["doc"].close()
+        _worker["doc"] = pymupdf.open(doc_filepath)
+        _worker["doc_filepath"] = doc_filepath
+    return _worker["doc"]
+
+
+def _ocr_image_cached(img_obj, array, conditions: Sequence[Condition]) -> Tuple[Dict[Condition, str], int, float]:
+    """
+    OCRs an image for every condition, reusing the results cached for identical pixels. Returns the text per
+    condition, how many came from the cache and the OCR seconds they saved.
+    """
+    cache: Optional[ResultCache] = _worker.get("cache")
+    digest = image_digest(img_obj) if cache is not None else None
+    texts, cached, saved_seconds = {}, 0, 0.0
+    for ocr_engine, language_option in conditions:
+        key = cache_key(digest, ocr_engine, language_option) if cache is not None else None
+        found = cache.lookup(OCR, key) if cache is not None else None
+        if found is not None:
+            text, cost_seconds = found
+            cached += 1
+            saved_seconds += cost_seconds
+        else:
+            start = time.perf_counter()
+            text = ocr_engines.ocr_image(ocr_engine, language_option, img_obj, array)
+            if cache is not None:
+                cache.put(OCR, key, text, time.perf_counter() - start)
+        texts[ocr_engine, language_option] = text
+    return texts, cached, saved_seconds
+
+
+def _prepared_inputs(page: pymupdf.Page, conditions: Sequence[Condition]) -> List[tuple]:
+    """
+    The page prepared for each engine's profile (see page_preprocess), rendered once per resolution, as
+    (PIL image, array, the conditions it is for).
+    """
+    from PIL import Image
+
+    by_engine: Dict[str, List[Condition]] = {}
+    for condition in conditions:
+        by_engine.setdefault(condition[0], []).append(condition)
+    renders = {}
+    inputs = []
+    for ocr_engine, engine_conditions in by_engine.items():
+        profile = page_preprocess.PROFILES[ocr_engine]
+        if profile.dpi not in renders:
+            renders[profile.dpi] = render_page(page, profile.dpi)
+        array = page_preprocess.prepare(pixmap_to_array(renders[profile.dpi]), profile)
+        inputs.append((Image.fromarray(array), array, engine_conditions))
+    return inputs
+
+
+def _ocr_page(key: PageKey, conditions: Sequence[Condition]) -> Tuple[PageKey, Dict[Condition, str], float, float,
+                                                                      int, float]:
+    """
+    Renders (or reuses the rendered image of) one page once and OCRs it for every requested condition, or
+    takes the text from the result cache when a page with the same pixels was already OCR'd the same way.
+    Returns the text per condition, the render/OCR seconds, the number of cached results and the OCR seconds
+    they saved. In memory mode the pixmap goes to the OCR engines directly and the PNG is written in the
+    background. With preprocessing each engine gets the page cleaned up at its own resolution instead, and
+    the PNG is only written for the viewer.
+    """
+    from PIL import Image
+
+    rel_path, filename, i = key
+    root_dir, img_dir = _worker["root_dir"], _worker["img_dir"]
+    start = time.perf_counter()
+    image_filepath = path.join(img_dir, root_dir, rel_path, f"{filename}_{i + 1:03}.png")
+    array = None
+    if _worker["preprocess"]:
+        page = _open_document(path.join(root_dir, rel_path, filename))[i]
+        if not os.path.exists(image_filepath):
+            pix = render_page(page)
+            if _worker["saver"] is not None:
+                _worker["saver"].save(pix, image_filepath)
+            elif not _worker["in_memory"]:
+                pix.save(image_filepath)
+        inputs = _prepared_inputs(page, conditions)
+    elif _worker["in_memory"]:
+        pix = render_page(_open_document(path.join(root_dir, rel_path, filename))[i])
+        if _worker["saver"] is not None and not os.path.exists(image_filepath):
+            _worker["saver"].save(pix, image_filepath)
+        img_obj = pixmap_to_image(pix)
+        array = pixmap_to_array(pix)
+    else:
+        if not os.path.exists(image_filepath):
+            page = _open_document(path.join(root_dir, rel_path, filename))[i]
+            page.get_pixmap().save(image_filepath)  # render page to an image
+        img_obj = Image.open(image_filepath)
+        img_obj.load()
+    if not _worker["preprocess"]:
+        inputs = [(img_obj, array, conditions)]
+    rendered = time.perf_counter()
+    texts, cached, saved_seconds = {}, 0, 0.0
+    for img_input, array_input, input_conditions in inputs:
+        input_texts, input_cached, input_saved_seconds = _ocr_image_cached(img_input, array_input, input_conditions)
+        texts.update(input_texts)
+        cached += input_cached
+        saved_seconds += input_saved_seconds
+    return key, texts, rendered - start, time.perf_counter() - rendered, cached, saved_seconds
+
+
+def output_location(output_filename: str, condition: Condition) -> str:
+    ocr_engine, language_option = condition
+    return f"{output_filename}_{ocr_engine}_{language_option}.csv"
+
+
+def completed_pages(output_filepath: str) -> Tuple[Set[PageKey], int]:
+    """Page keys already in the output, and the next value of its unnamed index column."""
+    if not os.path.exists(output_filepath) or os.path.getsize(output_filepath) == 0:
+        return set(), 0
+    done = pd.read_csv(output_filepath, usecols=lambda c: c in ("Unnamed: 0", "filename", "relative_path", "page"),
+                       dtype={"filename": str, "relative_path": str})
+    keys = set(zip(done["relative_path"], done["filename"], done["page"].astype(int)))
+    # rows of changed files may have been removed, so continue after the largest value rather than the count
+    next_row = int(done["Unnamed: 0"].max()) + 1 if "Unnamed: 0" in done.columns and len(done) else len(done)
+    return keys, next_row
+
+
+def remove_rendered_images(img_dir: str, root_dir: str, files: Sequence[FileKey]):
+    """Deletes the page images of PDFs that changed or were deleted, so they are never reused for OCR or viewing."""
+    for rel_path, filename in files:
+        folder = path.join(img_dir, root_dir, rel_path)
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                if name.startswith(f"{filename}_") and name.endswith(".png"):
+                    os.remove(path.join(folder, name))
+
+
+class ThroughputReport:
+    """
+    Seconds spent and pages handled per stage. Render/OCR seconds are summed over worker processes; a page
+    is rendered once however many conditions it is OCR'd for.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.ocr_results = 0
+        self.skipped = 0
+        self.skipped_files = 0
+        self.cached_results = 0
+        self.saved_ocr_seconds = 0.0
+        self.render_seconds = 0.0
+        self.ocr_seconds = 0.0
+        self.write_seconds = 0.0
+        self.started = time.perf_counter()
+
+    def summary(self) -> Dict[str, float]:
+        wall = time.perf_counter() - self.started
+
+        def rate(count, seconds):
+            return round(count / seconds, 3) if seconds > 0 else None
+
+        return {
+            "pages": self.pages,
+            "ocr_results": self.ocr_results,
+            "skipped": self.skipped,
+            "skipped_files": self.skipped_files,
+            "cached_results": self.cached_results,
+            "cache_hit_ratio": round(self.cached_results / self.ocr_results, 4) if self.ocr_results else None,
+            "saved_ocr_seconds": round(self.saved_ocr_seconds, 3),
+            "wall_seconds": round(wall, 3),
+            "pages_per_second": rate(self.pages, wall),
+            "render_pages_per_second": rate(self.pages, self.render_seconds),
+            "ocr_results_per_second": rate(self.ocr_results, self.ocr_seconds),
+            "write_results_per_second": rate(self.ocr_results, self.write_seconds),
+        }
+
+
+def run_pipeline(root_dir="pdf",
+                 pytesseract_exe=r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+                 output_filename="text/summary",
+                 ocr_engine="tesseract",
+                 language_option="tha+eng",
+                 img_dir="img",
+                 workers: Optional[int] = None,
+                 max_in_flight: Optional[int] = None,
+                 in_memory: bool = False,
+                 save_images: bool = True,
+                 conditions: Optional[Sequence[Condition]] = None,
+                 sink_rows: int = 64,
+                 sink_seconds: float = 5.0,
+                 use_cache: bool = True,
+                 preprocess: bool = False) -> Dict[str, float]:
+    """
+    pdf_to_text fanned out over a process pool, for one or several (ocr_engine, language_option) conditions.
+
+    The ingest manifest decides what to OCR: only PDFs that are new or whose content changed since they were
+    processed for a condition, after the rows of changed and deleted PDFs are removed from its output. Each
+    page is rendered once and OCR'd for every condition that needs it; results are appended to each
+    condition's summary_{engine}_{lang}.csv through a ResultSink, in batches of sink_rows or every
+    sink_seconds, and the persisted search indexes are updated with just the delta. An interrupted run resumes
+    by skipping the (relative_path, filename, page) keys already in the output. With use_cache, pages whose
+    pixels were already OCR'd the same way, in this or any earlier run, take their text from the result cache
+    beside the outputs instead. preprocess cleans each page up for each engine first (see page_preprocess).
+    Returns the throughput report.
+    """
+    from read_pdf import traverse_folder
+
+    conditions = list(dict.fromkeys(conditions or [(ocr_engine, language_option)]))
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    report = ThroughputReport()
+
+    manifest = Manifest(manifest_location(output_filename))
+    scan = manifest.scan(root_dir, traverse_folder(root_dir))
+    print(scan.summary())
+    remove_rendered_images(img_dir, root_dir, scan.changed + scan.deleted)
+    pending_files: Dict[Condition, List[PdfEntry]] = {}
+    previous: Dict[Condition, Tuple[Optional[Signature], Optional[np.ndarray]]] = {}
+
+    with ExitStack() as stack:
+        stack.callback(manifest.close)
+        sinks: Dict[Condition, ResultSink] = {}
+        done: Dict[Condition, Set[PageKey]] = {}
+        next_rows: Dict[Condition, int] = {}
+        for condition in conditions:
+            output_filepath = output_location(output_filename, condition)
+            signature = file_signature(output_filepath) if os.path.exists(output_filepath) else None
+            kept = prepare_output(manifest, scan, condition, output_filepath, OUTPUT_COLUMNS)
+            previous[condition] = signature, kept
+            pending_files[condition] = manifest.pending(condition, scan)
+            # opening a sink drops rows torn by an earlier crash, so read what is done afterwards
+            sinks[condition] = stack.enter_context(ResultSink(output_filepath, OUTPUT_COLUMNS,
+                                                              max_rows=sink_rows, max_seconds=sink_seconds))
+            if pending_files[condition]:
+                done[condition], next_rows[condition] = completed_pages(output_filepath)
+
+        todo_files: Dict[FileKey, List[Condition]] = {}
+        for condition in conditions:
+            for entry in pending_files[condition]:
+                todo_files.setdefault(entry.key, []).append(condition)
+        report.skipped_files = len(scan.entries) - len(todo_files)
+        if todo_files:
+            pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(conditions, root_dir, img_dir, pytesseract_exe, in_memory, save_images,
+                          cache_location(output_filename) if use_cache else None, preprocess)))
+        pending = set()
+
+        def drain(return_when):
+            nonlocal pending
+            finished, pending = wait(pending, return_when=return_when)
+            for future in finished:
+                (rel_path, filename, i), texts, render_seconds, ocr_seconds, cached, saved_seconds = future.result()
+                start = time.perf_counter()
+                for condition, s in texts.items():
+                    sinks[condition].write([next_rows[condition], filename, rel_path, i, s])
+                    next_rows[condition] += 1
+                report.pages += 1
+                report.ocr_results += len(texts)
+                report.render_seconds += render_seconds
+                report.ocr_seconds += ocr_seconds
+                report.cached_results += cached
+                report.saved_ocr_seconds += saved_seconds
+                report.write_seconds += time.perf_counter() - start
+                print(filename, i + 1)
+
+        for (rel_path, filename), file_conditions in todo_files.items():
+            os.makedirs(path.join(img_dir, root_dir, rel_path), exist_ok=True)
+            for i in range(scan.entries[rel_path, filename].page_count):
+                key = rel_path, filename, i
+                todo = [condition for condition in file_conditions if key not in done[condition]]
+                if not todo:
+                    report.skipped += 1
+                    continue
+                pending.add(pool.submit(_ocr_page, key, todo))
+                if len(pending) >= max_in_flight:
+                    drain(FIRST_COMPLETED)
+        while pending:
+            drain(FIRST_COMPLETED)
+
+        # every page of these files is on disk once the sinks close
+        for sink in sinks.values():
+            sink.close()
+        for condition in conditions:
+            manifest.mark_processed(condition, pending_files[condition])
+
+    for condition in conditions:
+        signature, kept = previous[condition]
+        if signature is None or (kept is None and not pending_files[condition]):
+            continue
+        output_filepath = output_location(output_filename, condition)
+        if search_index.update_indexes(output_filepath, signature, kept):
+            print("updated the search indexes of", output_filepath)
+
+    summary = report.summary()
+    print(summary)
+    return summary
+
+
+def parse_condition(value: str) -> Condition:
+    ocr_engine, _, language_option = value.partition(":")
+    if ocr_engine not in (ocr_engines.TESSERACT, ocr_engines.EASYOCR) or \
+            language_option not in ocr_engines.EASYOCR_LANGUAGES:
+        raise argparse.ArgumentTypeError(f"expected engine:lang such as tesseract:tha+eng, got {value}")
+    return ocr_engine, language_option
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR every PDF page in parallel, resuming from previous output")
+    parser.add_argument("--root-dir", default="pdf")
+    parser.add_argument("--output", default="text/summary")
+    parser.add_argument("--condition", type=parse_condition, action="append", dest="conditions",
+                        help="engine:lang to produce, repeatable; every page is rendered once for all of them "
+                             "(default: tesseract:tha+eng)")
+    parser.add_argument("--img-dir", default="img")
+    parser.add_argument("--tesseract", default=None, help="path to the tesseract executable, if not on PATH")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--in-memory", action="store_true", help="OCR the rendered pixmap without a PNG round-trip")
+    parser.add_argument("--no-save-images", action="store_true", help="with --in-memory, do not write img/ at all")
+    parser.add_argument("--no-cache", action="store_true", help="OCR every page, even ones with cached results")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="grayscale, crop, deskew and binarize pages at a resolution chosen per engine")
+    args = parser.parse_args()
+    run_pipeline(root_dir=args.root_dir, pytesseract_exe=args.tesseract, output_filename=args.output,
+                 img_dir=args.img_dir, workers=args.workers, in_memory=args.in_memory,
+                 save_images=not args.no_save_images, conditions=args.conditions, use_cache=not args.no_cache,
+                 preprocess=args.preprocess)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Page images for the viewer, rendered on demand from the source PDFs instead of pre-rendered into img/.
+
+A page is rendered at one of a few fixed SIZES, as PNG or WebP, and kept in a memory LRU and an on-disk
+cache, both bounded in bytes. Every variant has an ETag derived from the PDF's (mtime_ns, size) signature, so
+a changed PDF gets new images and a client's revalidation is answered without rendering or reading anything.
+
+    python page_images.py [img_cache]
+
+prints what the disk cache holds.
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from query_cache import QueryCache
+
+CACHE_DIR = "img_cache"
+RENDER_VERSION = 1  # bump when rendering changes, to retire cached images and ETags
+DEFAULT_MEMORY_BYTES = 128 * 1024 * 1024
+DEFAULT_DISK_BYTES = 2 << 30
+EVICT_CHECK_PUTS = 50  # disk writes between checks of the disk cache size
+EVICT_TO = 0.9  # eviction frees disk space down to this share of max_disk_bytes
+
+# width in pixels; None is PyMuPDF's default resolution, the same image the OCR pipeline saves to img/
+SIZES = {"thumb": 240, "medium": 800, "full": None}
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+WEBP_QUALITY = {"thumb": 60, "medium": 75, "full": 80}
+
+
+@dataclass(frozen=True)
+class PageImage:
+    data: bytes
+    mimetype: str
+    etag: str
+
+
+def pdf_signature(pdf_filepath: str) -> Tuple[int, int]:
+    """(mtime_ns, size) of the PDF, raises FileNotFoundError."""
+    stat = os.stat(pdf_filepath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def image_etag(pdf_filepath: str, signature: Tuple[int, int], page: int, size: str, fmt: str) -> str:
+    key = f"{RENDER_VERSION}:{os.path.abspath(pdf_filepath)}:{signature}:{page}:{size}:{fmt}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def render_image(pdf_filepath: str, page: int, size: str, fmt: str) -> bytes:
+    """The page (0-based) at SIZES[size] in format. Raises IndexError for a page the PDF does not have."""
+    # PyMuPDF and OpenCV are only imported once a page is rendered, so the app starts without them
+    import pymupdf
+    import page_preprocess
+    from page_render import pixmap_to_array
+
+    width = SIZES[size]
+    with pymupdf.open(pdf_filepath) as doc:
+        if not 0 <= page < doc.page_count:
+            raise IndexError(f"{pdf_filepath} has no page {page}")
+        pdf_page = doc[page]
+        if width is None:
+            pix = pdf_page.get_pixmap()
+        else:
+            zoom = width / pdf_page.rect.width
+            pix = pdf_page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom))
+        if fmt == "png":
+            return pix.tobytes("png")
+        profile = page_preprocess.Profile(grayscale=False, upload=fmt, quality=WEBP_QUALITY[size])
+        data, _ = page_preprocess.encode(pixmap_to_array(pix), profile)
+        return data
+
+
+class PageImageCache:
+    """
+    Rendered page images in memory (a QueryCache keyed by ETag) and on disk as {cache_dir}/{etag[:2]}/{etag}.
+    Disk entries are evicted least recently used first, by file mtime, which every hit refreshes.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_memory_bytes: int = DEFAULT_MEMORY_BYTES,
+                 max_disk_bytes: int = DEFAULT_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = QueryCache(max_entries=100_000, max_bytes=max_memory_bytes, ttl_seconds=float("inf"))
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None  # summed on first write
+        self._puts = 0
+        self.disk_hits = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.disk_evictions = 0
+
+    def _disk_filepath(self, etag: str) -> str:
+        return os.path.join(self.cache_dir, etag[:2], etag)
+
+    def _disk_files(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for folder in os.scandir(self.cache_dir):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        yield entry
+
+    def _read_disk(self, etag: str) -> Optional[bytes]:
+        filepath = self._disk_filepath(etag)
+        try:
+            with open(filepath, "rb") as f:
+                data = f.read()
+            os.utime(filepath)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write_disk(self, etag: str, data: bytes):
+        filepath = self._disk_filepath(etag)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        # per-thread temporary name, then rename, so a concurrent reader never sees a partial image
+        tmp_filepath = f"{filepath}.{threading.get_ident()}.tmp"
+        with open(tmp_filepath, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filepath, filepath)
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(entry.stat().st_size for entry in self._disk_files())
+            else:
+                self._disk_bytes += len(data)
+            self._puts += 1
+            if self._puts % EVICT_CHECK_PUTS == 0 or self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._disk_files()]
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        target = int(self.max_disk_bytes * EVICT_TO)
+        for _, size, filepath in sorted(entries):
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+
+    def etag(self, pdf_filepath: str, page: int, size: str, fmt: str) -> str:
+        """The ETag of a variant, from the PDF's signature alone. Raises FileNotFoundError."""
+        return image_etag(pdf_filepath, pdf_signature(pdf_filepath), page, size, fmt)
+
+    def get(self, pdf_filepath: str, page: int, size: str = "full", fmt: str = "png") -> PageImage:
+        """
+        The page (0-based) image, from memory, disk or rendered. Raises FileNotFoundError for a missing PDF,
+        IndexError for a missing page and KeyError for an unknown size or format.
+        """
+        if size not in SIZES:
+            raise KeyError(f"unknown size: {size}")
+        mimetype = FORMATS[fmt]
+        etag = self.etag(pdf_filepath, page, size, fmt)
+        data = self.memory.get(etag, RENDER_VERSION)
+        if data is None:
+            data = self._read_disk(etag)
+            if data is not None:
+                self.disk_hits += 1
+            else:
+                start = time.perf_counter()
+                data = render_image(pdf_filepath, page, size, fmt)
+                self.render_seconds += time.perf_counter() - start
+                self.renders += 1
+                self._write_disk(etag, data)
+            self.memory.put(etag, RENDER_VERSION, data, len(data))
+        return PageImage(data, mimetype, etag)
+
+    def stats(self) -> Dict[str, object]:
+        return {"memory": self.memory.stats(), "disk_hits": self.disk_hits, "disk_bytes": self._disk_bytes,
+                "disk_evictions": self.disk_evictions, "renders": self.renders,
+                "render_seconds": round(self.render_seconds, 3)}
+
+
+def main(cache_dir: str = CACHE_DIR):
+    cache = PageImageCache(cache_dir)
+    sizes = [entry.stat().st_size for entry in cache._disk_files()]
+    print({"cache_dir": cache_dir, "images": len(sizes), "bytes": sum(sizes)})
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,182 @@
+"""
+Clean-up of rendered pages before OCR: grayscale, binarization, deskew and border crop, at a resolution chosen
+per engine, and compact encodings for uploading pages to Gemini. Everything works on whole NumPy arrays
+through OpenCV, which releases the GIL, so it runs inside the OCR worker processes and dispatcher threads.
+
+The profiles are measured against unprocessed pages by benchmarks/preprocess.py.
+"""
+import io
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+WHITE = 255
+MAX_SKEW_DEGREES = 10.0  # larger estimates are more likely tables or pictures than a skewed scan
+MIN_SKEW_DEGREES = 0.1
+SKEW_STEP = 0.5  # coarse search step, refined to MIN_SKEW_DEGREES around the best
+SKEW_SAMPLE_POINTS = 20_000  # ink pixels used to estimate the skew
+BORDER_FILL = 0.5  # edge rows/columns darker than this share are scanner border, not page
+CROP_MARGIN = 0.01  # white margin kept around the content, as a share of the page size
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    How to prepare a page for one engine. dpi is the resolution it is rendered (or resized) to; binarize is
+    None, "otsu" or "adaptive"; upload is the encoding sent to an API: "png", "png1" (1-bit PNG), "jpeg" or
+    "webp", at quality for the lossy ones.
+    """
+    dpi: int = 72
+    grayscale: bool = True
+    binarize: Optional[str] = None
+    deskew: bool = True
+    crop: bool = True
+    upload: str = "png"
+    quality: int = 80
+
+
+# tesseract reads binarized text well from ~200 dpi; easyocr's detector works on grayscale and downsizes
+# large pages itself; Gemini reads small text fine at 150 dpi, and pays for every uploaded byte
+PROFILES = {
+    "tesseract": Profile(dpi=200, binarize="otsu"),
+    "easyocr": Profile(dpi=150),
+    "gemini": Profile(dpi=150, upload="webp", quality=60),
+}
+
+
+def to_grayscale(array: np.ndarray) -> np.ndarray:
+    if array.ndim == 2:
+        return array
+    if array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_RGBA2GRAY)
+    if array.shape[2] == 1:
+        return array[:, :, 0]
+    return cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+
+
+def binarize(gray: np.ndarray, method: str = "otsu") -> np.ndarray:
+    """Black text on white, as 0/255. "adaptive" copes with uneven lighting, "otsu" is faster."""
+    if method == "otsu":
+        return cv2.threshold(gray, 0, WHITE, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    if method == "adaptive":
+        block = max(gray.shape) // 50 | 1
+        return cv2.adaptiveThreshold(gray, WHITE, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block, 15)
+    raise ValueError(f"unknown binarization: {method}")
+
+
+def _ink(gray: np.ndarray) -> np.ndarray:
+    """Boolean mask of the dark pixels."""
+    return gray < cv2.threshold(gray, 0, WHITE, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[0]
+
+
+def crop_border(gray: np.ndarray) -> np.ndarray:
+    """
+    Trims the dark scanner border off the edges, then the white margin around the content down to
+    CROP_MARGIN. A page without ink is returned as is.
+    """
+    ink = _ink(gray)
+    rows, columns = ink.mean(axis=1), ink.mean(axis=0)
+
+    def inside(fill: np.ndarray) -> Tuple[int, int]:
+        page = np.flatnonzero(fill <= BORDER_FILL)
+        return (int(page[0]), int(page[-1]) + 1) if len(page) else (0, len(fill))
+
+    top, bottom = inside(rows)
+    left, right = inside(columns)
+    content = ink[top:bottom, left:right]
+    filled_rows, filled_columns = np.flatnonzero(content.any(axis=1)), np.flatnonzero(content.any(axis=0))
+    if not len(filled_rows):
+        return gray
+    margin = int(max(gray.shape) * CROP_MARGIN)
+    top, bottom = max(top + filled_rows[0] - margin, 0), min(top + filled_rows[-1] + 1 + margin, gray.shape[0])
+    left, right = max(left + filled_columns[0] - margin, 0), min(left + filled_columns[-1] + 1 + margin,
+                                                                 gray.shape[1])
+    return gray[top:bottom, left:right]
+
+
+def skew_angle(gray: np.ndarray) -> float:
+    """
+    Degrees the text lines are rotated by (counter-clockwise, as cv2.getRotationMatrix2D), 0 if unsure: the
+    angle at which the ink's row profile is sharpest, i.e. lines and the gaps between them line up.
+    """
+    ys, xs = np.nonzero(_ink(gray))
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > SKEW_SAMPLE_POINTS:
+        sample = np.random.default_rng(0).choice(len(ys), SKEW_SAMPLE_POINTS, replace=False)
+        ys, xs = ys[sample], xs[sample]
+    xs = xs - gray.shape[1] / 2
+    ys = ys - gray.shape[0] / 2
+
+    def sharpness(angles: np.ndarray) -> np.ndarray:
+        radians = np.deg2rad(angles)[:, None]
+        # row of every ink pixel once the page is rotated back by the candidate angle
+        rows = np.floor(np.sin(radians) * xs + np.cos(radians) * ys).astype(np.int64)
+        rows -= rows.min(axis=1, keepdims=True)
+        width = int(rows.max()) + 1
+        counts = np.bincount((rows + np.arange(len(angles))[:, None] * width).ravel(),
+                             minlength=len(angles) * width)
+        return (counts.astype(np.float64) ** 2).reshape(len(angles), width).sum(axis=1)
+
+    coarse = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP, SKEW_STEP)
+    best = coarse[np.argmax(sharpness(coarse))]
+    fine = best + np.arange(-SKEW_STEP, SKEW_STEP + MIN_SKEW_DEGREES / 2, MIN_SKEW_DEGREES)
+    angle = float(fine[np.argmax(sharpness(fine))])
+    return angle if MIN_SKEW_DEGREES <= abs(angle) < MAX_SKEW_DEGREES else 0.0
+
+
+def deskew(gray: np.ndarray) -> np.ndarray:
+    angle = skew_angle(gray)
+    if not angle:
+        return gray
+    height, width = gray.shape
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), -angle, 1.0)
+    return cv2.warpAffine(gray, rotation, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT,
+                          borderValue=WHITE)
+
+
+def prepare(array: np.ndarray, profile: Profile, source_dpi: Optional[int] = None) -> np.ndarray:
+    """
+    The page as the engine should see it. array is a rendered page, (height, width[, channels]) uint8, at
+    source_dpi (profile.dpi if not given), resized to profile.dpi. The result is a new array.
+    """
+    image = to_grayscale(array) if profile.grayscale else array
+    if source_dpi and source_dpi != profile.dpi:
+        scale = profile.dpi / source_dpi
+        image = cv2.resize(image, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    if profile.grayscale and profile.crop:
+        image = crop_border(image)
+    if profile.grayscale and profile.deskew:
+        image = deskew(image)
+    if profile.grayscale and profile.binarize:
+        image = binarize(image, profile.binarize)
+    return np.ascontiguousarray(image)
+
+
+def encode(array: np.ndarray, profile: Profile) -> Tuple[bytes, str]:
+    """The prepared page in the profile's upload encoding, and its MIME type."""
+    if profile.upload == "png1":
+        buffer = io.BytesIO()
+        Image.fromarray(array).convert("1").save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+    if array.ndim == 3:
+        array = cv2.cvtColor(array, cv2.COLOR_RGB2BGR)  # OpenCV encodes BGR
+    if profile.upload == "png":
+        ok, data = cv2.imencode(".png", array)
+        mime_type = "image/png"
+    elif profile.upload == "jpeg":
+        ok, data = cv2.imencode(".jpg", array, [cv2.IMWRITE_JPEG_QUALITY, profile.quality])
+        mime_type = "image/jpeg"
+    elif profile.upload == "webp":
+        ok, data = cv2.imencode(".webp", array, [cv2.IMWRITE_WEBP_QUALITY, profile.quality])
+        mime_type = "image/webp"
+    else:
+        raise ValueError(f"unknown upload encoding: {profile.upload}")
+    if not ok:
+        raise ValueError(f"could not encode the page as {profile.upload}")
+    return data.tobytes(), mime_type
+
@@ -0,0 +1,70 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import pymupdf
+from PIL import Image
+
+
+def render_page(page: pymupdf.Page, dpi: Optional[int] = None) -> pymupdf.Pixmap:
+    """Renders a page without alpha, at PyMuPDF's default resolution unless dpi is given."""
+    if dpi:
+        return page.get_pixmap(dpi=dpi)
+    return page.get_pixmap()
+
+
+def pixmap_to_array(pix: pymupdf.Pixmap) -> np.ndarray:
+    """
+    A (height, width, channels) uint8 view of the pixmap's sample buffer, without copying or encoding.
+    The array is only valid while pix is alive.
+    """
+    array = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    if pix.stride != pix.width * pix.n:
+        return array.reshape(pix.height, pix.stride)[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    return array.reshape(pix.height, pix.width, pix.n)
+
+
+def pixmap_to_image(pix: pymupdf.Pixmap) -> Image.Image:
+    """A PIL image sharing the pixmap's sample buffer. The image is only valid while pix is alive."""
+    mode = {1: "L", 3: "RGB", 4: "RGBA"}[pix.n]
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+
+
+class ImageSaver:
+    """
+    Writes rendered pages to disk on a background thread so the OCR loop does not wait for PNG encoding.
+    Call close() (or use it as a context manager) to wait for pending writes.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-saver")
+        self._pending: List[Future] = []
+
+    @staticmethod
+    def _save(pix: pymupdf.Pixmap, filepath: str):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        tmp_filepath = f"{filepath}.tmp.png"
+        pix.save(tmp_filepath)
+        # rename so the viewer never serves a half-written image
+        os.replace(tmp_filepath, filepath)
+
+    def save(self, pix: pymupdf.Pixmap, filepath: str) -> Future:
+        for f in self._pending:
+            if f.done():
+                f.result()  # surface write errors
+        self._pending = [f for f in self._pending if not f.done()]
+        future = self._executor.submit(self._save, pix, filepath)
+        self._pending.append(future)
+        return future
+
+    def close(self):
+        for future in self._pending:
+            future.result()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
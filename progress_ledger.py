@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# (relative_path, filename, page)
+PageKey = Tuple[str, str, int]
+
+DONE = "done"
+ERROR = "error"
+
+DEFAULT_LEDGER_FILEPATH = os.path.join("text_cleaned", "progress.sqlite")
+
+
+def page_key(relative_path, filename, page) -> PageKey:
+    return str(relative_path), str(filename), int(page)
+
+
+class ProgressLedger:
+    """
+    Per-page processing state shared by gemini_ocr.py and cleanup_text.py, keyed on
+    (relative_path, filename, page, stage) in a small SQLite table.
+
+    The done keys of a stage are loaded into a set once, so is_done() is a constant-time lookup however
+    many pages have been processed. Each mark_*() call is its own transaction, so a crash loses at most
+    the page being written.
+    """
+
+    def __init__(self, filepath: str = DEFAULT_LEDGER_FILEPATH):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS progress (
+                relative_path TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (relative_path, filename, page, stage)
+            ) WITHOUT ROWID""")
+        self._lock = threading.Lock()
+        self._done: Dict[str, Set[PageKey]] = {}
+
+    def _done_keys(self, stage: str) -> Set[PageKey]:
+        done = self._done.get(stage)
+        if done is None:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT relative_path, filename, page FROM progress WHERE stage = ? AND status = ?",
+                    (stage, DONE)).fetchall()
+            done = self._done[stage] = {(r, f, int(p)) for r, f, p in rows}
+        return done
+
+    def is_done(self, key: PageKey, stage: str) -> bool:
+        return key in self._done_keys(stage)
+
+    def count(self, stage: str, status: Optional[str] = None) -> int:
+        with self._lock:
+            if status is None:
+                query, args = "SELECT COUNT(*) FROM progress WHERE stage = ?", (stage,)
+            else:
+                query, args = "SELECT COUNT(*) FROM progress WHERE stage = ? AND status = ?", (stage, status)
+            return self._conn.execute(query, args).fetchone()[0]
+
+    def _mark(self, keys: Iterable[PageKey], stage: str, status: str, error: Optional[str]):
+        now = time.time()
+        rows = [(*key, stage, status, error, now) for key in keys]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        done = self._done_keys(stage)
+        for row in rows:
+            if status == DONE:
+                done.add(row[:3])
+            else:
+                done.discard(row[:3])
+
+    def mark_done(self, key: PageKey, stage: str):
+        self._mark([key], stage, DONE, None)
+
+    def mark_error(self, key: PageKey, stage: str, error: str):
+        self._mark([key], stage, ERROR, error)
+
+    def seed(self, keys: Iterable[PageKey], stage: str):
+        """Records keys as done in one transaction, e.g. to carry over progress kept in an existing output CSV."""
+        self._mark(keys, stage, DONE, None)
+
+    def seed_from_frame(self, frame, stage: str) -> int:
+        """seed() from the relative_path / filename / page columns of a DataFrame, once per stage."""
+        if self.count(stage) or frame.empty:
+            return 0
+        keys = {page_key(r, f, p) for r, f, p in zip(frame["relative_path"], frame["filename"], frame["page"])}
+        self.seed(keys, stage)
+        return len(keys)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,24 +1,21 @@
-import os
 from datetime import datetime
 from os import path, walk
 from typing import Tuple, List
 
-import easyocr
-import numpy as np
-import pandas as pd
-import pymupdf
-import pytesseract
-from PIL import Image
 
+# folders under the pdf root that are never ingested
+EXCLUDED_FOLDERS = ["กองคลัง"]
 
-def traverse_folder(root_folder) -> List[Tuple[str, str]]:
+
+def traverse_folder(root_folder, excluded_folders=EXCLUDED_FOLDERS) -> List[Tuple[str, str]]:
     file_list = []
 
     for folder_name, sub_folders, filenames in walk(root_folder):
-        if folder_name.startswith("pdf\\กองคลัง"):
-            continue
+        relative_path = str(path.relpath(folder_name, root_folder))
+        if relative_path == ".":
+            # prune excluded top-level folders instead of walking them
+            sub_folders[:] = [f for f in sub_folders if f not in excluded_folders]
         for f in filenames:
-            relative_path = str(path.relpath(folder_name, root_folder))
             file_list.append((relative_path, f))
 
     return file_list
@@ -29,45 +26,39 @@ def pdf_to_text(root_dir="pdf",
                 output_filename="text/summary",
                 ocr_engine="tesseract",
                 language_option="tha+eng",
-                img_dir="img"):
-    pytesseract.pytesseract.tesseract_cmd = pytesseract_exe
-    if language_option == "tha+eng":
-        reader = easyocr.Reader(['th', 'en'])
-    else:
-        reader = easyocr.Reader(['th'])
-    files = traverse_folder(root_dir)
-    data = []
+                img_dir="img",
+                workers=1,
+                in_memory=False,
+                save_images=True,
+                conditions=None,
+                preprocess=False):
+    """
+    OCRs the pages of new or changed PDFs under root_dir into {output_filename}_{ocr_engine}_{language_option}.csv,
+    removing the rows of changed and deleted PDFs, as recorded in the ingest manifest (see ocr_pipeline.py).
 
-    for rel_path, filename in files:
-        if not os.path.exists(os.path.join(img_dir, rel_path)):
-            os.makedirs(os.path.join(img_dir, rel_path))
-        with pymupdf.open(path.join("pdf", rel_path, filename)) as doc:  # open a document
-            for i, page in enumerate(doc):
-                image_filepath = path.join("img", "pdf", rel_path, f"{filename}_{i + 1:03}.png")
-                if os.path.exists(image_filepath):
-                    print("skipped", filename, i + 1)
-                else:
-                    pix = page.get_pixmap()  # render page to an image
-                    pix.save(image_filepath)
-                    print(filename, i + 1)
-                img_obj = Image.open(image_filepath)
-                if ocr_engine == "tesseract":
-                    s = pytesseract.image_to_string(img_obj, lang=language_option)
-                else:
-                    s = " ".join(reader.readtext(np.array(img_obj), detail=0, paragraph=True))
-                data.append([filename, rel_path, i, s])
+    By default each page is rendered to img/ as PNG and read back for OCR. With in_memory the rendered
+    pixmap is handed to the OCR engine directly and, if save_images, written to img/ in the background
+    for the viewer.
 
-    df = pd.DataFrame(data, columns=["filename", "relative_path", "page", "text"])
-    df.to_csv(f"{output_filename}_{ocr_engine}_{language_option}.csv")
-    print("done")
+    conditions, a list of (ocr_engine, language_option), produces all of those outputs in one pass that
+    renders every page once.
 
+    preprocess gives each engine the page grayscaled, cropped, deskewed and, for tesseract, binarized, at a
+    resolution chosen per engine (see page_preprocess.py).
+    """
+    from ocr_pipeline import run_pipeline
+    run_pipeline(root_dir=root_dir, pytesseract_exe=pytesseract_exe, output_filename=output_filename,
+                 ocr_engine=ocr_engine, language_option=language_option, img_dir=img_dir, workers=workers or 1,
+                 in_memory=in_memory, save_images=save_images, conditions=conditions, preprocess=preprocess)
 
-if __name__ == "__main__":
-    start = datetime.now()
-    pdf_to_text(language_option="tha")
-    finish = datetime.now()
-    print(start, finish, finish - start)
+
+def main():
+    # both language options in a single pass, rendering every page once
     start = datetime.now()
-    pdf_to_text(language_option="tha+eng")
+    pdf_to_text(conditions=[("tesseract", "tha"), ("tesseract", "tha+eng")])
     finish = datetime.now()
     print(start, finish, finish - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Results of OCR and LLM calls keyed by a hash of what they were computed from, so repeated pages (letterheads,
+standard forms, re-scanned copies) are only paid for once, across documents, runs and tools.
+
+OCR results are keyed by the rendered page's pixels plus the engine, language and model; LLM cleanup results
+by the prompt. Entries are evicted least recently used first once the cache grows past max_bytes.
+
+    python result_cache.py [text/result_cache.sqlite]
+
+prints what the cache holds and what it has saved.
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+RESULT_CACHE_FILENAME = "result_cache.sqlite"
+DEFAULT_MAX_BYTES = 1 << 30
+EVICT_CHECK_PUTS = 100  # puts between checks of the total size
+EVICT_TO = 0.9  # eviction frees space down to this share of max_bytes
+
+OCR = "ocr"
+LLM = "llm"
+
+
+def cache_location(output_filename: str) -> str:
+    """Beside the outputs, e.g. text/summary -> text/result_cache.sqlite"""
+    return os.path.join(os.path.dirname(output_filename), RESULT_CACHE_FILENAME)
+
+
+def image_digest(img: Image.Image) -> str:
+    """Hash of an image's decoded pixels, the same whether it was rendered in memory or read back from PNG."""
+    digest = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """Hash of the inputs of a computation, e.g. cache_key(image_digest(img), "tesseract", "tha+eng")."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    The cached results, in SQLite. Every entry keeps the seconds its computation took and how often it was
+    reused, so the cache can report the calls and seconds it saved over its lifetime; lookups and hits of this
+    process are counted separately for the hit rate. Safe to share between threads and processes.
+    """
+
+    def __init__(self, filepath: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        # pool workers write concurrently, wait for each other's short transactions instead of failing
+        self._conn = sqlite3.connect(filepath, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                cost_seconds REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+        self._lock = threading.Lock()
+        self._puts = 0
+        # per namespace: lookups, hits, seconds saved, in this process
+        self.session: Dict[str, Dict[str, float]] = {}
+
+    def _count(self, namespace: str, hit: bool, saved_seconds: float = 0.0):
+        counts = self.session.setdefault(namespace, {"lookups": 0, "hits": 0, "saved_seconds": 0.0})
+        counts["lookups"] += 1
+        counts["hits"] += int(hit)
+        counts["saved_seconds"] += saved_seconds
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        found = self.lookup(namespace, key)
+        return found[0] if found is not None else None
+
+    def lookup(self, namespace: str, key: str) -> Optional[Tuple[str, float]]:
+        """The cached value and the seconds its computation took, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, cost_seconds FROM results WHERE namespace = ? AND key = ?",
+                                     (namespace, key)).fetchone()
+            if row is None:
+                self._count(namespace, False)
+                return None
+            self._conn.execute("UPDATE results SET hits = hits + 1, used_at = ? WHERE namespace = ? AND key = ?",
+                               (time.time(), namespace, key))
+            self._count(namespace, True, row[1])
+            return row
+
+    def put(self, namespace: str, key: str, value: str, cost_seconds: float = 0.0):
+        nbytes = len(value.encode("utf-8")) + len(key)
+        if nbytes > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results (namespace, key, value, nbytes, cost_seconds, "
+                               "created_at, used_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (namespace, key, value, nbytes, cost_seconds, now, now))
+            self._puts += 1
+            if self._puts % EVICT_CHECK_PUTS == 0:
+                self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * EVICT_TO)
+        victims, freed = [], 0
+        for namespace, key, nbytes in self._conn.execute(
+                "SELECT namespace, key, nbytes FROM results ORDER BY used_at"):
+            victims.append((namespace, key))
+            freed += nbytes
+            if freed >= excess:
+                break
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany("DELETE FROM results WHERE namespace = ? AND key = ?", victims)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def evict(self):
+        """Shrinks the cache to within max_bytes now, instead of at the next periodic check."""
+        with self._lock:
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT namespace, COUNT(*), SUM(nbytes), SUM(hits), SUM(hits * cost_seconds) "
+                "FROM results GROUP BY namespace").fetchall()
+        stats = {}
+        for namespace, entries, nbytes, hits, saved_seconds in rows:
+            stats[namespace] = {"entries": entries, "bytes": nbytes, "reused": hits,
+                                "saved_seconds": round(saved_seconds, 1)}
+        for namespace, counts in self.session.items():
+            lookups = counts["lookups"]
+            stats.setdefault(namespace, {})["session"] = {
+                "lookups": lookups, "hits": counts["hits"],
+                "hit_ratio": round(counts["hits"] / lookups, 4) if lookups else None,
+                "saved_seconds": round(counts["saved_seconds"], 1)}
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(filepath: Optional[str] = None):
+    with ResultCache(filepath or cache_location("text/summary")) as cache:
+        print(cache.stats())
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,243 @@
+"""
+Buffered, crash-safe appends of per-page results, shared by the OCR and cleanup stages.
+
+Rows are buffered and written in one go once max_rows are pending or max_seconds have passed, on close(), at
+interpreter exit and on SIGTERM, so memory stays bounded however large the corpus is.
+
+CSV targets keep a <file>.committed sidecar with the byte length of the last complete flush; reopening a file
+truncates anything past it, so a crash mid-write never leaves a torn row behind. Arrow targets write every
+flush as a new part file in a <name>.parts/ directory, renamed into place once complete.
+"""
+import atexit
+import csv
+import io
+import os
+import signal
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Union
+
+import pandas as pd
+
+CSV = "csv"
+ARROW = "arrow"
+
+Row = Union[Mapping[str, Any], Sequence[Any]]
+
+_open_sinks: "weakref.WeakSet[ResultSink]" = weakref.WeakSet()
+_signals_installed = False
+
+
+def _flush_all():
+    for sink in list(_open_sinks):
+        try:
+            sink.flush()
+        except Exception as e:
+            print(f"could not flush {sink.filepath}: {e}")
+
+
+def _on_signal(signum, frame):
+    _flush_all()
+    # leave through SystemExit so context managers and finally blocks still run
+    raise SystemExit(128 + signum)
+
+
+def _install_signal_handlers():
+    global _signals_installed
+    if _signals_installed or threading.current_thread() is not threading.main_thread():
+        return
+    _signals_installed = True
+    atexit.register(_flush_all)
+    for name in ("SIGTERM", "SIGHUP"):
+        signum = getattr(signal, name, None)
+        if signum is not None and signal.getsignal(signum) == signal.SIG_DFL:
+            signal.signal(signum, _on_signal)
+
+
+def committed_location(filepath: str) -> str:
+    return f"{filepath}.committed"
+
+
+def drop_incomplete_rows(filepath: str) -> int:
+    """Truncates a CSV target to its last complete flush, if a sidecar records one. Returns the bytes dropped."""
+    committed_filepath = committed_location(filepath)
+    if not os.path.exists(filepath) or not os.path.exists(committed_filepath):
+        return 0
+    with open(committed_filepath) as f:
+        committed = int(f.read().strip() or 0)
+    size = os.path.getsize(filepath)
+    if size <= committed:
+        return 0
+    print(f"dropping {size - committed} bytes of incomplete rows from {filepath}")
+    with open(filepath, "r+b") as f:
+        f.truncate(committed)
+    return size - committed
+
+
+def record_committed(filepath: str, length: int):
+    committed_filepath = committed_location(filepath)
+    with open(f"{committed_filepath}.tmp", "w") as f:
+        f.write(str(length))
+    os.replace(f"{committed_filepath}.tmp", committed_filepath)
+
+
+def parts_location(filepath: str) -> str:
+    return f"{os.path.splitext(filepath)[0]}.parts"
+
+
+def read_parts(filepath: str) -> pd.DataFrame:
+    """Every row written to an Arrow sink so far, in write order."""
+    import pyarrow as pa
+
+    directory = parts_location(filepath)
+    names = sorted(f for f in os.listdir(directory) if f.endswith(".arrow")) if os.path.isdir(directory) else []
+    tables = [pa.ipc.open_file(pa.memory_map(os.path.join(directory, f), "r")).read_all() for f in names]
+    if not tables:
+        return pd.DataFrame()
+    return pa.concat_tables(tables, promote_options="default").to_pandas()
+
+
+class ResultSink:
+    """
+    Appends rows, given as dicts keyed by column or as sequences in column order, to filepath.
+
+    on_commit(rows) is called with the rows of each flush once they are on disk, e.g. to mark them done in the
+    progress ledger only when a crash can no longer lose them. With truncate the target starts out empty.
+    """
+
+    def __init__(self, filepath: str, columns: Sequence[str], fmt: str = CSV, max_rows: int = 64,
+                 max_seconds: float = 5.0, on_commit: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                 truncate: bool = False, fsync: bool = True):
+        if fmt not in (CSV, ARROW):
+            raise ValueError(f"unknown sink format {fmt}")
+        self.filepath = filepath
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.on_commit = on_commit
+        self.fsync = fsync
+        self.rows_written = 0
+        self.flushes = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.RLock()
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        if fmt == CSV:
+            self._open_csv(truncate)
+        else:
+            self._open_parts(truncate)
+
+        _open_sinks.add(self)
+        _install_signal_handlers()
+        self._stop = threading.Event()
+        self._timer = None
+        if max_seconds:
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True,
+                                           name=f"sink-{os.path.basename(filepath)}")
+            self._timer.start()
+
+    # --- targets ---
+
+    def _open_csv(self, truncate: bool):
+        if truncate or not os.path.exists(self.filepath):
+            self._file = open(self.filepath, "wb")
+        else:
+            drop_incomplete_rows(self.filepath)
+            self._file = open(self.filepath, "r+b")
+            self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._write_csv([dict(zip(self.columns, self.columns))])
+        else:
+            self._commit_offset()
+
+    def _write_csv(self, rows: List[Dict[str, Any]]):
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=self.columns, lineterminator="\n", extrasaction="ignore")
+        writer.writerows(rows)
+        self._file.write(text.getvalue().encode("utf-8"))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._commit_offset()
+
+    def _commit_offset(self):
+        record_committed(self.filepath, self._file.tell())
+
+    def _open_parts(self, truncate: bool):
+        self._parts_dir = parts_location(self.filepath)
+        os.makedirs(self._parts_dir, exist_ok=True)
+        for name in os.listdir(self._parts_dir):
+            if truncate or not name.endswith(".arrow"):
+                os.remove(os.path.join(self._parts_dir, name))  # leftovers of an interrupted flush
+        existing = [int(name.split("-")[1].split(".")[0]) for name in os.listdir(self._parts_dir)]
+        self._next_part = max(existing, default=-1) + 1
+
+    def _write_part(self, rows: List[Dict[str, Any]]):
+        import pyarrow as pa
+
+        table = pa.Table.from_pylist([{c: row.get(c) for c in self.columns} for row in rows])
+        part_filepath = os.path.join(self._parts_dir, f"part-{self._next_part:06}.arrow")
+        with pa.OSFile(f"{part_filepath}.tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(f"{part_filepath}.tmp", part_filepath)
+        self._next_part += 1
+
+    # --- buffering ---
+
+    def write(self, row: Row):
+        if not isinstance(row, Mapping):
+            row = dict(zip(self.columns, row))
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"{self.filepath} is closed")
+            self._buffer.append(dict(row))
+            if len(self._buffer) >= self.max_rows or time.monotonic() - self._last_flush >= self.max_seconds:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._buffer or self._closed:
+                return
+            rows, self._buffer = self._buffer, []
+            try:
+                if self.fmt == CSV:
+                    self._write_csv(rows)
+                else:
+                    self._write_part(rows)
+            except BaseException:
+                self._buffer = rows + self._buffer  # retried by the next flush
+                raise
+            self.rows_written += len(rows)
+            self.flushes += 1
+            if self.on_commit is not None:
+                self.on_commit(rows)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.max_seconds):
+            if time.monotonic() - self._last_flush >= self.max_seconds:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"could not flush {self.filepath}: {e}")
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            if self._closed:
+                return
+            self.flush()
+            self._closed = True
+            if self.fmt == CSV:
+                self._file.close()
+        _open_sinks.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
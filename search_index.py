@@ -0,0 +1,670 @@
+import json
+import math
+import os
+import sys
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from engine_registry import registry
+
+INDEX_FOLDER = "index"
+INDEX_VERSION = 4
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+THAI_TOKENIZER = "thai_tokenizer"
+
+
+def _load_tokenizer() -> Callable[..., List[str]]:
+    from pythainlp import tokenize
+    # the first call builds the dictionary trie, most of a cold start
+    tokenize.word_tokenize("ภาษาไทย")
+    return tokenize.word_tokenize
+
+
+registry.register(THAI_TOKENIZER, _load_tokenizer)
+
+
+def word_tokenize(text: str, keep_whitespace: bool = True) -> List[str]:
+    """PyThaiNLP's word_tokenize, loaded on first use."""
+    return registry.get(THAI_TOKENIZER)(text, keep_whitespace=keep_whitespace)
+
+
+def tokenize_text(text: str) -> List[str]:
+    return word_tokenize(text, keep_whitespace=False)
+
+
+def title_stem(filename: str) -> str:
+    """The filename without its extension, which would otherwise glue onto the last word ("...ประชุม.pdf" -> "ม.")."""
+    return os.path.splitext(filename)[0]
+
+
+def field_texts(field: str, values) -> Iterable[str]:
+    """The strings an index field is built from: the column's values, the file stems for the title tokens."""
+    values = values.astype(str)
+    return values.map(title_stem) if field == "title" else values
+
+
+def first_positions(text: str, tokens: List[str]) -> Dict[str, int]:
+    """Character offset of the first occurrence of each token, walking the tokens in text order."""
+    positions: Dict[str, int] = {}
+    cursor = 0
+    for token in tokens:
+        found = text.find(token, cursor)
+        if found < 0:
+            found = cursor  # the tokenizer normalized something, keep the running estimate
+        else:
+            cursor = found + len(token)
+        positions.setdefault(token, found)
+    return positions
+
+
+def index_location(corpus_filepath: str, field: str) -> str:
+    """index/ beside the corpus' folder, e.g. text/summary_x.csv, "text" -> index/summary_x.text.npz"""
+    corpus_dir, corpus_name = os.path.split(os.path.abspath(corpus_filepath))
+    return os.path.join(os.path.dirname(corpus_dir), INDEX_FOLDER, f"{os.path.splitext(corpus_name)[0]}.{field}.npz")
+
+
+class PostingSource:
+    """
+    Matching and BM25 scoring shared by the page-level index and its per-document grouping. Subclasses
+    provide n_rows, the per-row BM25 length norms and lookup_with_freqs().
+    """
+    n_rows: int
+    _norms: np.ndarray
+
+    def lookup_with_freqs(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def lookup(self, term: str) -> np.ndarray:
+        return self.lookup_with_freqs(term)[0]
+
+    def match_all(self, terms: Sequence[str]) -> np.ndarray:
+        """Sorted row ids containing every term. Whitespace-only terms are separators and are ignored."""
+        return match_all_fields([self], terms)
+
+    def _term_bm25(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """The rows containing term and its BM25 score in each of them."""
+        rows, freqs = self.lookup_with_freqs(term)
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+        idf = math.log(1 + (self.n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+        return rows, idf * freqs * (BM25_K1 + 1) / (freqs + self._norms[rows])
+
+    def bm25(self, terms: Sequence[str]) -> np.ndarray:
+        """Dense BM25 score of every row for the given terms, computed posting list by posting list."""
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for term in query_terms(terms):
+            rows, term_scores = self._term_bm25(term)
+            # rows are unique within a posting list, so fancy-index accumulation is safe
+            scores[rows] += term_scores
+        return scores
+
+    def bm25_groups(self, groups: Sequence[Sequence[Tuple[str, float]]]) -> np.ndarray:
+        """
+        BM25 where each query term is a group of weighted alternatives (e.g. its fuzzy expansions): a row scores
+        the best weighted alternative it contains of every group.
+        """
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for group in groups:
+            best = np.zeros(self.n_rows, dtype=np.float32)
+            for term, weight in group:
+                rows, term_scores = self._term_bm25(term)
+                best[rows] = np.maximum(best[rows], weight * term_scores)
+            scores += best
+        return scores
+
+
+def bm25_norms(lengths: np.ndarray) -> np.ndarray:
+    """The per-row part of the BM25 denominator: k1 * (1 - b + b * len / avg_len)"""
+    avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+    return (BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)).astype(np.float32)
+
+
+class InvertedIndex(PostingSource):
+    """
+    Token -> sorted row ids, stored CSR-style: the postings of vocab[term] are
+    postings[offsets[i]:offsets[i + 1]], freqs holds the term's count in each of those rows and positions the
+    character offset of its first occurrence there, for snippets. lengths is the token count of every row, for
+    BM25 length normalization.
+    """
+
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, postings: np.ndarray, freqs: np.ndarray,
+                 lengths: np.ndarray, positions: np.ndarray):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.postings = postings
+        self.freqs = freqs
+        self.lengths = lengths
+        self.positions = positions
+        self.n_rows = len(lengths)
+        self._norms = bm25_norms(lengths)
+        self._substring_cache: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._substring_terms: Dict[str, List[str]] = {}
+
+    @classmethod
+    def build(cls, texts: Iterable[str], tokenizer: Callable[[str], List[str]] = tokenize_text) -> "InvertedIndex":
+        lists: Dict[str, List[Tuple[int, int, int]]] = {}
+        # filenames repeat once per page, only tokenize them once
+        memo: Dict[str, Tuple[List[str], Dict[str, int]]] = {}
+        row_lengths = []
+        for row, text in enumerate(texts):
+            text = text if isinstance(text, str) else ""
+            if text not in memo:
+                tokens = tokenizer(text)
+                positions = first_positions(text, tokens)
+                if len(text) < 256:
+                    memo[text] = tokens, positions
+            else:
+                tokens, positions = memo[text]
+            row_lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                lists.setdefault(token, []).append((row, count, positions[token]))
+
+        terms = sorted(lists)
+        vocab = {term: i for i, term in enumerate(terms)}
+        df = np.fromiter((len(lists[t]) for t in terms), dtype=np.int64, count=len(terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+        total = int(offsets[-1])
+        postings = np.fromiter((row for t in terms for row, _, _ in lists[t]), dtype=np.int32, count=total)
+        freqs = np.fromiter((count for t in terms for _, count, _ in lists[t]), dtype=np.int32, count=total)
+        positions = np.fromiter((position for t in terms for _, _, position in lists[t]), dtype=np.int32,
+                                count=total)
+        return cls(vocab, offsets, postings, freqs, np.array(row_lengths, dtype=np.int32), positions)
+
+    def __len__(self):
+        return len(self.vocab)
+
+    @property
+    def nbytes(self) -> int:
+        return (self.offsets.nbytes + self.postings.nbytes + self.freqs.nbytes + self.lengths.nbytes
+                + self.positions.nbytes)
+
+    def term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        i = self.vocab.get(term)
+        if i is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        return self.postings[self.offsets[i]:self.offsets[i + 1]], self.freqs[self.offsets[i]:self.offsets[i + 1]]
+
+    def substring_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows having any token that contains term, for query terms that are not whole tokens in the corpus.
+        The frequency of a row is the summed count of those tokens.
+        """
+        cached = self._substring_cache.get(term)
+        if cached is None:
+            matches = [self.term_postings(v) for v in self.substring_terms(term)]
+            if matches:
+                rows, inverse = np.unique(np.concatenate([m[0] for m in matches]), return_inverse=True)
+                freqs = np.bincount(inverse, weights=np.concatenate([m[1] for m in matches])).astype(np.int32)
+                cached = rows.astype(np.int32), freqs
+            else:
+                cached = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+            if len(self._substring_cache) > 1024:
+                self._substring_cache.clear()
+            self._substring_cache[term] = cached
+        return cached
+
+    def substring_terms(self, term: str) -> List[str]:
+        """The vocabulary tokens containing term."""
+        tokens = self._substring_terms.get(term)
+        if tokens is None:
+            tokens = [v for v in self.vocab if term in v]
+            if len(self._substring_terms) > 1024:
+                self._substring_terms.clear()
+            self._substring_terms[term] = tokens
+        return tokens
+
+    def lookup_with_freqs(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        if term in self.vocab:
+            return self.term_postings(term)
+        return self.substring_postings(term)
+
+    def first_position(self, term: str, rows: np.ndarray) -> np.ndarray:
+        """
+        Character offset of the first occurrence of term in each of the given rows, -1 where it does not occur.
+        A term that is not a whole token is located through the tokens containing it.
+        """
+        found = np.full(len(rows), -1, dtype=np.int64)
+        tokens = [term] if term in self.vocab else self.substring_terms(term)
+        for token in tokens:
+            i = self.vocab[token]
+            posting = self.postings[self.offsets[i]:self.offsets[i + 1]]
+            at = np.minimum(np.searchsorted(posting, rows), max(len(posting) - 1, 0))
+            hit = posting[at] == rows if len(posting) else np.zeros(len(rows), dtype=bool)
+            position = self.positions[self.offsets[i] + at] + token.index(term)
+            better = hit & ((found < 0) | (position < found))
+            found[better] = position[better]
+        return found
+
+    def select_rows(self, keep: np.ndarray) -> "InvertedIndex":
+        """The index of the rows where the boolean mask keep is set, renumbered in order, without re-tokenizing."""
+        new_rows = (np.cumsum(keep) - 1).astype(np.int32)
+        term_ids = np.repeat(np.arange(len(self.vocab)), np.diff(self.offsets))
+        kept = keep[self.postings]
+        counts = np.bincount(term_ids[kept], minlength=len(self.vocab))
+        terms = sorted(self.vocab, key=self.vocab.get)
+        alive = np.flatnonzero(counts)
+        offsets = np.zeros(len(alive) + 1, dtype=np.int64)
+        np.cumsum(counts[alive], out=offsets[1:])
+        return InvertedIndex({terms[i]: n for n, i in enumerate(alive)}, offsets, new_rows[self.postings[kept]],
+                             self.freqs[kept], self.lengths[keep], self.positions[kept])
+
+    @classmethod
+    def concatenate(cls, first: "InvertedIndex", second: "InvertedIndex") -> "InvertedIndex":
+        """One index over the rows of first followed by the rows of second."""
+        terms = sorted(set(first.vocab) | set(second.vocab))
+        vocab = {term: i for i, term in enumerate(terms)}
+
+        def merged_term_ids(index):
+            ids = np.array([vocab[t] for t in sorted(index.vocab, key=index.vocab.get)], dtype=np.int64)
+            return np.repeat(ids, np.diff(index.offsets))
+
+        term_ids = np.concatenate([merged_term_ids(first), merged_term_ids(second)])
+        # a stable sort keeps the rows of first ahead of those of second, so every posting list stays sorted
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        postings = np.concatenate([first.postings, second.postings + np.int32(first.n_rows)])[order]
+        return cls(vocab, offsets, postings.astype(np.int32), np.concatenate([first.freqs, second.freqs])[order],
+                   np.concatenate([first.lengths, second.lengths]),
+                   np.concatenate([first.positions, second.positions])[order])
+
+    def save(self, filepath: str, signature: Optional[Sequence[int]] = None):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        terms = sorted(self.vocab, key=self.vocab.get)
+        tmp_filepath = f"{filepath}.tmp.npz"
+        np.savez(tmp_filepath,
+                 version=np.array([INDEX_VERSION]),
+                 signature=np.array(signature if signature is not None else [-1, -1], dtype=np.int64),
+                 vocab=np.frombuffer(json.dumps(terms, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                 offsets=self.offsets,
+                 postings=self.postings,
+                 freqs=self.freqs,
+                 lengths=self.lengths,
+                 positions=self.positions)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath: str, signature: Optional[Sequence[int]] = None) -> Optional["InvertedIndex"]:
+        """Returns None if the file is missing, from another index version or built from another corpus version."""
+        if not os.path.exists(filepath):
+            return None
+        with np.load(filepath) as data:
+            if int(data["version"][0]) != INDEX_VERSION:
+                return None
+            if signature is not None and tuple(data["signature"]) != tuple(signature):
+                return None
+            terms = json.loads(data["vocab"].tobytes().decode("utf-8"))
+            return cls({term: i for i, term in enumerate(terms)}, data["offsets"], data["postings"],
+                       data["freqs"], data["lengths"], data["positions"])
+
+
+TRIGRAM_PAD = "\0\0"
+TRIGRAM_BATCH_ROWS = 4096
+CODEPOINT_BITS = 21
+
+
+def _codepoints(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+
+def _trigram_keys(codes: np.ndarray) -> np.ndarray:
+    """Every run of three code points packed into one uint64, by start position."""
+    return (codes[:-2] << (2 * CODEPOINT_BITS)) | (codes[1:-1] << CODEPOINT_BITS) | codes[2:]
+
+
+class TrigramIndex:
+    """
+    Character trigram -> sorted row ids, for exact substring search that does not depend on word segmentation.
+    keys are the sorted trigrams packed into uint64 and the rows of keys[i] are postings[offsets[i]:offsets[i + 1]].
+    Every text is padded with two NULs, so one- and two-character queries at the end of a text are found too.
+    """
+
+    def __init__(self, keys: np.ndarray, offsets: np.ndarray, postings: np.ndarray, n_rows: int):
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+        self.n_rows = n_rows
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "TrigramIndex":
+        texts = [t if isinstance(t, str) else "" for t in texts]
+        pairs_keys, pairs_rows = [], []
+        for start in range(0, len(texts), TRIGRAM_BATCH_ROWS):
+            batch = [t + TRIGRAM_PAD for t in texts[start:start + TRIGRAM_BATCH_ROWS]]
+            codes = _codepoints("".join(batch))
+            rows = np.repeat(np.arange(start, start + len(batch), dtype=np.int32), [len(t) for t in batch])
+            keys = _trigram_keys(codes)
+            # trigrams starting in the padding run into the next text
+            within = rows[:-2] == rows[2:]
+            keys, rows = keys[within], rows[:-2][within]
+            order = np.lexsort((rows, keys))
+            keys, rows = keys[order], rows[order]
+            distinct = np.ones(len(keys), dtype=bool)
+            distinct[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+            pairs_keys.append(keys[distinct])
+            pairs_rows.append(rows[distinct])
+        keys = np.concatenate(pairs_keys) if pairs_keys else np.empty(0, dtype=np.uint64)
+        rows = np.concatenate(pairs_rows) if pairs_rows else np.empty(0, dtype=np.int32)
+        # batches are in row order, so a stable sort by trigram keeps every posting list sorted
+        order = np.argsort(keys, kind="stable")
+        return cls._from_pairs(keys[order], rows[order], len(texts))
+
+    @classmethod
+    def _from_pairs(cls, keys: np.ndarray, rows: np.ndarray, n_rows: int) -> "TrigramIndex":
+        unique, counts = np.unique(keys, return_counts=True)
+        offsets = np.zeros(len(unique) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(unique, offsets, rows.astype(np.int32), n_rows)
+
+    def _pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.repeat(self.keys, np.diff(self.offsets)), self.postings
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.offsets.nbytes + self.postings.nbytes
+
+    def _range(self, lo: int, hi: int) -> np.ndarray:
+        # uint64 bounds, a Python int list would be compared as float64 and lose the low bits
+        i, j = np.searchsorted(self.keys, np.array([lo, hi], dtype=np.uint64))
+        return self.postings[self.offsets[i]:self.offsets[j]]
+
+    def candidates(self, query: str) -> np.ndarray:
+        """Sorted rows that contain every trigram of query: a superset of the rows containing it."""
+        if not query:
+            return np.arange(self.n_rows, dtype=np.int32)
+        codes = _codepoints(query)
+        if len(codes) < 3:
+            # every trigram starting with the query, e.g. "ab" -> "ab?"
+            shift = CODEPOINT_BITS * (3 - len(codes))
+            prefix = 0
+            for code in codes:
+                prefix = (prefix << CODEPOINT_BITS) | int(code)
+            found = np.zeros(self.n_rows, dtype=bool)
+            found[self._range(prefix << shift, (prefix + 1) << shift)] = True
+            return np.flatnonzero(found).astype(np.int32)
+        postings = [self._range(int(key), int(key) + 1) for key in np.unique(_trigram_keys(codes))]
+        postings.sort(key=len)
+        result = postings[0]
+        for p in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, p, assume_unique=True)
+        return result
+
+    @staticmethod
+    def exact(query: str) -> bool:
+        """Whether candidates() of query are exactly the rows containing it: queries of up to three characters."""
+        return len(query) <= 3
+
+    def select_rows(self, keep: np.ndarray) -> "TrigramIndex":
+        """The index of the rows where the boolean mask keep is set, renumbered in order."""
+        keys, rows = self._pairs()
+        kept = keep[rows]
+        return self._from_pairs(keys[kept], (np.cumsum(keep) - 1)[rows[kept]], int(keep.sum()))
+
+    @classmethod
+    def concatenate(cls, first: "TrigramIndex", second: "TrigramIndex") -> "TrigramIndex":
+        """One index over the rows of first followed by the rows of second."""
+        first_keys, first_rows = first._pairs()
+        second_keys, second_rows = second._pairs()
+        keys = np.concatenate([first_keys, second_keys])
+        rows = np.concatenate([first_rows, second_rows + np.int32(first.n_rows)])
+        order = np.argsort(keys, kind="stable")
+        return cls._from_pairs(keys[order], rows[order], first.n_rows + second.n_rows)
+
+    def save(self, filepath: str, signature: Optional[Sequence[int]] = None):
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        tmp_filepath = f"{filepath}.tmp.npz"
+        np.savez(tmp_filepath,
+                 version=np.array([INDEX_VERSION]),
+                 signature=np.array(signature if signature is not None else [-1, -1], dtype=np.int64),
+                 n_rows=np.array([self.n_rows]),
+                 keys=self.keys,
+                 offsets=self.offsets,
+                 postings=self.postings)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath: str, signature: Optional[Sequence[int]] = None) -> Optional["TrigramIndex"]:
+        """Returns None if the file is missing, from another index version or built from another corpus version."""
+        if not os.path.exists(filepath):
+            return None
+        with np.load(filepath) as data:
+            if int(data["version"][0]) != INDEX_VERSION:
+                return None
+            if signature is not None and tuple(data["signature"]) != tuple(signature):
+                return None
+            return cls(data["keys"], data["offsets"], data["postings"], int(data["n_rows"][0]))
+
+
+class VerbatimIndex(PostingSource):
+    """
+    A field matched with the recall of the old `term in field` check: the rows of the tokens containing a term,
+    plus the rows whose raw value contains it anywhere else (inside a longer token, across token boundaries),
+    found through the field's trigrams and verified by contains(), with a frequency of 1.
+    """
+
+    def __init__(self, index: InvertedIndex, trigrams: TrigramIndex):
+        self.index = index
+        self.trigrams = trigrams
+        self.n_rows = index.n_rows
+        self.lengths = index.lengths
+        self._norms = index._norms
+        self._cache: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes
+
+    def contains(self, term: str, rows: np.ndarray) -> np.ndarray:
+        """Boolean mask of the given rows whose raw value contains term."""
+        raise NotImplementedError
+
+    def raw_rows(self, term: str) -> np.ndarray:
+        """Sorted rows whose raw value contains term verbatim."""
+        rows = self.trigrams.candidates(term)
+        if not len(rows) or self.trigrams.exact(term):
+            return rows
+        return rows[self.contains(term, rows)]
+
+    def lookup_with_freqs(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._cache.get(term)
+        if cached is None:
+            rows, freqs = self.index.lookup_with_freqs(term)
+            raw = self.raw_rows(term)
+            if len(np.setdiff1d(raw, rows, assume_unique=True)):
+                merged = np.union1d(rows, raw).astype(np.int32)
+                merged_freqs = np.ones(len(merged), dtype=np.int32)
+                merged_freqs[np.searchsorted(merged, rows)] = freqs
+                rows, freqs = merged, merged_freqs
+            cached = rows, freqs
+            if len(self._cache) > 1024:
+                self._cache.clear()
+            self._cache[term] = cached
+        return cached
+
+
+class TitleIndex(VerbatimIndex):
+    """The filename field: stem tokens, verified against the distinct filenames (names[codes[row]])."""
+
+    def __init__(self, index: InvertedIndex, trigrams: TrigramIndex, names: Sequence[str], codes: np.ndarray):
+        super().__init__(index, trigrams)
+        self.names = names
+        self.codes = codes
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + self.codes.nbytes
+
+    def contains(self, term: str, rows: np.ndarray) -> np.ndarray:
+        codes = self.codes[rows]
+        unique = np.unique(codes)
+        matching = unique[np.fromiter((term in self.names[c] for c in unique), dtype=bool, count=len(unique))]
+        return np.isin(codes, matching)
+
+
+class TextIndex(VerbatimIndex):
+    """The page text field, verified against the text column (a pandas Series) of the candidate rows only."""
+
+    def __init__(self, index: InvertedIndex, trigrams: TrigramIndex, texts):
+        super().__init__(index, trigrams)
+        self.texts = texts
+
+    def contains(self, term: str, rows: np.ndarray) -> np.ndarray:
+        return self.texts.iloc[rows].str.contains(term, regex=False, na=False).to_numpy(dtype=bool)
+
+    def first_position(self, term: str, rows: np.ndarray) -> np.ndarray:
+        """InvertedIndex.first_position(), with the rows the tokens do not locate term in searched directly."""
+        found = self.index.first_position(term, rows)
+        missing = np.flatnonzero(found < 0)
+        if len(missing):
+            texts = self.texts.iloc[rows[missing]].fillna("").astype(str)
+            found[missing] = [text.find(term) for text in texts]
+        return found
+
+
+class GroupedIndex(PostingSource):
+    """
+    A view of a page-level index where rows are groups of pages (documents). A group's term frequency
+    and length are the sum over its pages, or the max for fields repeated on every page such as the
+    filename, so matching and BM25 work per document without re-indexing joined text.
+    """
+
+    def __init__(self, index: Union[InvertedIndex, VerbatimIndex], groups: np.ndarray, n_groups: int,
+                 repeated: bool = False):
+        self.index = index
+        self.groups = groups
+        self.n_rows = n_groups
+        self.repeated = repeated
+        if repeated:
+            lengths = np.zeros(n_groups, dtype=np.int32)
+            np.maximum.at(lengths, groups, index.lengths)
+        else:
+            lengths = np.bincount(groups, weights=index.lengths, minlength=n_groups).astype(np.int32)
+        self.lengths = lengths
+        self._norms = bm25_norms(lengths)
+
+    def lookup_with_freqs(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        rows, freqs = self.index.lookup_with_freqs(term)
+        if self.repeated:
+            counts = np.zeros(self.n_rows, dtype=np.int32)
+            np.maximum.at(counts, self.groups[rows], freqs)
+        else:
+            counts = np.bincount(self.groups[rows], weights=freqs, minlength=self.n_rows).astype(np.int32)
+        found = np.flatnonzero(counts).astype(np.int32)
+        return found, counts[found]
+
+
+def query_terms(terms: Iterable[str]) -> List[str]:
+    """Distinct terms in query order, without the whitespace tokens word_tokenize keeps between words."""
+    return [t for t in dict.fromkeys(terms) if t.strip()]
+
+
+def match_all_fields(indexes: Sequence[PostingSource], terms: Sequence[str]) -> np.ndarray:
+    """Sorted row ids where every term occurs in at least one of the indexed fields (e.g. filename or text)."""
+    return match_groups(indexes, [[term] for term in query_terms(terms)])
+
+
+def match_groups(indexes: Sequence[PostingSource], groups: Sequence[Sequence[str]]) -> np.ndarray:
+    """Sorted row ids where, for every group of alternative terms, one of them occurs in one of the fields."""
+    if not groups:
+        return np.arange(indexes[0].n_rows, dtype=np.int32)
+    postings = []
+    for group in groups:
+        found = [index.lookup(term) for term in group for index in indexes]
+        postings.append(found[0] if len(found) == 1 else np.unique(np.concatenate(found)).astype(np.int32))
+    postings.sort(key=len)
+    result = postings[0]
+    for p in postings[1:]:
+        if not len(result):
+            break
+        result = np.intersect1d(result, p, assume_unique=True)
+    return result
+
+
+def top_k(scores: np.ndarray, rows: np.ndarray, offset: int, limit: int) -> np.ndarray:
+    """The rows ranked offset..offset+limit by descending score, without sorting every matched row."""
+    end = min(offset + limit, len(rows))
+    if offset >= end:
+        return rows[:0]
+    row_scores = scores[rows]
+    if end < len(rows):
+        best = np.argpartition(-row_scores, end - 1)[:end]
+    else:
+        best = np.arange(len(rows))
+    # ties keep row order so pages of the same document stay together
+    best = best[np.lexsort((rows[best], -row_scores[best]))]
+    return rows[best[offset:end]]
+
+
+def load_or_build(filepath: str, texts: Iterable[str], signature: Optional[Sequence[int]] = None,
+                  persist: bool = True, index_class=InvertedIndex):
+    index = index_class.load(filepath, signature)
+    if index is None:
+        index = index_class.build(texts)
+        if persist:
+            index.save(filepath, signature)
+    return index
+
+
+# (index file field, index class, corpus column) of every persisted index
+INDEXED_FIELDS = [("text", InvertedIndex, "text"), ("title", InvertedIndex, "filename"),
+                  ("text_trigrams", TrigramIndex, "text"), ("title_trigrams", TrigramIndex, "filename")]
+
+
+def update_indexes(corpus_filepath: str, previous_signature: Sequence[int], kept: Optional[np.ndarray]) -> bool:
+    """
+    Brings the persisted indexes of a corpus up to date after some of its previous rows were removed (kept is a
+    boolean mask over them, None if all were kept) and new rows appended, tokenizing only the appended rows.
+    Returns False if the persisted indexes were not built from previous_signature; they are then rebuilt in full
+    on next load.
+    """
+    from corpus_store import ensure_columnar, file_signature, load_corpus_frame
+
+    signature = file_signature(corpus_filepath)
+    ensure_columnar(corpus_filepath, signature)
+    frame = load_corpus_frame(corpus_filepath, ["filename", "text"])
+    updated = True
+    for field, index_class, column in INDEXED_FIELDS:
+        texts = field_texts(field, frame[column])
+        filepath = index_location(corpus_filepath, field)
+        index = index_class.load(filepath, previous_signature)
+        if index is None or (kept is not None and index.n_rows != len(kept)):
+            updated = False
+            continue
+        if kept is not None:
+            index = index.select_rows(kept)
+        appended = index_class.build(texts.iloc[index.n_rows:])
+        index_class.concatenate(index, appended).save(filepath, signature)
+    return updated
+
+
+def main(corpus_filepaths: List[str]):
+    """Builds and persists the indexes of the given corpora, by default every text/summary_*.csv and the cleaned docs."""
+    from corpus_store import file_signature, load_corpus_frame
+
+    if not corpus_filepaths:
+        corpus_filepaths = [os.path.join("text", f) for f in sorted(os.listdir("text"))
+                            if f.startswith("summary_") and f.endswith(".csv")]
+        cleaned = os.path.join("text_cleaned", "cleaned_consolidated_docs.csv")
+        if os.path.exists(cleaned):
+            corpus_filepaths.append(cleaned)
+
+    for corpus_filepath in corpus_filepaths:
+        signature = file_signature(corpus_filepath)
+        frame = load_corpus_frame(corpus_filepath)
+        for field, index_class, column in INDEXED_FIELDS:
+            index_class.build(field_texts(field, frame[column])).save(index_location(corpus_filepath, field),
+                                                                     signature)
+        print(corpus_filepath, len(frame), "rows")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
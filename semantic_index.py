@@ -0,0 +1,234 @@
+"""
+Page embeddings of the cleaned corpus (vector_context + clean_text) for /docsearch/semantic_search.
+
+The offline job embeds on CPU in batches and only re-embeds pages whose key is new or whose text changed since
+the last run. Vectors are stored L2-normalized as float16 in index/<corpus>.embeddings.npz:
+
+    python semantic_index.py [text_cleaned/cleaned_consolidated_docs.csv]
+
+Needs sentence-transformers (requirements_rag.txt); nothing is imported until an encoder is first used.
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import search_index
+from corpus_store import Corpus, Signature, file_signature, load_corpus_frame
+
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_VERSION = 1
+BATCH_SIZE = 64
+DEFAULT_CORPUS = os.path.join("text_cleaned", "cleaned_consolidated_docs.csv")
+
+# texts -> (len(texts), dim) array of L2-normalized vectors
+Encoder = Callable[[List[str]], np.ndarray]
+
+_encoders: Dict[str, Encoder] = {}
+_encoders_lock = threading.Lock()
+
+
+def sentence_encoder(model_name: str = EMBEDDING_MODEL) -> Encoder:
+    """A CPU sentence-transformers encoder, loaded once per process and model."""
+    with _encoders_lock:
+        if model_name not in _encoders:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(model_name, device="cpu")
+            _encoders[model_name] = lambda texts: model.encode(
+                texts, batch_size=BATCH_SIZE, normalize_embeddings=True, convert_to_numpy=True,
+                show_progress_bar=False)
+        return _encoders[model_name]
+
+
+def embeddings_location(corpus_filepath: str) -> str:
+    return search_index.index_location(corpus_filepath, "embeddings")
+
+
+def embedding_texts(frame: pd.DataFrame) -> List[str]:
+    """What gets embedded for each page: the "Type | Subject | Entities" line, then the page text."""
+    texts = frame["text"].fillna("").astype(str)
+    if "vector_context" in frame.columns:
+        texts = frame["vector_context"].fillna("").astype(str) + "\n" + texts
+    return [t.strip() for t in texts]
+
+
+def content_hashes(texts: List[str]) -> np.ndarray:
+    return np.array([int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little")
+                     for t in texts], dtype=np.uint64)
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _page_keys(frame: pd.DataFrame) -> List[Tuple[str, str, int]]:
+    return list(zip(frame["relative_path"].astype(str), frame["filename"].astype(str),
+                    frame["page"].astype(int)))
+
+
+def _load_npz(filepath: str, model_name: Optional[str] = None) -> Optional[dict]:
+    if not os.path.exists(filepath):
+        return None
+    with np.load(filepath, allow_pickle=False) as data:
+        stored = {name: data[name] for name in data.files}
+    if int(stored["version"]) != EMBEDDING_VERSION:
+        return None
+    if model_name is not None and str(stored["model"]) != model_name:
+        return None
+    return stored
+
+
+def build_embeddings(corpus_filepath: str = DEFAULT_CORPUS, encoder: Optional[Encoder] = None,
+                     model_name: str = EMBEDDING_MODEL, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Embeds the corpus, reusing the stored vector of every page whose key and text are unchanged, and writes
+    the matrix in corpus row order. Returns how many pages were reused and embedded.
+    """
+    start = time.perf_counter()
+    signature = file_signature(corpus_filepath)
+    frame = load_corpus_frame(corpus_filepath)
+    keys = _page_keys(frame)
+    texts = embedding_texts(frame)
+    hashes = content_hashes(texts)
+    filepath = embeddings_location(corpus_filepath)
+
+    previous = _load_npz(filepath, model_name)
+    reused: Dict[Tuple[str, str, int], int] = {}
+    if previous is not None:
+        old_keys = zip(previous["relative_path"].tolist(), previous["filename"].tolist(), previous["page"].tolist())
+        reused = {key: i for i, key in enumerate(old_keys)}
+
+    vectors: Optional[np.ndarray] = None
+    todo = []
+    for row, key in enumerate(keys):
+        old = reused.get(key)
+        if old is not None and previous["hashes"][old] == hashes[row]:
+            if vectors is None:
+                vectors = np.zeros((len(keys), previous["vectors"].shape[1]), dtype=np.float16)
+            vectors[row] = previous["vectors"][old]
+        elif texts[row]:
+            todo.append(row)
+
+    encoder = encoder or sentence_encoder(model_name)
+    for batch_start in range(0, len(todo), batch_size):
+        batch = todo[batch_start:batch_start + batch_size]
+        embedded = _normalized(encoder([texts[row] for row in batch])).astype(np.float16)
+        if vectors is None:
+            vectors = np.zeros((len(keys), embedded.shape[1]), dtype=np.float16)
+        vectors[batch] = embedded
+        print(f"embedded {batch_start + len(batch)}/{len(todo)}")
+    if vectors is None:
+        vectors = np.zeros((len(keys), 0), dtype=np.float16)
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.tmp.npz"
+    np.savez(tmp_filepath,
+             version=np.int64(EMBEDDING_VERSION),
+             model=np.array(model_name),
+             signature=np.array(signature, dtype=np.int64),
+             relative_path=np.array([k[0] for k in keys], dtype=str),
+             filename=np.array([k[1] for k in keys], dtype=str),
+             page=np.array([k[2] for k in keys], dtype=np.int32),
+             hashes=hashes,
+             # pages without any text keep a zero vector and are never returned
+             has_vector=np.array([bool(t) for t in texts]),
+             vectors=vectors)
+    os.replace(tmp_filepath, filepath)
+    return {"rows": len(keys), "embedded": len(todo), "reused": len(keys) - len(todo),
+            "seconds": round(time.perf_counter() - start, 3)}
+
+
+class EmbeddingIndex:
+    """
+    Page vectors aligned to the rows of a loaded corpus, held as float32 so a query is one BLAS
+    matrix-vector product. rows are the corpus rows that have a vector.
+    """
+
+    def __init__(self, vectors: np.ndarray, rows: np.ndarray, model_name: str):
+        self.vectors = vectors
+        self.rows = rows
+        self.model_name = model_name
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.vectors.nbytes + self.rows.nbytes)
+
+    @classmethod
+    def load(cls, filepath: str, corpus: Corpus) -> Optional["EmbeddingIndex"]:
+        stored = _load_npz(filepath)
+        if stored is None:
+            return None
+        n_rows = len(corpus.frame)
+        stored_vectors = stored["vectors"]
+        if tuple(stored["signature"].tolist()) == tuple(corpus.signature) and len(stored_vectors) == n_rows:
+            vectors = stored_vectors.astype(np.float32)
+            has_vector = stored["has_vector"]
+        else:
+            # the corpus changed since the last embedding run: match pages by key, newer pages have no vector yet
+            position = {key: i for i, key in enumerate(zip(stored["relative_path"].tolist(),
+                                                            stored["filename"].tolist(),
+                                                            stored["page"].tolist()))}
+            vectors = np.zeros((n_rows, stored_vectors.shape[1]), dtype=np.float32)
+            has_vector = np.zeros(n_rows, dtype=bool)
+            for row, key in enumerate(_page_keys(corpus.frame)):
+                i = position.get(key)
+                if i is not None and stored["has_vector"][i]:
+                    vectors[row] = stored_vectors[i]
+                    has_vector[row] = True
+        return cls(vectors, np.flatnonzero(has_vector).astype(np.int32), str(stored["model"]))
+
+    def similarity(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every corpus row to the (normalized) query; rows without a vector score 0."""
+        return self.vectors @ query_vector.astype(np.float32)
+
+
+class EmbeddingStore:
+    """
+    Embedding indexes per corpus, reloaded when either the corpus or its embeddings file changes, plus the
+    query encoder. encoder overrides the sentence-transformers model, e.g. for tests.
+    """
+
+    def __init__(self, encoder: Optional[Encoder] = None):
+        self.encoder = encoder
+        self._entries: Dict[str, Tuple[Tuple[Signature, Signature], EmbeddingIndex]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, corpus: Corpus) -> Optional[EmbeddingIndex]:
+        filepath = embeddings_location(corpus.filepath)
+        if not os.path.exists(filepath):
+            return None
+        version = (corpus.signature, file_signature(filepath))
+        entry = self._entries.get(corpus.filepath)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(corpus.filepath)
+            if entry is None or entry[0] != version:
+                entry = version, EmbeddingIndex.load(filepath, corpus)
+                self._entries[corpus.filepath] = entry
+            return entry[1]
+
+    def encode_query(self, query: str, model_name: str) -> np.ndarray:
+        encoder = self.encoder or sentence_encoder(model_name)
+        return _normalized(encoder([query]))[0]
+
+    def stats(self) -> dict:
+        return {path: {"rows": len(index.rows), "memory_bytes": index.nbytes, "model": index.model_name}
+                for path, (_, index) in dict(self._entries).items() if index is not None}
+
+
+def main(corpus_filepaths: List[str]):
+    for corpus_filepath in corpus_filepaths or [DEFAULT_CORPUS]:
+        print(corpus_filepath, build_embeddings(corpus_filepath))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])